@@ -3,6 +3,9 @@ import os
 import json
 import time
 import asyncio
+import select
+import socket
+import threading
 from http.server import BaseHTTPRequestHandler
 
 # Add the backend directory to the Python path before importing
@@ -10,8 +13,35 @@ backend_path = os.path.join(os.path.dirname(__file__), "..", "..", "backend")
 if backend_path not in sys.path:
     sys.path.insert(0, backend_path)
 
-from models import ChatRequest
-from llm_service import LLMService
+# models (pydantic) and llm_service (openai) are imported in do_POST so that
+# GET and OPTIONS requests on a cold instance do not pay for them
+from budget import RequestBudget
+from chat_pipeline import chat_pipeline
+from disconnect import RequestScope, current_scope, run_until_disconnect
+from answer_cache import AnswerCache, collection_hash
+
+# Kept for the lifetime of a warm instance
+answer_cache = AnswerCache()
+
+# One LLMService per warm instance, on an event loop of its own: its
+# scheduler fair-queues every concurrent request and its work queue
+# connections are reused instead of opened per request
+_instance_lock = threading.Lock()
+_llm_service = None
+_loop = None
+
+
+def _instance():
+    """The instance's LLMService and event loop, created on the first request"""
+    global _llm_service, _loop
+    with _instance_lock:
+        if _loop is None:
+            from llm_service import LLMService
+
+            _llm_service = LLMService()
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+    return _llm_service, _loop
 
 
 class handler(BaseHTTPRequestHandler):
@@ -27,25 +57,58 @@ class handler(BaseHTTPRequestHandler):
             self.send_header("Connection", "keep-alive")
             self.end_headers()
 
+            from models import ChatRequest
+
             # Read request body
             content_length = int(self.headers["Content-Length"])
             post_data = self.rfile.read(content_length)
-            request_data = json.loads(post_data.decode("utf-8"))
 
-            # Parse request using ChatRequest model
-            request = ChatRequest(**request_data)
+            # Parse and validate the JSON body in one pass in pydantic-core
+            request = ChatRequest.model_validate_json(post_data)
 
-            # Initialize LLM service
-            llm_service = LLMService()
+            llm_service, loop = _instance()
 
-            # Process the chat request and stream response
-            asyncio.run(self._process_chat_request(request, llm_service))
+            # Process the chat request and stream response, cancelling the
+            # whole task tree if the client goes away
+            scope = RequestScope(
+                flow=request.tenant,
+                weight=llm_service.scheduler.weight_for(request.tenant, request.collection),
+            )
+            asyncio.run_coroutine_threadsafe(
+                run_until_disconnect(
+                    self._process_chat_request(request, llm_service),
+                    self._client_disconnected,
+                    scope,
+                ),
+                loop,
+            ).result()
 
         except Exception as e:
             error_data = {"type": "error", "error": str(e)}
             self.wfile.write(f"data: {json.dumps(error_data)}\n\n".encode())
             print(f"❌ Error in chat handler: {str(e)}")
 
+    def _send(self, data: str):
+        """Write one SSE frame; a dead connection cancels the request"""
+        try:
+            self.wfile.write(data.encode())
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            scope = current_scope()
+            if scope:
+                scope.disconnected = True
+            raise asyncio.CancelledError()
+
+    async def _client_disconnected(self) -> bool:
+        """Whether the client closed its end (readable socket with no data)"""
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            if readable:
+                return self.connection.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+        return False
+
     async def _process_chat_request(self, request, llm_service):
         """Process chat request with streaming response"""
         start_time = time.time()
@@ -53,184 +116,34 @@ class handler(BaseHTTPRequestHandler):
         print(f"📝 Question: {request.question}")
         print(f"📊 Received {len(request.documents)} documents")
 
-        try:
-            total_cost = 0.0
-
-            # Convert DocumentData to the format expected by LLMService
-            documents_dict = []
-            for doc in request.documents:
-                pages_dict = []
-                for page in doc.pages:
-                    pages_dict.append(
-                        {"page_number": page.page_number, "text": page.text}
-                    )
-
-                documents_dict.append(
-                    {
-                        "id": doc.id,
-                        "filename": doc.filename,
-                        "pages": pages_dict,
-                        "total_pages": doc.total_pages,
-                    }
-                )
-
-            # Step 1: Select relevant documents
-            step1_start = time.time()
-            doc_selection_status = {
-                "type": "status",
-                "step": "document_selection",
-                "message": "Finding relevant documents...",
-                "step_number": 1,
-                "total_steps": 3,
-            }
-            data = f"data: {json.dumps(doc_selection_status)}\n\n"
-            self.wfile.write(data.encode())
-            self.wfile.flush()
-
-            print("⏱️ Step 1: Starting document selection...")
-            selected_docs, step1_cost = await llm_service.select_documents(
-                request.description,
-                documents_dict,
+        # Exact answer cache: replay the stored event sequence on a hit,
+        # record the pipeline's events otherwise
+        cache_key = None
+        cached = None
+        if answer_cache.enabled:
+            cache_key = answer_cache.key(
+                collection_hash(request.documents, request.description),
                 request.question,
                 request.chat_history,
+                f"{request.model}:{request.max_cost}:{request.max_latency_ms}",
             )
-            total_cost += step1_cost
-            step1_time = time.time() - step1_start
-            msg = f"✅ Step 1: Document selection completed in {step1_time:.2f}s"
-            print(msg)
-
-            # Send completion status for document selection
-            doc_selection_complete = {
-                "type": "step_complete",
-                "step": "document_selection",
-                "selected_documents": [
-                    {"id": doc["id"], "filename": doc["filename"]}
-                    for doc in selected_docs
-                ],
-                "cost": step1_cost,
-                "time_taken": step1_time,
-            }
-            data = f"data: {json.dumps(doc_selection_complete)}\n\n"
-            self.wfile.write(data.encode())
-            self.wfile.flush()
-
-            # Step 2: Find relevant pages
-            step2_start = time.time()
-            page_selection_status = {
-                "type": "status",
-                "step": "page_selection",
-                "message": "Finding relevant pages in selected documents...",
-                "step_number": 2,
-                "total_steps": 3,
-            }
-            data = f"data: {json.dumps(page_selection_status)}\n\n"
-            self.wfile.write(data.encode())
-            self.wfile.flush()
-
-            print("⏱️ Step 2: Starting page selection...")
-
-            async def process_document(doc):
-                return await llm_service.find_relevant_pages(
-                    doc["pages"],
-                    request.question,
-                    doc["filename"],
-                    request.chat_history,
-                )
-
-            # Create tasks for all documents
-            doc_tasks = [process_document(doc) for doc in selected_docs]
-
-            # Wait for all documents to complete
-            doc_results = await asyncio.gather(*doc_tasks)
-
-            # Combine results
-            all_relevant_pages = []
-            step2_cost = 0.0
-            for doc_relevant_pages, doc_cost in doc_results:
-                all_relevant_pages.extend(doc_relevant_pages)
-                step2_cost += doc_cost
-
-            relevant_pages = all_relevant_pages
-            total_cost += step2_cost
-            step2_time = time.time() - step2_start
-            msg = f"✅ Step 2: Page selection completed in {step2_time:.2f}s"
-            print(msg)
-
-            # Send completion status for page selection
-            page_selection_complete = {
-                "type": "step_complete",
-                "step": "page_selection",
-                "relevant_pages_count": len(relevant_pages),
-                "cost": step2_cost,
-                "time_taken": step2_time,
-            }
-            data = f"data: {json.dumps(page_selection_complete)}\n\n"
-            self.wfile.write(data.encode())
-            self.wfile.flush()
-
-            # Step 3: Generate answer
-            step3_start = time.time()
-            answer_generation_status = {
-                "type": "status",
-                "step": "answer_generation",
-                "message": "Generating comprehensive answer...",
-                "step_number": 3,
-                "total_steps": 3,
-            }
-            data = f"data: {json.dumps(answer_generation_status)}\n\n"
-            self.wfile.write(data.encode())
-            self.wfile.flush()
-
-            print("⏱️ Step 3: Starting answer generation...")
-
-            # Stream the answer generation
-            async for chunk in llm_service.generate_answer_stream(
-                relevant_pages, request.question, request.chat_history, request.model
-            ):
-                if chunk.get("type") == "content":
-                    content_data = {
-                        "type": "content",
-                        "content": chunk["content"],
-                    }
-                    data = f"data: {json.dumps(content_data)}\n\n"
-                    self.wfile.write(data.encode())
-                    self.wfile.flush()
-                elif chunk.get("type") == "cost":
-                    total_cost += chunk["cost"]
-
-            step3_time = time.time() - step3_start
-            msg = f"✅ Step 3: Answer generation completed in {step3_time:.2f}s"
-            print(msg)
-
-            # Send final completion
-            total_time = time.time() - start_time
-            completion_data = {
-                "type": "complete",
-                "timing_breakdown": {
-                    "document_selection": step1_time,
-                    "page_detection": step2_time,
-                    "answer_generation": step3_time,
-                    "total_time": total_time,
-                },
-                "cost_breakdown": {
-                    "document_selection": step1_cost,
-                    "page_detection": step2_cost,
-                    "answer_generation": total_cost - step1_cost - step2_cost,
-                    "total_cost": total_cost,
-                },
-            }
-            data = f"data: {json.dumps(completion_data)}\n\n"
-            self.wfile.write(data.encode())
-            self.wfile.flush()
-
-            cost_msg = f"🎉 Request completed in {total_time:.2f}s, total cost: ${total_cost:.4f}"
-            print(cost_msg)
-
-        except Exception as e:
-            error_data = {"type": "error", "error": str(e)}
-            data = f"data: {json.dumps(error_data)}\n\n"
-            self.wfile.write(data.encode())
-            print(f"❌ Error in stream_response: {str(e)}")
+            cached = answer_cache.get(cache_key)
+
+        if cached is not None:
+            print("♻️ Answer cache hit, replaying stored response")
+            events = answer_cache.replay(cached)
+        else:
+            budget = RequestBudget(
+                request.max_cost, request.max_latency_ms, llm_service.pricing
+            )
+            events = chat_pipeline(request, llm_service, budget, start_time=start_time)
+            if cache_key is not None:
+                events = answer_cache.record(cache_key, events)
+        try:
+            async for frame in events:
+                self._send(frame)
+        finally:
+            await events.aclose()
 
     def do_OPTIONS(self):
         # Handle CORS preflight
@@ -40,35 +40,49 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
 
 
-# Fallback for FastAPI compatibility (if needed for local development)
-try:
-    from main import app as fastapi_app
+def _fastapi_app():
+    """Build the FastAPI app for local development"""
+    try:
+        from main import app as fastapi_app
 
-    app = fastapi_app
-except ImportError:
-    from fastapi import FastAPI
-    from fastapi.middleware.cors import CORSMiddleware
+        return fastapi_app
+    except ImportError:
+        from fastapi import FastAPI
+        from fastapi.middleware.cors import CORSMiddleware
 
-    app = FastAPI()
+        fallback_app = FastAPI()
 
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],
-        allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
-    )
+        fallback_app.add_middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+        )
 
-    @app.get("/")
-    def read_root():
-        return {
-            "message": "PDF Chatbot API (FastAPI Fallback)",
-            "version": "1.0.0",
-            "note": "Using FastAPI fallback mode",
-            "endpoints": {
-                "upload": "/api/upload - POST - Upload PDF documents",
-                "chat": "/api/chat/stream - POST - Stream chat responses",
-                "health": "/api/health - GET - Health check",
-            },
-            "status": "fallback",
-        }
+        @fallback_app.get("/")
+        def read_root():
+            return {
+                "message": "PDF Chatbot API (FastAPI Fallback)",
+                "version": "1.0.0",
+                "note": "Using FastAPI fallback mode",
+                "endpoints": {
+                    "upload": "/api/upload - POST - Upload PDF documents",
+                    "chat": "/api/chat/stream - POST - Stream chat responses",
+                    "health": "/api/health - GET - Health check",
+                },
+                "status": "fallback",
+            }
+
+        return fallback_app
+
+
+def __getattr__(name):
+    # Fallback for FastAPI compatibility (if needed for local development).
+    # Resolved on first access so serving the static index above never pays
+    # for importing FastAPI, OpenAI and the backend.
+    if name == "app":
+        global app
+        app = _fastapi_app()
+        return app
+    raise AttributeError(name)
@@ -2,7 +2,6 @@ import sys
 import os
 import json
 import tempfile
-import cgi
 from http.server import BaseHTTPRequestHandler
 
 # Add the backend directory to the Python path before importing
@@ -10,9 +9,14 @@ backend_path = os.path.join(os.path.dirname(__file__), "..", "backend")
 if backend_path not in sys.path:
     sys.path.insert(0, backend_path)
 
-from models import UploadResponse, DocumentData, DocumentPage
-from pdf_processor import PDFProcessor
+# Spawning extraction workers would add to every cold start, and a crashed
+# page only takes down this short-lived instance: extract in-process unless
+# PDF_SANDBOX is set explicitly
+os.environ.setdefault("PDF_SANDBOX", "0")
 
+# models (pydantic), pdf_processor (PyPDF2) and cgi are imported in
+# _process_files so that GET and OPTIONS requests on a cold instance do not
+# pay for them
 # Vercel payload limit is 4.5MB for the entire request
 MAX_PAYLOAD_SIZE = 4.5 * 1024 * 1024  # 4.5MB in bytes
 MAX_FILE_SIZE = 4.5 * 1024 * 1024  # 4.5MB per individual file
@@ -150,6 +154,12 @@ class handler(BaseHTTPRequestHandler):
 
     def _process_files(self):
         """Process uploaded files"""
+        import cgi
+
+        from models import UploadResponse, DocumentData, DocumentPage
+        from pdf_processor import PDFProcessor
+        from dedup import find_duplicates
+
         # Parse the form data
         form = cgi.FieldStorage(
             fp=self.rfile,
@@ -183,7 +193,7 @@ class handler(BaseHTTPRequestHandler):
         pdf_processor = PDFProcessor()
 
         # Process files and extract text
-        documents = []
+        extracted = []
         total_processed_size = 0
 
         for i, file_item in enumerate(files):
@@ -215,22 +225,17 @@ class handler(BaseHTTPRequestHandler):
                 temp_file_path = temp_file.name
 
             try:
-                # Extract text from PDF
-                pages_data = pdf_processor.extract_pages(temp_file_path)
-
-                # Convert to DocumentPage objects
-                pages = [
-                    DocumentPage(page_number=page["page_number"], text=page["text"])
-                    for page in pages_data
-                ]
-
-                documents.append(
-                    DocumentData(
-                        id=i + 1,
-                        filename=file_item.filename,
-                        pages=pages,
-                        total_pages=len(pages),
-                    )
+                # Extract and normalize text from PDF
+                pages_data, stats = pdf_processor.extract_document(temp_file_path)
+
+                extracted.append(
+                    {
+                        "id": i + 1,
+                        "filename": file_item.filename,
+                        "pages": pages_data,
+                        "normalization": stats,
+                        "toc": pdf_processor.extract_toc(temp_file_path),
+                    }
                 )
             except Exception as e:
                 error_msg = f"Error processing {file_item.filename}: {str(e)}"
@@ -246,9 +251,38 @@ class handler(BaseHTTPRequestHandler):
                 except OSError:
                     pass
 
+        # Record near-duplicate pages and documents across the upload
+        duplicates = find_duplicates(extracted)
+        print(
+            f"Dedup: {duplicates['duplicate_pages']} duplicate pages, "
+            f"{duplicates['duplicate_documents']} duplicate documents"
+        )
+        documents = [
+            DocumentData(
+                id=doc["id"],
+                filename=doc["filename"],
+                pages=[
+                    DocumentPage(
+                        page_number=page["page_number"],
+                        text=page["text"],
+                        is_blank=page["is_blank"],
+                        duplicate_of=page["duplicate_of"],
+                        extraction_error=page.get("extraction_error"),
+                    )
+                    for page in doc["pages"]
+                ],
+                total_pages=len(doc["pages"]),
+                toc=doc["toc"] or None,
+                normalization=doc["normalization"],
+                duplicate_of=doc["duplicate_of"],
+            )
+            for doc in extracted
+        ]
+
         # Create response
         response = UploadResponse(
             documents=documents,
+            duplicates=duplicates,
             message=f"Successfully processed {len(files)} documents ({total_processed_size / 1024 / 1024:.1f}MB total)",
         )
 
@@ -34,6 +34,7 @@ interface Message {
       total_cost?: number;
     };
     model?: string;
+    cached?: boolean;
   };
 }
 
@@ -45,6 +46,7 @@ interface DocumentData {
     text: string;
   }>;
   total_pages: number;
+  store_id?: string; // Lazy mode: only sampled pages are held client-side
 }
 
 interface StatelessChatSectionProps {
@@ -82,6 +84,7 @@ export default function StatelessChatSection({
     isChunked: boolean;
   } | null>(null);
   const [totalSessionCost, setTotalSessionCost] = useState<number>(0);
+  const [relevanceToken, setRelevanceToken] = useState<string | null>(null);
   const [selectedPageContent, setSelectedPageContent] = useState<{
     content: string;
     pageNumber: number;
@@ -145,6 +148,7 @@ export default function StatelessChatSection({
           documents: documents,
           description: description,
           model: selectedModel,
+          relevance_token: relevanceToken,
           chat_history: messages.map(msg => ({
             role: msg.role,
             content: msg.content,
@@ -153,6 +157,21 @@ export default function StatelessChatSection({
         }),
       });
 
+      if (response.status === 429) {
+        const retryAfter = response.headers.get('Retry-After') || 'a few';
+        setMessages(prev => prev.map(msg =>
+          msg.id === assistantMessageId
+            ? {
+                ...msg,
+                content: `The server is busy right now. Please try again in ${retryAfter} seconds.`,
+                isStreaming: false,
+                progress: undefined
+              }
+            : msg
+        ));
+        return;
+      }
+
       if (!response.ok) {
         throw new Error('Failed to get response');
       }
@@ -225,6 +244,7 @@ export default function StatelessChatSection({
                 if (data.cost_breakdown?.total_cost) {
                   setTotalSessionCost(prev => prev + data.cost_breakdown.total_cost);
                 }
+                setRelevanceToken(data.relevance_token ?? null);
                 
                 setMessages(prev => prev.map(msg => 
                   msg.id === assistantMessageId 
@@ -236,7 +256,8 @@ export default function StatelessChatSection({
                           ...msg.metadata,
                           timing: data.timing_breakdown,
                           costs: data.cost_breakdown,
-                          model: selectedModel
+                          model: selectedModel,
+                          cached: data.cached
                         }
                       }
                     : msg
@@ -429,16 +450,18 @@ export default function StatelessChatSection({
       return content;
     }
     
-    // Parse special markers: $PAGE_STARTfilename:pages$PAGE_END
+    // Parse special markers: $PAGE_STARTfilename:pages[#Llines]$PAGE_END
     const pageRefRegex = /\$PAGE_START([^:]+):([^\$]+)\$PAGE_END/g;
     
     // Replace markers with markdown links
     const processedContent = content.replace(pageRefRegex, (match, filename, pageSpec) => {
       const cleanFilename = filename.trim();
-      const cleanPageSpec = pageSpec.trim();
+      // Optional line anchor, e.g. "5#L12-18"
+      const [cleanPageSpec, lineSpec] = pageSpec.trim().split('#L');
+      const label = lineSpec ? `Page ${cleanPageSpec}, lines ${lineSpec}` : `Page ${cleanPageSpec}`;
       
       // Convert to markdown link format with special data attributes
-      return `[${cleanFilename} (Page ${cleanPageSpec})](javascript:void(0) "data-page-ref=${cleanFilename}:${cleanPageSpec}")`;
+      return `[${cleanFilename} (${label})](javascript:void(0) "data-page-ref=${cleanFilename}:${cleanPageSpec}")`;
     });
     
     return processedContent;
@@ -483,6 +506,14 @@ export default function StatelessChatSection({
     }
     
     const page = document.pages.find(p => p.page_number === pageNumber);
+    if (!page && document.store_id) {
+      // Lazily stored PDF: fetch the page from the server
+      fetch(`${config.apiBaseUrl}/documents/${document.store_id}/pages/${pageNumber}`)
+        .then(response => response.json())
+        .then(data => setSelectedPageContent({ content: data.text, pageNumber, filename }))
+        .catch(error => console.error('Could not load page:', error));
+      return;
+    }
     if (!page) {
       console.error('Page not found:', pageNumber, 'in', filename);
       return;
@@ -856,6 +887,9 @@ export default function StatelessChatSection({
                     {message.metadata.costs?.total_cost && (
                       <span><span className="font-medium">Cost:</span> ${message.metadata.costs.total_cost.toFixed(4)}</span>
                     )}
+                    {message.metadata.cached && (
+                      <span className="font-medium">Cached</span>
+                    )}
                   </div>
                 </div>
               )}
@@ -10,6 +10,7 @@ interface DocumentData {
   filename: string;
   pages: { page_number: number; text: string }[];
   total_pages: number;
+  store_id?: string;
 }
 
 export default function Home() {
@@ -0,0 +1,223 @@
+import itertools
+import math
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, Optional
+
+from budget import CHARS_PER_TOKEN
+from metrics import metrics
+from sse import frame_type
+
+# Latency a request is expected to meet; requests that cannot (by the
+# estimate below) get a degraded plan or a 429
+ADMISSION_TARGET_LATENCY_MS = float(os.environ.get("ADMISSION_TARGET_LATENCY_MS", "60000"))
+# Upstream token throughput assumed until completed requests calibrate it (0: off)
+ADMISSION_TOKENS_PER_SECOND = float(os.environ.get("ADMISSION_TOKENS_PER_SECOND", "200000"))
+# Hard limits on requests in flight and LLM calls waiting in the scheduler
+ADMISSION_MAX_ACTIVE = int(os.environ.get("ADMISSION_MAX_ACTIVE", "64"))
+ADMISSION_MAX_QUEUED_CALLS = int(os.environ.get("ADMISSION_MAX_QUEUED_CALLS", "512"))
+# Cost cap of the degraded plan (0: reject instead of degrading)
+ADMISSION_DEGRADED_MAX_COST = float(os.environ.get("ADMISSION_DEGRADED_MAX_COST", "0.02"))
+
+# Tokens assumed for a page whose text the request does not carry (lazy
+# documents and prebuilt collections)
+ESTIMATED_PAGE_TOKENS = 500
+# Share of the full plan's tokens a degraded plan is expected to read
+DEGRADED_LOAD_FACTOR = 0.25
+MAX_RETRY_AFTER_SECONDS = 60
+# Tickets whose stream was never consumed are forgotten after this long
+TICKET_TTL_SECONDS = 600
+# Fixed part of a request's latency (selection, answer), on top of reading
+BASE_LATENCY_SECONDS = 5.0
+# Only requests reading at least this much (with the load they shared) are
+# long enough to calibrate throughput; each weighs this much in the average
+CALIBRATION_MIN_TOKENS = 50000
+THROUGHPUT_SMOOTHING = 0.2
+
+ADMIT = "admit"
+DEGRADE = "degrade"
+REJECT = "reject"
+OUTCOMES = {ADMIT: "admitted", DEGRADE: "degraded", REJECT: "rejected"}
+
+
+def estimate_request_tokens(documents: Iterable[Any], extra_pages: int = 0) -> int:
+    """Rough input tokens the full pipeline reads: every page's text once"""
+    chars = 0
+    pages = extra_pages
+    for doc in documents:
+        if getattr(doc, "store_id", None):
+            pages += doc.total_pages
+            continue
+        chars += sum(len(page.text) for page in doc.pages if not page.is_blank)
+    return int(chars / CHARS_PER_TOKEN) + pages * ESTIMATED_PAGE_TOKENS
+
+
+class AdmissionDecision:
+    def __init__(
+        self,
+        action: str,
+        reason: str,
+        estimated_ms: float,
+        retry_after: int = 0,
+        ticket: Optional[int] = None,
+    ):
+        self.action = action
+        self.reason = reason
+        self.estimated_ms = estimated_ms
+        self.retry_after = retry_after
+        self.ticket = ticket
+
+    @property
+    def admitted(self) -> bool:
+        return self.action != REJECT
+
+    @property
+    def degraded(self) -> bool:
+        return self.action == DEGRADE
+
+
+class AdmissionController:
+    """
+    Admission control for chat requests, decided before any LLM spend.
+
+    The load is the estimated input tokens of the requests in flight. A new
+    request's latency is estimated as a fixed base plus (load + its tokens) /
+    throughput, where throughput starts at `tokens_per_second` and follows
+    what completed requests achieved. A request that would miss the target
+    latency gets a degraded plan (reading about a quarter of the tokens) if
+    that fits, and is rejected with a Retry-After otherwise; waiting cannot
+    help a request that misses it on an idle server, so that one is served
+    (degraded if possible) anyway. Requests are also rejected
+    outright beyond `max_active` in flight or `max_queued_calls` LLM calls
+    waiting in the scheduler.
+    """
+
+    def __init__(
+        self,
+        target_latency_ms: float = ADMISSION_TARGET_LATENCY_MS,
+        tokens_per_second: float = ADMISSION_TOKENS_PER_SECOND,
+        max_active: int = ADMISSION_MAX_ACTIVE,
+        max_queued_calls: int = ADMISSION_MAX_QUEUED_CALLS,
+        degraded_max_cost: float = ADMISSION_DEGRADED_MAX_COST,
+    ):
+        self.target_latency_ms = target_latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.max_active = max_active
+        self.max_queued_calls = max_queued_calls
+        self.degraded_max_cost = degraded_max_cost
+        # ticket -> (tokens, load when admitted, admission time)
+        self._active: Dict[int, tuple] = {}
+        self._load = 0
+        self._tickets = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.tokens_per_second > 0
+
+    @property
+    def load(self) -> int:
+        return self._load
+
+    def _estimate_ms(self, tokens: int) -> float:
+        return (BASE_LATENCY_SECONDS + (self._load + tokens) / self.tokens_per_second) * 1000
+
+    def _expire(self):
+        cutoff = time.monotonic() - TICKET_TTL_SECONDS
+        for ticket, (tokens, _, started) in list(self._active.items()):
+            if started < cutoff:
+                del self._active[ticket]
+                self._load -= tokens
+
+    def _update_gauges(self):
+        metrics.set_gauge("admission_active", len(self._active))
+        metrics.set_gauge("admission_load_tokens", self._load)
+        metrics.set_gauge("admission_tokens_per_second", round(self.tokens_per_second))
+
+    def _retry_after(self, tokens: int, target_ms: float) -> int:
+        """Seconds until the load has drained enough for `tokens` to fit"""
+        budget_tokens = (target_ms / 1000 - BASE_LATENCY_SECONDS) * self.tokens_per_second
+        excess = self._load + tokens - budget_tokens
+        seconds = math.ceil(max(0.0, excess) / self.tokens_per_second)
+        return min(MAX_RETRY_AFTER_SECONDS, max(1, seconds))
+
+    def admit(
+        self, tokens: int, queued_calls: int = 0, max_latency_ms: Optional[float] = None
+    ) -> AdmissionDecision:
+        """Decide on a request estimated to read `tokens` input tokens"""
+        target_ms = self.target_latency_ms
+        if max_latency_ms:
+            target_ms = min(target_ms, max_latency_ms)
+
+        with self._lock:
+            self._expire()
+            estimated_ms = self._estimate_ms(tokens)
+            degraded_tokens = int(tokens * DEGRADED_LOAD_FACTOR)
+            if len(self._active) >= self.max_active:
+                decision = AdmissionDecision(
+                    REJECT, "max_active", estimated_ms, self._retry_after(tokens, target_ms)
+                )
+            elif queued_calls >= self.max_queued_calls:
+                decision = AdmissionDecision(
+                    REJECT, "queue_depth", estimated_ms, self._retry_after(tokens, target_ms)
+                )
+            elif estimated_ms <= target_ms:
+                decision = AdmissionDecision(ADMIT, "within_target", estimated_ms)
+            elif self.degraded_max_cost > 0 and (
+                self._estimate_ms(degraded_tokens) <= target_ms or not self._active
+            ):
+                decision = AdmissionDecision(
+                    DEGRADE, "latency_target", self._estimate_ms(degraded_tokens)
+                )
+                tokens = degraded_tokens
+            elif not self._active:
+                decision = AdmissionDecision(ADMIT, "idle", estimated_ms)
+            else:
+                decision = AdmissionDecision(
+                    REJECT,
+                    "latency_target",
+                    estimated_ms,
+                    self._retry_after(degraded_tokens, target_ms),
+                )
+
+            if decision.admitted:
+                decision.ticket = next(self._tickets)
+                self._active[decision.ticket] = (tokens, self._load, time.monotonic())
+                self._load += tokens
+            self._update_gauges()
+
+        metrics.incr(f"admission_{OUTCOMES[decision.action]}")
+        if not decision.admitted:
+            metrics.incr(f"admission_rejected_{decision.reason}")
+        metrics.set_gauge("admission_estimated_latency_ms", round(decision.estimated_ms))
+        return decision
+
+    def release(self, ticket: Optional[int], completed: bool = True):
+        """A request finished; completed requests calibrate the throughput"""
+        with self._lock:
+            entry = self._active.pop(ticket, None)
+            if entry is None:
+                return
+            tokens, load_at_admission, started = entry
+            self._load -= tokens
+            read_seconds = time.monotonic() - started - BASE_LATENCY_SECONDS
+            if completed and tokens + load_at_admission >= CALIBRATION_MIN_TOKENS:
+                # The request shared upstream capacity with the load it found
+                observed = (tokens + load_at_admission) / max(1.0, read_seconds)
+                self.tokens_per_second += THROUGHPUT_SMOOTHING * (
+                    observed - self.tokens_per_second
+                )
+            self._update_gauges()
+
+    async def hold(self, ticket: Optional[int], frames: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Pass a response's frames through, releasing its ticket at the end"""
+        completed = False
+        try:
+            async for frame in frames:
+                # Only frames that may be the final event are parsed
+                if not completed and '"complete"' in frame:
+                    completed = frame_type(frame) == "complete"
+                yield frame
+        finally:
+            self.release(ticket, completed)
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from history import history_hash
+from metrics import metrics
+
+# Answers are replayed for this long after they were generated...
+CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# ...and at most this many (or this many bytes of SSE frames) are kept (0: off)
+CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+CACHE_MAX_BYTES = int(os.environ.get("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.;:]+$")
+
+
+def normalize_question(question: str) -> str:
+    """Case, width, whitespace and trailing punctuation do not change the answer"""
+    text = unicodedata.normalize("NFKC", question).casefold()
+    return _TRAILING_PUNCTUATION.sub("", " ".join(text.split()))
+
+
+def collection_hash(
+    documents: Iterable[Any], description: str = "", collection: Optional[str] = None
+) -> str:
+    """
+    Fingerprint of what a question is asked against: the description, the
+    prebuilt collection version (if any) and every uploaded document's text.
+    Lazily stored documents are identified by their content-addressed id.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([description, collection]).encode("utf-8"))
+    for doc in documents:
+        store_id = getattr(doc, "store_id", None)
+        digest.update(
+            json.dumps([doc.id, doc.filename, doc.total_pages, store_id]).encode("utf-8")
+        )
+        if store_id:
+            continue
+        for page in doc.pages:
+            digest.update(page.text.encode("utf-8"))
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _free_frame(frame: str) -> str:
+    """A `step_complete` frame with its cost zeroed, as a replay spends nothing"""
+    if not frame.startswith("data: "):
+        return frame
+    try:
+        event = json.loads(frame[len("data: "):])
+    except ValueError:
+        return frame
+    if event.get("type") != "step_complete" or not event.get("cost"):
+        return frame
+    event["cost"] = 0.0
+    return f"data: {json.dumps(event)}\n\n"
+
+
+class CachedAnswer:
+    def __init__(self, frames: List[str], complete: Dict[str, Any], scope: Optional[str]):
+        self.frames = [_free_frame(frame) for frame in frames]
+        self.complete = complete
+        self.scope = scope
+        self.created = time.time()
+        self.hits = 0
+        self.size = sum(len(frame) for frame in frames)
+
+
+class AnswerCache:
+    """
+    Exact-match cache of final answers. An entry is the full SSE event
+    sequence of a completed request (status, selected documents, page counts
+    and answer content), replayed as fast as the client reads it on a hit.
+
+    Keys combine the collection hash, the normalized question, the history
+    hash and the requested answer model. Entries expire after `ttl_seconds`
+    and are evicted least-recently-used beyond `max_entries`/`max_bytes`.
+    Entries stored under a named collection are dropped as soon as a request
+    sees a different version of that collection, or on `invalidate`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl_seconds: float = CACHE_TTL_SECONDS,
+        max_bytes: int = CACHE_MAX_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        # Named collection -> collection hash its cached entries belong to
+        self._versions: Dict[str, str] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def key(
+        self, collection_key: str, question: str, chat_history: List[Any], model: str
+    ) -> str:
+        return hashlib.sha256(
+            json.dumps(
+                [
+                    collection_key,
+                    normalize_question(question),
+                    history_hash(chat_history or []),
+                    model,
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _update_gauges(self):
+        metrics.set_gauge("answer_cache_entries", len(self._entries))
+        metrics.set_gauge("answer_cache_bytes", self._bytes)
+
+    def get(self, key: str) -> Optional[CachedAnswer]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry.created > self.ttl_seconds:
+                self._remove(key)
+                self._update_gauges()
+                entry = None
+            if entry is None:
+                metrics.incr("answer_cache_misses")
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+        metrics.incr("answer_cache_hits")
+        return entry
+
+    def put(self, key: str, entry: CachedAnswer):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+            self._update_gauges()
+
+    def observe_collection(self, collection: str, version: str):
+        """Drop a named collection's entries once its content has changed"""
+        with self._lock:
+            previous = self._versions.get(collection)
+            self._versions[collection] = version
+        if previous is not None and previous != version:
+            print(f"Collection {collection} changed, invalidating cached answers")
+            self.invalidate(collection)
+
+    def invalidate(self, collection: Optional[str] = None) -> int:
+        """Remove the entries of one named collection, or all of them"""
+        with self._lock:
+            keys = [
+                key
+                for key, entry in self._entries.items()
+                if collection is None or entry.scope == collection
+            ]
+            for key in keys:
+                self._remove(key)
+            self._update_gauges()
+        metrics.incr("answer_cache_invalidated", len(keys))
+        return len(keys)
+
+    async def record(
+        self, key: str, frames: AsyncIterator[str], scope: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Pass SSE frames through, storing them once the request completes.
+        Streams that end in an error (or never complete) are not cached, and
+        neither are completed ones marked failed or degraded.
+        """
+        recorded = []
+        async for frame in frames:
+            recorded.append(frame)
+            yield frame
+        if not recorded:
+            return
+        try:
+            last = json.loads(recorded[-1][len("data: "):])
+        except ValueError:
+            return
+        if last.get("type") == "complete" and not (last.get("failed") or last.get("degraded")):
+            self.put(key, CachedAnswer(recorded[:-1], last, scope))
+
+    async def replay(self, entry: CachedAnswer) -> AsyncIterator[str]:
+        """The cached event sequence, ending with a `complete` marked cached"""
+        start = time.time()
+        for frame in entry.frames:
+            yield frame
+        yield f"data: {json.dumps(cached_completion(entry, time.time() - start))}\n\n"
+
+
+def cached_completion(entry: CachedAnswer, replay_time: float) -> Dict[str, Any]:
+    """The stored `complete` event with zeroed stage costs and replay timing"""
+    original = entry.complete
+    completion = dict(original)
+    completion["timing_breakdown"] = {
+        "document_selection": 0.0,
+        "page_detection": 0.0,
+        "answer_generation": replay_time,
+        "total_time": replay_time,
+    }
+    completion["cost_breakdown"] = {
+        stage: 0.0
+        for stage, value in original["cost_breakdown"].items()
+        if isinstance(value, (int, float))
+    }
+    completion["cached"] = True
+    completion["cache"] = {
+        "age_seconds": time.time() - entry.created,
+        "hits": entry.hits,
+        "original_time": original["timing_breakdown"]["total_time"],
+        "original_cost": original["cost_breakdown"]["total_cost"],
+    }
+    return completion
@@ -0,0 +1,314 @@
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+from digests import DIGEST_SCAN_PAGES
+from passages import context_chars
+
+# Share of the remaining budget each stage may plan against
+SELECTION_SHARE = 0.15
+PAGE_SCAN_SHARE = 0.6
+
+# Rough prompt sizing used for cost estimates
+CHARS_PER_TOKEN = 4
+PAGE_SCAN_PROMPT_CHARS = 1500
+PAGE_SCAN_OUTPUT_TOKENS = 600
+ANSWER_PROMPT_CHARS = 2000
+ANSWER_OUTPUT_TOKENS = 2000
+# Assumed size of a page whose text has not been extracted yet (lazy mode)
+ESTIMATED_PAGE_CHARS = 2000
+# Step 2 passes besides the chunk scans: share of screened pages rescanned
+# by the scan model, size of a formatted digest, share of digested pages
+# still read in full, and the TOC section pick
+SCREEN_ESCALATION_SHARE = 0.3
+DIGEST_CHARS = 400
+DIGEST_PASS_SHARE = 0.5
+TOC_PROMPT_CHARS = 4000
+TOC_OUTPUT_TOKENS = 100
+
+# Below this much remaining latency the faster model is preferred
+FAST_MODEL_LATENCY_MS = 20000
+FAST_ANSWER_CONTEXT_CHARS = 40000
+
+# Budget fraction after which the pipeline stops starting new work
+NEARLY_EXHAUSTED = 0.9
+# Pages cited by the answer sent when the budget runs out before step 3
+EXHAUSTED_ANSWER_PAGES = 5
+
+
+def _document_chars(pages: List[Any]) -> float:
+    """
+    Text size of a document's pages. Lazy pages not extracted yet are not
+    read: they count as the average of the extracted ones. Collection pages
+    report their size from the collection index.
+    """
+    chars = 0
+    known = 0
+    for page in pages:
+        if getattr(page, "materialized", True) is False:
+            continue
+        char_count = page.get("char_count")
+        chars += char_count if char_count is not None else len(page["text"])
+        known += 1
+    if known == 0:
+        return len(pages) * ESTIMATED_PAGE_CHARS
+    return chars * len(pages) / known
+
+
+async def exhausted_answer_stream(relevant_pages: List[Dict[str, Any]]):
+    """
+    Stand-in for the answer stream once the budget is used up: point to the
+    best-ranked pages instead of calling the model. Yields the same chunks
+    as LLMService.generate_answer_stream.
+    """
+    cited: Dict[str, List[int]] = {}
+    for page in relevant_pages[:EXHAUSTED_ANSWER_PAGES]:
+        cited.setdefault(page.get("source_document"), []).append(page["page_number"])
+    if cited:
+        references = " ".join(
+            f"$PAGE_START{filename}:{','.join(str(n) for n in numbers)}$PAGE_END"
+            for filename, numbers in cited.items()
+        )
+        content = (
+            "The request budget ran out before an answer could be generated. "
+            f"The most relevant pages found were: {references}"
+        )
+    else:
+        content = "The request budget ran out before an answer could be generated."
+    yield {"type": "content", "content": content}
+    yield {"type": "cost", "cost": 0.0}
+
+
+class RequestBudget:
+    """Tracks cost and latency consumption against a request's limits"""
+
+    def __init__(
+        self,
+        max_cost: Optional[float] = None,
+        max_latency_ms: Optional[int] = None,
+        pricing: Optional[Dict[str, Dict[str, float]]] = None,
+    ):
+        self.max_cost = max_cost
+        self.max_latency_ms = max_latency_ms
+        self.pricing = pricing or {}
+        self.start = time.monotonic()
+        self.spent = 0.0
+        self.stage_models: Dict[str, str] = {}
+        self.actions: List[str] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_cost is not None or self.max_latency_ms is not None
+
+    def charge(self, cost: float):
+        self.spent += cost
+
+    def note(self, action: str):
+        """Record a degradation applied to stay within budget"""
+        print(f"Budget: {action}")
+        self.actions.append(action)
+
+    def remaining_cost(self) -> Optional[float]:
+        if self.max_cost is None:
+            return None
+        return max(0.0, self.max_cost - self.spent)
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.start) * 1000
+
+    def remaining_ms(self) -> Optional[float]:
+        if self.max_latency_ms is None:
+            return None
+        return max(0.0, self.max_latency_ms - self.elapsed_ms())
+
+    def used_fraction(self) -> float:
+        """Largest fraction consumed across the cost and latency limits"""
+        fractions = [0.0]
+        if self.max_cost:
+            fractions.append(self.spent / self.max_cost)
+        if self.max_latency_ms:
+            fractions.append(self.elapsed_ms() / self.max_latency_ms)
+        return max(fractions)
+
+    def nearly_exhausted(self) -> bool:
+        return self.used_fraction() >= NEARLY_EXHAUSTED
+
+    def stage_deadline(self, share: float) -> Optional[float]:
+        """Monotonic deadline giving a stage `share` of the remaining latency"""
+        remaining = self.remaining_ms()
+        if remaining is None:
+            return None
+        return time.monotonic() + remaining * share / 1000
+
+    def estimate_cost(self, input_chars: int, output_tokens: int, model: str) -> float:
+        if model not in self.pricing:
+            return 0.0
+        input_tokens = input_chars / CHARS_PER_TOKEN
+        return (
+            input_tokens / 1_000_000 * self.pricing[model]["input"]
+            + output_tokens / 1_000_000 * self.pricing[model]["output"]
+        )
+
+    def cheapest_model(self) -> Optional[str]:
+        """Cheapest model a stage may fall back to (screen-only models excluded)"""
+        candidates = [m for m in self.pricing if not self.pricing[m].get("screen_only")]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda m: self.pricing[m]["input"])
+
+    def choose_model(
+        self, stage: str, preferred: str, input_chars: int, output_tokens: int, share: float
+    ) -> str:
+        """Use `preferred` unless it would not fit the stage's share of the budget"""
+        model = preferred
+        cheapest = self.cheapest_model()
+        if cheapest and cheapest != preferred:
+            remaining_cost = self.remaining_cost()
+            remaining_ms = self.remaining_ms()
+            if remaining_cost is not None and (
+                self.estimate_cost(input_chars, output_tokens, preferred)
+                > remaining_cost * share
+            ):
+                model = cheapest
+                self.note(f"{stage}: using {cheapest} instead of {preferred} to fit max_cost")
+            elif remaining_ms is not None and remaining_ms < FAST_MODEL_LATENCY_MS:
+                model = cheapest
+                self.note(f"{stage}: using {cheapest} instead of {preferred} to fit max_latency_ms")
+        self.stage_models[stage] = model
+        return model
+
+    def choose_scan_model(
+        self, preferred: str, documents: List[Dict[str, Any]], chunk_size: int = 20
+    ) -> str:
+        """choose_model for step 2, sized from the documents to scan"""
+        input_chars, output_tokens = 0, 0
+        if self.max_cost is not None:
+            chunks = 0
+            for doc in documents:
+                chunks += math.ceil(len(doc["pages"]) / chunk_size)
+                input_chars += _document_chars(doc["pages"])
+            input_chars += chunks * PAGE_SCAN_PROMPT_CHARS
+            output_tokens = chunks * PAGE_SCAN_OUTPUT_TOKENS
+        return self.choose_model(
+            "page_detection", preferred, input_chars, output_tokens, PAGE_SCAN_SHARE
+        )
+
+    def plan_chunk_caps(
+        self,
+        documents: List[Dict[str, Any]],
+        model: str,
+        chunk_size: int = 20,
+        passes: Optional[Dict[str, Any]] = None,
+    ) -> Dict[int, Optional[int]]:
+        """
+        Cap the number of page-scan chunks per document so the estimated step 2
+        cost fits its share of the remaining budget. Chunks are shared out in
+        proportion to each document's size, with at least one per document.
+        `passes` (LLMService.scan_passes) prices the screen model, digest and
+        TOC passes too: the digest and TOC calls come out of the share first,
+        and digested pages count towards the chunks only in part.
+        """
+        caps: Dict[int, Optional[int]] = {doc["id"]: None for doc in documents}
+        remaining_cost = self.remaining_cost()
+        if remaining_cost is None or not documents:
+            return caps
+        passes = passes or {}
+        digested_pages = passes.get("digested_pages") or {}
+        digest_model = passes.get("digest_model")
+        toc_model = passes.get("toc_model")
+
+        chunk_counts = {}
+        total_chars = 0.0
+        fixed_cost = 0.0
+        for doc in documents:
+            page_count = len(doc["pages"])
+            digested = min(digested_pages.get(doc["id"], 0), page_count)
+            full_pages = page_count - digested * (1 - DIGEST_PASS_SHARE)
+            chunk_counts[doc["id"]] = math.ceil(full_pages / chunk_size)
+            if page_count:
+                total_chars += _document_chars(doc["pages"]) * full_pages / page_count
+            if digested and digest_model:
+                fixed_cost += self.estimate_cost(
+                    digested * DIGEST_CHARS
+                    + math.ceil(digested / DIGEST_SCAN_PAGES) * PAGE_SCAN_PROMPT_CHARS,
+                    math.ceil(digested / DIGEST_SCAN_PAGES) * PAGE_SCAN_OUTPUT_TOKENS,
+                    digest_model,
+                )
+            if toc_model and doc.get("toc") and page_count >= passes.get("toc_min_pages", 0):
+                fixed_cost += self.estimate_cost(TOC_PROMPT_CHARS, TOC_OUTPUT_TOKENS, toc_model)
+        total_chunks = sum(chunk_counts.values())
+        if total_chunks == 0:
+            return caps
+
+        avg_chunk_chars = total_chars / total_chunks + PAGE_SCAN_PROMPT_CHARS
+        chunk_cost = self.estimate_cost(avg_chunk_chars, PAGE_SCAN_OUTPUT_TOKENS, model)
+        screen_model = passes.get("screen_model")
+        if screen_model:
+            # Every chunk is screened, the borderline pages are rescanned
+            chunk_cost = (
+                self.estimate_cost(avg_chunk_chars, PAGE_SCAN_OUTPUT_TOKENS, screen_model)
+                + chunk_cost * SCREEN_ESCALATION_SHARE
+            )
+        if chunk_cost <= 0:
+            return caps
+        allowed = int(max(0.0, remaining_cost * PAGE_SCAN_SHARE - fixed_cost) / chunk_cost)
+        if allowed >= total_chunks:
+            return caps
+
+        for doc_id, count in chunk_counts.items():
+            caps[doc_id] = max(1, int(allowed * count / total_chunks))
+        self.note(f"page_detection: scanning {sum(caps.values())} of {total_chunks} chunks")
+        return caps
+
+    def fit_answer_context(
+        self, relevant_pages: List[Dict[str, Any]], model: str
+    ) -> List[Dict[str, Any]]:
+        """Drop trailing pages until the answer prompt fits the remaining budget"""
+        max_chars = None
+        remaining_cost = self.remaining_cost()
+        if remaining_cost is not None and model in self.pricing:
+            output_cost = self.estimate_cost(0, ANSWER_OUTPUT_TOKENS, model)
+            input_cost_per_char = self.estimate_cost(CHARS_PER_TOKEN, 0, model) / CHARS_PER_TOKEN
+            if input_cost_per_char > 0:
+                max_chars = int(max(0.0, remaining_cost - output_cost) / input_cost_per_char)
+                max_chars = max(0, max_chars - ANSWER_PROMPT_CHARS)
+        remaining_ms = self.remaining_ms()
+        if remaining_ms is not None and remaining_ms < FAST_MODEL_LATENCY_MS:
+            max_chars = (
+                FAST_ANSWER_CONTEXT_CHARS
+                if max_chars is None
+                else min(max_chars, FAST_ANSWER_CONTEXT_CHARS)
+            )
+        if max_chars is None:
+            return relevant_pages
+
+        fitted = []
+        used_chars = 0
+        for page in relevant_pages:
+            page_chars = context_chars(page)
+            if fitted and used_chars + page_chars > max_chars:
+                break
+            fitted.append(page)
+            used_chars += page_chars
+        if len(fitted) < len(relevant_pages):
+            self.note(
+                f"answer_generation: context trimmed to {len(fitted)} of {len(relevant_pages)} pages"
+            )
+        return fitted
+
+    def cost_report(self) -> Dict[str, Any]:
+        return {
+            "max_cost": self.max_cost,
+            "spent": self.spent,
+            "remaining": self.remaining_cost(),
+            "stage_models": self.stage_models,
+            "actions": self.actions,
+        }
+
+    def timing_report(self) -> Dict[str, Any]:
+        return {
+            "max_latency_ms": self.max_latency_ms,
+            "elapsed_ms": self.elapsed_ms(),
+            "remaining_ms": self.remaining_ms(),
+            "used_fraction": self.used_fraction(),
+        }
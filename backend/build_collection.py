@@ -0,0 +1,95 @@
+"""
+Build a prebuilt collection file from a directory of PDFs.
+
+    python build_collection.py ./manuals -o manuals.nvcol --description "Product manuals"
+
+The backend opens the files listed in COLLECTION_PATHS at startup and serves
+them by name (the file name without extension) through ChatRequest.collection.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pdf_processor import PDFProcessor
+from dedup import find_duplicates
+from collection_store import DEFAULT_BLOCK_SIZE, write_collection
+
+
+def _extract(pdf_path: str):
+    processor = PDFProcessor()
+    pages, stats = processor.extract_document(pdf_path)
+    return pages, stats, processor.extract_toc(pdf_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a no-vector collection file")
+    parser.add_argument("input_dir", help="Directory containing PDF files")
+    parser.add_argument("-o", "--output", required=True, help="Collection file to write")
+    parser.add_argument("--description", default="", help="Collection description")
+    parser.add_argument(
+        "--jobs", type=int, default=os.cpu_count(), help="Parallel extraction workers"
+    )
+    parser.add_argument("--zstd", action="store_true", help="Compress text in zstd blocks")
+    parser.add_argument(
+        "--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="Uncompressed bytes per zstd block"
+    )
+    args = parser.parse_args()
+
+    filenames = sorted(
+        name
+        for name in os.listdir(args.input_dir)
+        if name.lower().endswith(".pdf")
+    )
+    print(f"Extracting {len(filenames)} PDFs with {args.jobs} workers...")
+    start = time.time()
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(_extract, os.path.join(args.input_dir, name)): name
+            for name in filenames
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                print(f"Skipping {name}: {e}")
+
+    documents = []
+    for name in filenames:
+        if name not in results:
+            continue
+        pages, stats, toc = results[name]
+        documents.append(
+            {
+                "id": len(documents) + 1,
+                "filename": name,
+                "pages": pages,
+                "total_pages": len(pages),
+                "normalization": stats,
+                "toc": toc,
+            }
+        )
+
+    duplicates = find_duplicates(documents)
+    write_collection(
+        args.output,
+        documents,
+        description=args.description,
+        compress=args.zstd,
+        block_size=args.block_size,
+    )
+
+    total_pages = sum(doc["total_pages"] for doc in documents)
+    print(
+        f"Wrote {args.output}: {len(documents)} documents, {total_pages} pages, "
+        f"{duplicates['duplicate_pages']} duplicate pages, "
+        f"{os.path.getsize(args.output) / 1024 / 1024:.1f}MB in {time.time() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from budget import (
+    PAGE_SCAN_SHARE,
+    SELECTION_SHARE,
+    RequestBudget,
+    exhausted_answer_stream,
+)
+from dedup import attach_cluster_members, plan_cluster_scan
+from disconnect import record_fallback, request_failed
+from history import recent_history
+from passages import context_chars, focus_pages
+from relevance_memory import RelevanceMemory
+from sse import coalesce_content
+
+
+def request_documents(request, pdf_store=None, store=None) -> List[Dict[str, Any]]:
+    """
+    The request's documents in the format LLMService expects. Lazy documents
+    get every page from `pdf_store`, extracted when first read, and a
+    prebuilt collection `store` adds its documents after the uploaded ones.
+    """
+    documents = []
+    for doc in request.documents:
+        pages = [
+            {
+                "page_number": page.page_number,
+                "text": page.text,
+                "is_blank": page.is_blank,
+                "duplicate_of": page.duplicate_of,
+            }
+            for page in doc.pages
+        ]
+        lazy_pages = (
+            pdf_store.lazy_pages(doc.store_id) if pdf_store and doc.store_id else None
+        )
+        documents.append(
+            {
+                "id": doc.id,
+                "filename": doc.filename,
+                "pages": lazy_pages or pages,
+                "total_pages": doc.total_pages,
+                "outline": doc.outline,
+                "toc": doc.toc,
+            }
+        )
+    if store is not None:
+        # Pages are read lazily from the mmap. The collection's ids start at
+        # 1 too, so they follow the uploaded ones
+        documents.extend(store.documents(max((doc["id"] for doc in documents), default=0)))
+    return documents
+
+
+def _frame(event: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+
+async def chat_pipeline(
+    request,
+    llm_service,
+    budget: RequestBudget,
+    pdf_store=None,
+    store=None,
+    degraded: bool = False,
+    start_time: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    Answer a chat request in three steps (document selection, page
+    detection, answer generation), yielding its SSE frames: a status and a
+    step_complete per step, the answer content and a final complete event,
+    or an error event if a step raises. Shared by the FastAPI endpoint and
+    the serverless handler.
+    """
+    start_time = start_time or time.time()
+    try:
+        total_cost = 0.0
+        documents_dict = request_documents(request, pdf_store, store)
+        description = request.description
+        if store is not None:
+            description = description or store.description
+
+        # Step 1: Select relevant documents
+        step1_start = time.time()
+        yield _frame(
+            {
+                "type": "status",
+                "step": "document_selection",
+                "message": "Finding relevant documents...",
+                "step_number": 1,
+                "total_steps": 3,
+            }
+        )
+
+        print("Step 1: Starting document selection...")
+        # Steps 1 and 2 see a compact history; step 3 gets the full one
+        if budget.nearly_exhausted() and request.chat_history:
+            # Out of budget: keep the latest messages instead of a summary
+            budget.note("history_compaction: skipped, budget nearly used up")
+            record_fallback("history_compaction")
+            scan_history, compaction_cost = recent_history(request.chat_history), 0.0
+        else:
+            scan_history, compaction_cost = await llm_service.compact_history(
+                request.chat_history
+            )
+        total_cost += compaction_cost
+        budget.charge(compaction_cost)
+
+        # Follow-up fast path: re-check the pages used in earlier turns and
+        # skip selection and the full scan if they are sufficient
+        reused_pages = None
+        followup_cost = 0.0
+        memory = RelevanceMemory.decode(request.relevance_token)
+        if memory and request.chat_history and budget.nearly_exhausted():
+            budget.note("followup_check: skipped, budget nearly used up")
+        elif memory and request.chat_history:
+            candidate_docs = memory.candidate_documents(documents_dict)
+            if candidate_docs:
+                pages, sufficient, followup_cost = await llm_service.check_candidate_pages(
+                    candidate_docs, request.question, scan_history
+                )
+                total_cost += followup_cost
+                budget.charge(followup_cost)
+                if sufficient:
+                    reused_pages = pages
+                print(
+                    f"Follow-up check: {len(pages)} remembered pages relevant, sufficient={sufficient}"
+                )
+
+        if reused_pages is not None:
+            reused_ids = {page["document_id"] for page in reused_pages}
+            selected_docs = [doc for doc in documents_dict if doc["id"] in reused_ids]
+            step1_cost = 0.0
+        else:
+            selection_model = budget.choose_model(
+                "document_selection",
+                llm_service.selection_model,
+                len(description) + 600 * len(documents_dict),
+                1000,
+                SELECTION_SHARE,
+            )
+            selected_docs, step1_cost = await llm_service.select_documents(
+                description,
+                documents_dict,
+                request.question,
+                scan_history,
+                selection_model,
+            )
+            total_cost += step1_cost
+            budget.charge(step1_cost)
+        step1_time = time.time() - step1_start
+        print(f"Step 1 complete in {step1_time:.2f}s")
+
+        yield _frame(
+            {
+                "type": "step_complete",
+                "step": "document_selection",
+                "selected_documents": [
+                    {"id": doc["id"], "filename": doc["filename"]} for doc in selected_docs
+                ],
+                "cost": step1_cost,
+                "time_taken": step1_time,
+                "reused": reused_pages is not None,
+            }
+        )
+
+        # Step 2: Find relevant pages
+        step2_start = time.time()
+        yield _frame(
+            {
+                "type": "status",
+                "step": "page_selection",
+                "message": "Finding relevant pages in selected documents...",
+                "step_number": 2,
+                "total_steps": 3,
+            }
+        )
+
+        print("Step 2: Starting page selection...")
+        # Scan one page per near-duplicate cluster
+        scan_docs, cluster_members = plan_cluster_scan(selected_docs, documents_dict)
+        scan_model = budget.choose_scan_model(llm_service.scan_model, scan_docs)
+        scan_stats = llm_service.new_scan_stats(scan_model)
+        chunk_caps = budget.plan_chunk_caps(
+            scan_docs,
+            scan_model,
+            passes=(
+                llm_service.scan_passes(scan_docs, scan_model)
+                if budget.max_cost is not None
+                else None
+            ),
+        )
+        scan_deadline = budget.stage_deadline(PAGE_SCAN_SHARE)
+
+        async def process_document(doc):
+            pages, cost = await llm_service.find_relevant_pages(
+                doc["pages"],
+                request.question,
+                doc["filename"],
+                scan_history,
+                scan_model,
+                chunk_caps.get(doc["id"]),
+                scan_deadline,
+                scan_stats,
+                doc.get("toc"),
+            )
+            for page in pages:
+                page["document_id"] = doc["id"]
+            return pages, cost
+
+        all_relevant_pages = []
+        step2_cost = 0.0
+        if reused_pages is not None:
+            all_relevant_pages.extend(reused_pages)
+        elif budget.nearly_exhausted():
+            # Out of budget: answer from each selected document's first page
+            budget.note("page_detection: skipped, budget nearly used up")
+            record_fallback("page_detection")
+            for doc in selected_docs:
+                if doc["pages"]:
+                    first_page = doc["pages"][0].copy()
+                    first_page["source_document"] = doc["filename"]
+                    first_page["document_id"] = doc["id"]
+                    all_relevant_pages.append(first_page)
+        else:
+            # Small documents share packed chunks, the rest are scanned one
+            # document at a time, all in parallel
+            packed_docs, separate_docs = llm_service.partition_small_documents(scan_docs)
+            doc_tasks = [process_document(doc) for doc in separate_docs]
+            if packed_docs:
+                packed_caps = [chunk_caps.get(doc["id"]) for doc in packed_docs]
+                doc_tasks.append(
+                    llm_service.find_relevant_pages_packed(
+                        packed_docs,
+                        request.question,
+                        scan_history,
+                        scan_model,
+                        None if None in packed_caps else sum(packed_caps),
+                        scan_deadline,
+                        scan_stats,
+                    )
+                )
+
+            for doc_relevant_pages, doc_cost in await asyncio.gather(*doc_tasks):
+                all_relevant_pages.extend(doc_relevant_pages)
+                step2_cost += doc_cost
+            attach_cluster_members(all_relevant_pages, cluster_members)
+
+        # Highest-scoring pages first, so trimming drops the weakest
+        relevant_pages = llm_service.rank_pages(all_relevant_pages)
+        total_cost += step2_cost
+        budget.charge(step2_cost)
+        step2_time = time.time() - step2_start
+        print(f"Step 2 complete in {step2_time:.2f}s")
+
+        yield _frame(
+            {
+                "type": "step_complete",
+                "step": "page_selection",
+                "relevant_pages_count": len(relevant_pages),
+                "candidate_pages_count": len(all_relevant_pages),
+                "escalation_rate": scan_stats.report()["escalation_rate"],
+                "top_pages": [
+                    {
+                        "document": page.get("source_document"),
+                        "page_number": page["page_number"],
+                        "relevance": page.get("relevance_score"),
+                        "reason": page.get("relevance_reason"),
+                    }
+                    for page in relevant_pages[:5]
+                ],
+                "cost": step2_cost,
+                "time_taken": step2_time,
+            }
+        )
+
+        # Step 3: Generate answer
+        step3_start = time.time()
+        yield _frame(
+            {
+                "type": "status",
+                "step": "answer_generation",
+                "message": "Generating comprehensive answer...",
+                "step_number": 3,
+                "total_steps": 3,
+            }
+        )
+
+        print("Step 3: Starting answer generation...")
+        # Long pages are cut to the passages matching the question
+        relevant_pages = focus_pages(relevant_pages, request.question, llm_service.passage_chars)
+        if budget.nearly_exhausted():
+            # Out of budget: point to the best pages without an answer call
+            budget.note("answer_generation: skipped, budget nearly used up")
+            record_fallback("answer_generation")
+            answer_stream = exhausted_answer_stream(relevant_pages)
+        else:
+            answer_model = budget.choose_model(
+                "answer_generation",
+                request.model,
+                sum(context_chars(page) for page in relevant_pages),
+                2000,
+                1.0,
+            )
+            relevant_pages = budget.fit_answer_context(relevant_pages, answer_model)
+            answer_stream = llm_service.generate_answer_stream(
+                relevant_pages, request.question, request.chat_history, answer_model
+            )
+        step3_cost = 0.0
+
+        # Stream the answer, merging tokens into fewer content frames
+        async for chunk in coalesce_content(answer_stream):
+            if chunk.get("type") == "content":
+                yield _frame({"type": "content", "content": chunk["content"]})
+            elif chunk.get("type") == "cost":
+                total_cost += chunk["cost"]
+                step3_cost += chunk["cost"]
+                budget.charge(chunk["cost"])
+
+        step3_time = time.time() - step3_start
+        print(f"Step 3 complete in {step3_time:.2f}s")
+
+        total_time = time.time() - start_time
+        completion_data = {
+            "type": "complete",
+            "timing_breakdown": {
+                "document_selection": step1_time,
+                "page_detection": step2_time,
+                "answer_generation": step3_time,
+                "total_time": total_time,
+            },
+            "cost_breakdown": {
+                "document_selection": step1_cost,
+                "page_detection": step2_cost,
+                "history_compaction": compaction_cost,
+                "followup_check": followup_cost,
+                "answer_generation": step3_cost,
+                "total_cost": total_cost,
+                "page_detection_stages": scan_stats.report(),
+            },
+            "stage_models": budget.stage_models,
+            "reused_previous_pages": reused_pages is not None,
+            "cached": False,
+            "degraded": degraded,
+            # A stage fell back to a default: the answer is not cached
+            "failed": request_failed(),
+            "relevance_token": (
+                RelevanceMemory.from_relevant_pages(relevant_pages, documents_dict).encode()
+                if relevant_pages
+                else None
+            ),
+        }
+        if budget.enabled:
+            completion_data["timing_breakdown"]["budget"] = budget.timing_report()
+            completion_data["cost_breakdown"]["budget"] = budget.cost_report()
+        yield _frame(completion_data)
+
+        print(f"Request completed in {total_time:.2f}s, total cost: ${total_cost:.4f}")
+
+    except Exception as e:
+        yield _frame({"type": "error", "error": str(e)})
+        print(f"Error in chat pipeline: {str(e)}")
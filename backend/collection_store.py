@@ -0,0 +1,348 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional
+
+from dedup import page_key
+
+MAGIC = b"NVCOLL01"
+FORMAT_VERSION = 1
+FLAG_ZSTD = 1
+PAGE_BLANK = 1
+
+# magic, version, flags, num_docs, num_pages, num_blocks,
+# meta_offset, meta_length, index_offset, blob_offset, blob_length
+_HEADER = struct.Struct("<8sIIIIIQQQQQ")
+DEFAULT_BLOCK_SIZE = 256 * 1024
+CACHED_BLOCKS = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _zstd():
+    """Import zstandard lazily; it is only needed for compressed collections"""
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception(
+            "Compressed collections require the 'zstandard' package (pip install zstandard)"
+        )
+    return zstandard
+
+
+def write_collection(
+    path: str,
+    documents: List[Dict[str, Any]],
+    description: str = "",
+    compress: bool = False,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    indexes: Optional[Dict[str, Any]] = None,
+):
+    """
+    Write documents to a single collection file.
+
+    Layout: a fixed header, a JSON metadata section (documents, description,
+    optional indexes), a columnar page index (text offsets, page numbers,
+    owning document, flags, and for compressed files the block table) and one
+    UTF-8 text blob, optionally split into zstd blocks of whole pages.
+    """
+    doc_meta = []
+    page_numbers = []
+    page_docs = []
+    page_flags = []
+    page_duplicates = {}
+    encoded_pages = []
+    for doc_index, doc in enumerate(documents):
+        doc_meta.append(
+            {
+                "id": doc["id"],
+                "filename": doc["filename"],
+                "total_pages": len(doc["pages"]),
+                "first_page": len(page_numbers),
+                "normalization": doc.get("normalization"),
+                "duplicate_of": doc.get("duplicate_of"),
+                "toc": doc.get("toc"),
+            }
+        )
+        for page in doc["pages"]:
+            if page.get("duplicate_of"):
+                page_duplicates[str(len(page_numbers))] = page["duplicate_of"]
+            page_numbers.append(page["page_number"])
+            page_docs.append(doc_index)
+            page_flags.append(PAGE_BLANK if page.get("is_blank") else 0)
+            encoded_pages.append((page["text"] or "").encode("utf-8"))
+
+    num_pages = len(encoded_pages)
+    text_offsets = [0]
+    for data in encoded_pages:
+        text_offsets.append(text_offsets[-1] + len(data))
+
+    # Group whole pages into blocks
+    block_first_pages = [0]
+    blocks = []
+    if compress:
+        compressor = _zstd().ZstdCompressor(level=10)
+        current = []
+        current_size = 0
+        for index, data in enumerate(encoded_pages):
+            if current and current_size + len(data) > block_size:
+                blocks.append(compressor.compress(b"".join(current)))
+                block_first_pages.append(index)
+                current, current_size = [], 0
+            current.append(data)
+            current_size += len(data)
+        blocks.append(compressor.compress(b"".join(current)))
+        block_first_pages.append(num_pages)
+        blob = b"".join(blocks)
+    else:
+        blob = b"".join(encoded_pages)
+        block_first_pages.append(num_pages)
+    block_offsets = [0]
+    for block in blocks or [blob]:
+        block_offsets.append(block_offsets[-1] + len(block))
+
+    metadata = json.dumps(
+        {
+            "description": description,
+            "documents": doc_meta,
+            "page_duplicates": page_duplicates,
+            "indexes": indexes or {},
+        }
+    ).encode("utf-8")
+
+    num_blocks = len(block_first_pages) - 1
+    columns = [
+        struct.pack(f"<{num_pages + 1}Q", *text_offsets),
+        struct.pack(f"<{num_blocks + 1}Q", *block_offsets),
+        struct.pack(f"<{num_pages}I", *page_numbers),
+        struct.pack(f"<{num_pages}I", *page_docs),
+        struct.pack(f"<{num_blocks + 1}I", *block_first_pages),
+        bytes(page_flags),
+    ]
+
+    meta_offset = _align(_HEADER.size)
+    index_offset = _align(meta_offset + len(metadata))
+    index_length = 0
+    for column in columns:
+        index_length = _align(index_length) + len(column)
+    blob_offset = _align(index_offset + index_length)
+
+    with open(path, "wb") as file:
+        file.write(
+            _HEADER.pack(
+                MAGIC,
+                FORMAT_VERSION,
+                FLAG_ZSTD if compress else 0,
+                len(documents),
+                num_pages,
+                num_blocks,
+                meta_offset,
+                len(metadata),
+                index_offset,
+                blob_offset,
+                len(blob),
+            )
+        )
+        file.seek(meta_offset)
+        file.write(metadata)
+        position = index_offset
+        for column in columns:
+            position = _align(position)
+            file.seek(position)
+            file.write(column)
+            position += len(column)
+        file.seek(blob_offset)
+        file.write(blob)
+
+
+class StoredPage(Mapping):
+    """Read-only page view whose text is only decoded when accessed"""
+
+    _KEYS = ("page_number", "text", "is_blank", "duplicate_of")
+
+    def __init__(self, store: "CollectionStore", index: int, id_offset: int = 0):
+        self._store = store
+        self._index = index
+        self._id_offset = id_offset
+
+    def __getitem__(self, key):
+        if key == "page_number":
+            return self._store.page_numbers[self._index]
+        if key == "text":
+            return self._store.page_text(self._index)
+        if key == "char_count":
+            # UTF-8 length from the index, without decompressing the text
+            return self._store.page_size(self._index)
+        if key == "is_blank":
+            return bool(self._store.page_flags[self._index] & PAGE_BLANK)
+        if key == "duplicate_of":
+            return self._store.page_duplicate(self._index, self._id_offset)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self)
+
+
+class CollectionStore:
+    """
+    Memory-mapped, read-only view of a prebuilt collection file. Columns are
+    zero-copy memoryviews over the mapping and page text is sliced (and for
+    compressed files, block-decompressed) only when a page is read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        stat = os.stat(path)
+        # Changes whenever the file is rebuilt; keys cached answers
+        self.version = f"{self.name}:{stat.st_size}:{stat.st_mtime_ns}"
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = view = memoryview(self._mmap)
+
+        (
+            magic,
+            version,
+            flags,
+            num_docs,
+            num_pages,
+            num_blocks,
+            meta_offset,
+            meta_length,
+            index_offset,
+            blob_offset,
+            blob_length,
+        ) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise Exception(f"{path} is not a collection file (version {FORMAT_VERSION})")
+
+        self.compressed = bool(flags & FLAG_ZSTD)
+        self.num_pages = num_pages
+        metadata = json.loads(bytes(view[meta_offset : meta_offset + meta_length]))
+        self.description = metadata["description"]
+        self.document_meta = metadata["documents"]
+        self.page_duplicates = metadata["page_duplicates"]
+        self.indexes = metadata["indexes"]
+
+        position = index_offset
+
+        def column(fmt: str, count: int, width: int):
+            nonlocal position
+            position = _align(position)
+            col = view[position : position + count * width].cast(fmt)
+            position += count * width
+            return col
+
+        self.text_offsets = column("Q", num_pages + 1, 8)
+        self.block_offsets = column("Q", num_blocks + 1, 8)
+        self.page_numbers = column("I", num_pages, 4)
+        self.page_docs = column("I", num_pages, 4)
+        self.block_first_pages = column("I", num_blocks + 1, 4)
+        self.page_flags = column("B", num_pages, 1)
+        self.blob = view[blob_offset : blob_offset + blob_length]
+
+        self._blocks: "OrderedDict[int, bytes]" = OrderedDict()
+        self._decompressor = _zstd().ZstdDecompressor() if self.compressed else None
+        print(
+            f"Opened collection '{self.name}': {num_docs} documents, {num_pages} pages"
+            + (" (zstd)" if self.compressed else "")
+        )
+
+    def _block(self, block_index: int) -> bytes:
+        data = self._blocks.get(block_index)
+        if data is None:
+            start = self.block_offsets[block_index]
+            end = self.block_offsets[block_index + 1]
+            data = self._decompressor.decompress(self.blob[start:end])
+            self._blocks[block_index] = data
+            while len(self._blocks) > CACHED_BLOCKS:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(block_index)
+        return data
+
+    def page_bytes(self, index: int) -> memoryview:
+        """UTF-8 bytes of a page, sliced without copying where possible"""
+        start = self.text_offsets[index]
+        end = self.text_offsets[index + 1]
+        if not self.compressed:
+            return self.blob[start:end]
+        block_index = bisect.bisect_right(self.block_first_pages, index) - 1
+        block_start = self.text_offsets[self.block_first_pages[block_index]]
+        return memoryview(self._block(block_index))[start - block_start : end - block_start]
+
+    def page_size(self, index: int) -> int:
+        """UTF-8 byte length of a page, read from the index alone"""
+        return self.text_offsets[index + 1] - self.text_offsets[index]
+
+    def page_text(self, index: int) -> str:
+        return str(self.page_bytes(index), "utf-8")
+
+    def page_duplicate(self, index: int, id_offset: int = 0) -> Optional[str]:
+        """A page's duplicate_of, its document id shifted like documents() shifts ids"""
+        key = self.page_duplicates.get(str(index))
+        if key is None or not id_offset:
+            return key
+        document_id, _, page_number = key.partition(":")
+        if not document_id.isdigit():
+            # Built before pages were keyed by document id
+            return key
+        return page_key(int(document_id) + id_offset, int(page_number))
+
+    def documents(self, id_offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Documents in the shape the chat pipeline expects, with lazy pages.
+        Ids are shifted by `id_offset` to stay clear of uploaded documents'.
+        """
+        documents = []
+        for meta in self.document_meta:
+            first = meta["first_page"]
+            documents.append(
+                {
+                    "id": meta["id"] + id_offset,
+                    "filename": meta["filename"],
+                    "total_pages": meta["total_pages"],
+                    "pages": [
+                        StoredPage(self, index, id_offset)
+                        for index in range(first, first + meta["total_pages"])
+                    ],
+                    "toc": meta.get("toc"),
+                }
+            )
+        return documents
+
+    def close(self):
+        self.text_offsets.release()
+        self.block_offsets.release()
+        self.page_numbers.release()
+        self.page_docs.release()
+        self.block_first_pages.release()
+        self.page_flags.release()
+        self.blob.release()
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+def load_collections(paths: str) -> Dict[str, CollectionStore]:
+    """Open the comma-separated collection files named in `paths`"""
+    stores = {}
+    for path in filter(None, (p.strip() for p in paths.split(","))):
+        try:
+            store = CollectionStore(path)
+            stores[store.name] = store
+        except Exception as e:
+            print(f"Could not open collection {path}: {e}")
+    return stores
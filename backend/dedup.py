@@ -0,0 +1,205 @@
+import random
+import re
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+SHINGLE_WORDS = 4
+PAGE_SIMILARITY = 0.85
+DOCUMENT_SIMILARITY = 0.9
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1234)
+_MIX_A = _rng.randrange(1, _MERSENNE_PRIME)
+_MIX_B = _rng.randrange(0, _MERSENNE_PRIME)
+_EMPTY_BIN = _MERSENNE_PRIME
+_WORD = re.compile(r"\w+")
+
+
+def page_key(document_id: int, page_number: int) -> str:
+    """Pages are keyed by document id, since filenames may repeat"""
+    return f"{document_id}:{page_number}"
+
+
+def shingles(text: str) -> set:
+    """Hashed word n-grams of a page; crc32 keeps them stable across processes"""
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {
+        zlib.crc32(" ".join(words[i : i + SHINGLE_WORDS]).encode("utf-8"))
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
+
+def minhash(shingle_set: set) -> List[int]:
+    """
+    One-permutation MinHash: each shingle is hashed once and binned, keeping
+    the minimum per bin, which costs one pass instead of one per permutation.
+    Empty bins borrow the next non-empty bin's value so signatures of
+    similar sets stay comparable.
+    """
+    signature = [_EMPTY_BIN] * NUM_PERMUTATIONS
+    for x in shingle_set:
+        h = (_MIX_A * x + _MIX_B) % _MERSENNE_PRIME
+        slot = h % NUM_PERMUTATIONS
+        value = h // NUM_PERMUTATIONS
+        if value < signature[slot]:
+            signature[slot] = value
+    if _EMPTY_BIN in signature:
+        for slot in range(NUM_PERMUTATIONS):
+            offset = 1
+            while signature[slot] == _EMPTY_BIN and offset < NUM_PERMUTATIONS:
+                borrowed = signature[(slot + offset) % NUM_PERMUTATIONS]
+                if borrowed != _EMPTY_BIN:
+                    signature[slot] = borrowed + offset * _MERSENNE_PRIME
+                offset += 1
+    return signature
+
+
+def similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+def _cluster(signatures: List[List[int]], threshold: float) -> List[int]:
+    """
+    Group signatures with LSH banding and union-find, verifying candidate
+    pairs against `threshold`. Returns the representative index of each item,
+    which is always the earliest member of its cluster.
+    """
+    parent = list(range(len(signatures)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(LSH_BANDS):
+        buckets = defaultdict(list)
+        start = band * LSH_ROWS
+        for index, sig in enumerate(signatures):
+            buckets[tuple(sig[start : start + LSH_ROWS])].append(index)
+        for members in buckets.values():
+            for other in members[1:]:
+                first = members[0]
+                root_a, root_b = find(first), find(other)
+                if root_a == root_b:
+                    continue
+                if similarity(signatures[first], signatures[other]) >= threshold:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    return [find(i) for i in range(len(signatures))]
+
+
+def find_duplicates(documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Fingerprint every non-blank page of an upload and record near-duplicates
+    in place: pages get `duplicate_of` (the page key of their cluster's
+    representative, "document id:page number") and documents whose content is near-identical to an
+    earlier document get `duplicate_of` set to that document's filename.
+    Returns clustering statistics.
+    """
+    page_refs = []
+    page_signatures = []
+    doc_signatures: List[Optional[List[int]]] = []
+    for doc in documents:
+        doc_signature = None
+        for page in doc["pages"]:
+            page["duplicate_of"] = None
+            if page.get("is_blank"):
+                continue
+            shingle_set = shingles(page["text"])
+            if not shingle_set:
+                continue
+            signature = minhash(shingle_set)
+            page_refs.append((doc["id"], page))
+            page_signatures.append(signature)
+            # MinHash of a union is the element-wise minimum of the parts
+            doc_signature = (
+                signature
+                if doc_signature is None
+                else [min(a, b) for a, b in zip(doc_signature, signature)]
+            )
+        doc["duplicate_of"] = None
+        doc_signatures.append(doc_signature)
+
+    duplicate_pages = 0
+    for index, rep in enumerate(_cluster(page_signatures, PAGE_SIMILARITY)):
+        if rep != index:
+            rep_id, rep_page = page_refs[rep]
+            page_refs[index][1]["duplicate_of"] = page_key(rep_id, rep_page["page_number"])
+            duplicate_pages += 1
+
+    indexed = [i for i, sig in enumerate(doc_signatures) if sig is not None]
+    duplicate_documents = 0
+    reps = _cluster([doc_signatures[i] for i in indexed], DOCUMENT_SIMILARITY)
+    for position, rep in enumerate(reps):
+        if rep != position:
+            documents[indexed[position]]["duplicate_of"] = documents[indexed[rep]][
+                "filename"
+            ]
+            duplicate_documents += 1
+
+    return {
+        "pages_fingerprinted": len(page_signatures),
+        "duplicate_pages": duplicate_pages,
+        "duplicate_documents": duplicate_documents,
+    }
+
+
+def plan_cluster_scan(
+    selected_docs: List[Dict[str, Any]], documents: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], Dict[str, List[str]]]:
+    """
+    Restrict the selected documents to one page per duplicate cluster.
+
+    Returns the documents to scan and a map from each scanned page key to the
+    other selected pages in its cluster, as the "filename:page" locations the
+    answer cites. Pages whose representative is no longer in the collection
+    are scanned as usual.
+    """
+    present = {
+        page_key(doc["id"], page["page_number"])
+        for doc in documents
+        for page in doc["pages"]
+    }
+    claimed: Dict[str, str] = {}  # cluster key -> scanned page key
+    members: Dict[str, List[str]] = {}
+    scan_docs = []
+    for doc in selected_docs:
+        scan_pages = []
+        for page in doc["pages"]:
+            key = page_key(doc["id"], page["page_number"])
+            cluster = page.get("duplicate_of")
+            if cluster not in present:
+                cluster = key
+            if cluster in claimed:
+                members[claimed[cluster]].append(f"{doc['filename']}:{page['page_number']}")
+                continue
+            claimed[cluster] = key
+            members[key] = []
+            scan_pages.append(page)
+        if scan_pages:
+            scan_doc = doc.copy()
+            scan_doc["pages"] = scan_pages
+            scan_docs.append(scan_doc)
+    return scan_docs, members
+
+
+def attach_cluster_members(
+    relevant_pages: List[Dict[str, Any]], members: Dict[str, List[str]]
+) -> List[Dict[str, Any]]:
+    """
+    Tag each relevant page with the duplicate pages it stands in for; pages
+    carry their `document_id` from the page scan
+    """
+    for page in relevant_pages:
+        key = page_key(page.get("document_id"), page["page_number"])
+        if members.get(key):
+            page["also_in"] = members[key]
+    return relevant_pages
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Pages sent per digest-building call, and how much of each page is read
+DIGEST_BATCH_PAGES = 10
+DIGEST_SOURCE_CHARS = 4000
+# Digests scanned per step 2 call (they are a few hundred characters each)
+DIGEST_SCAN_PAGES = 80
+MAX_DIGESTS = 200000
+
+# Structured output of a digest-building call
+PAGE_DIGEST_SCHEMA = {
+    "name": "page_digests",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "pages": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "page_number": {"type": "integer"},
+                        "summary": {"type": "string"},
+                        "headings": {"type": "array", "items": {"type": "string"}},
+                        "entities": {"type": "array", "items": {"type": "string"}},
+                        "numbers": {"type": "array", "items": {"type": "string"}},
+                    },
+                    "required": ["page_number", "summary", "headings", "entities", "numbers"],
+                    "additionalProperties": False,
+                },
+            }
+        },
+        "required": ["pages"],
+        "additionalProperties": False,
+    },
+}
+
+
+def page_key(text: str) -> str:
+    """Digests are keyed by page text, so stateless clients find them again"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def valid_digest(entry: Any) -> bool:
+    """Whether a digest has every field format_digest reads, with the right types"""
+    return (
+        isinstance(entry, dict)
+        and isinstance(entry.get("summary"), str)
+        and all(
+            isinstance(entry.get(field), list)
+            for field in ("headings", "entities", "numbers")
+        )
+    )
+
+
+def format_digest(digest: Dict[str, Any]) -> str:
+    """One compact line per field, as shown to the page scan"""
+    parts = [digest["summary"]]
+    for field in ("headings", "entities", "numbers"):
+        if digest.get(field):
+            parts.append(f"{field.capitalize()}: {'; '.join(digest[field])}")
+    return "\n".join(parts)
+
+
+class DigestStore:
+    """
+    Short per-page digests (one-line summary, headings, key entities and
+    numbers) built in the background after upload. Kept in an LRU keyed by
+    the page text hash and, if `path` is set, appended to a JSON-lines file
+    that is reloaded at startup.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = MAX_DIGESTS):
+        self.path = path
+        self.max_entries = max_entries
+        self._digests: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    try:
+                        key, digest = json.loads(line)
+                    except ValueError:
+                        continue
+                    if not valid_digest(digest):
+                        continue
+                    self._digests[key] = digest
+            self._trim()
+            print(f"Loaded {len(self._digests)} page digests from {path}")
+
+    def _trim(self):
+        while len(self._digests) > self.max_entries:
+            self._digests.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+    def get(self, text: str) -> Optional[Dict[str, Any]]:
+        key = page_key(text)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+            return digest
+
+    def has(self, text: str) -> bool:
+        with self._lock:
+            return page_key(text) in self._digests
+
+    def put_many(self, items: List[tuple]):
+        """Store (page text, digest) pairs"""
+        entries = [(page_key(text), digest) for text, digest in items]
+        with self._lock:
+            for key, digest in entries:
+                self._digests[key] = digest
+            self._trim()
+            if self.path:
+                with open(self.path, "a") as file:
+                    for entry in entries:
+                        file.write(json.dumps(entry) + "\n")
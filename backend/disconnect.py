@@ -0,0 +1,139 @@
+import asyncio
+import contextvars
+import itertools
+from typing import AsyncIterator, Awaitable, Callable, Coroutine, List, Optional
+
+from metrics import metrics
+
+POLL_INTERVAL_SECONDS = 0.25
+_request_ids = itertools.count(1)
+
+
+class RequestScope:
+    """Per-request state shared with every task spawned while serving it"""
+
+    def __init__(self, flow: Optional[str] = None, weight: float = 1.0):
+        self.disconnected = False
+        self.cancelled_calls = 0
+        # Stages that fell back to a default (all documents, an error answer)
+        # instead of a model result; such responses are not cached
+        self.fallbacks: List[str] = []
+        # Fair-queuing flow: the tenant, or this request on its own
+        self.flow = flow or f"request-{next(_request_ids)}"
+        self.weight = weight
+
+    def record_cancelled_call(self, kind: str):
+        """Count an LLM call abandoned because the client went away"""
+        if self.disconnected:
+            self.cancelled_calls += 1
+            metrics.incr(f"{kind}_cancelled_on_disconnect")
+
+    def record_fallback(self, stage: str):
+        if stage not in self.fallbacks:
+            self.fallbacks.append(stage)
+
+
+request_scope: contextvars.ContextVar[Optional[RequestScope]] = contextvars.ContextVar(
+    "request_scope", default=None
+)
+
+
+def current_scope() -> Optional[RequestScope]:
+    return request_scope.get()
+
+
+def record_fallback(stage: str):
+    """Note on the current request that `stage` fell back to a default"""
+    scope = current_scope()
+    if scope:
+        scope.record_fallback(stage)
+
+
+def request_failed() -> bool:
+    """Whether any stage of the current request fell back to a default"""
+    scope = current_scope()
+    return bool(scope and scope.fallbacks)
+
+
+async def _watch(
+    task: asyncio.Task,
+    scope: RequestScope,
+    is_disconnected: Callable[[], Awaitable[bool]],
+):
+    while not task.done():
+        if await is_disconnected():
+            scope.disconnected = True
+            task.cancel()
+            return
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+
+def _finish(scope: RequestScope):
+    if scope.disconnected:
+        metrics.incr("requests_disconnected")
+        metrics.incr("llm_calls_released", scope.cancelled_calls)
+        print(f"Client disconnected, cancelled {scope.cancelled_calls} in-flight LLM calls")
+
+
+async def stream_until_disconnect(
+    events: AsyncIterator[str],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    scope: Optional[RequestScope] = None,
+) -> AsyncIterator[str]:
+    """
+    Relay `events` while watching the client. On disconnect the producer task
+    is cancelled, which cancels everything it awaits: document selection,
+    every page-scan chunk task and the OpenAI answer stream.
+    """
+    scope = scope or RequestScope()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def produce():
+        request_scope.set(scope)
+        try:
+            async for event in events:
+                await queue.put(event)
+        finally:
+            await queue.put(done)
+
+    producer = asyncio.create_task(produce())
+    watcher = asyncio.create_task(_watch(producer, scope, is_disconnected))
+    try:
+        while True:
+            event = await queue.get()
+            if event is done:
+                break
+            yield event
+    finally:
+        # Also reached when the server itself stops consuming the stream
+        if not producer.done():
+            scope.disconnected = True
+            producer.cancel()
+        watcher.cancel()
+        await asyncio.gather(producer, watcher, return_exceptions=True)
+        _finish(scope)
+
+
+async def run_until_disconnect(
+    coro: Coroutine,
+    is_disconnected: Callable[[], Awaitable[bool]],
+    scope: Optional[RequestScope] = None,
+):
+    """Run `coro`, cancelling it (and its task tree) if the client disconnects"""
+    scope = scope or RequestScope()
+
+    async def run():
+        request_scope.set(scope)
+        return await coro
+
+    task = asyncio.create_task(run())
+    watcher = asyncio.create_task(_watch(task, scope, is_disconnected))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not scope.disconnected:
+            raise
+    finally:
+        watcher.cancel()
+        _finish(scope)
@@ -0,0 +1,231 @@
+"""
+Local stand-in for the OpenAI chat completions API, for load tests.
+
+    python fake_openai.py --port 8100 --latency-ms 800 --rate-limit 0.05
+
+Point the backend at it with OPENAI_BASE_URL=http://127.0.0.1:8100/v1.
+Responses are shaped for this app's prompts: document selection gets a JSON
+array of ids from the prompt, structured calls get a reply for their schema
+(page scores, packed page scores naming the document number, page digests or
+table-of-contents sections),
+follow-up checks get a {"pages", "sufficient"} object, history compaction
+gets a summary and answers are streamed token by token with usage. Latency
+is log-normal around the configured median; a share of requests can be
+answered with 429 (with retry-after) or 500.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_PAGE_NUMBER = re.compile(r'"page_number": (\d+)')
+_DOCUMENT_ID = re.compile(r'"id": (\d+)')
+_PACKED_PAGE = re.compile(r'"document": (\d+),\s*"filename": "[^"]*",\s*"page_number": (\d+)')
+_TOC_INDEX = re.compile(r"^\s*\[(\d+)\]", re.M)
+
+
+class FakeSettings:
+    def __init__(self, args):
+        self.latency_ms = args.latency_ms
+        self.latency_sigma = args.latency_sigma
+        self.ttft_ms = args.ttft_ms
+        self.tokens_per_second = args.tokens_per_second
+        self.answer_tokens = args.answer_tokens
+        self.rate_limit = args.rate_limit
+        self.failure_rate = args.failure_rate
+        self.seed = args.seed
+
+    def latency(self, median_ms: float) -> float:
+        return random.lognormvariate(0, self.latency_sigma) * median_ms / 1000
+
+
+def _usage(prompt: str, completion_tokens: int) -> dict:
+    prompt_tokens = max(1, len(prompt) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _structured_content(schema: dict, prompt: str) -> str:
+    """A reply matching the json_schema the app asked for, by schema name"""
+    name = schema.get("name")
+    if name == "page_digests":
+        return json.dumps(
+            {
+                "pages": [
+                    {
+                        "page_number": int(n),
+                        "summary": f"Page {n} covers one part of the document.",
+                        "headings": [f"Section {n}"],
+                        "entities": ["ACME"],
+                        "numbers": [f"{n} units"],
+                    }
+                    for n in _PAGE_NUMBER.findall(prompt)
+                ]
+            }
+        )
+    if name == "toc_sections":
+        indices = sorted({int(n) for n in _TOC_INDEX.findall(prompt)})
+        return json.dumps({"sections": random.sample(indices, min(len(indices), 2))})
+
+    # Page scans; packed chunks name each page's document
+    packed = "document" in schema.get("schema", {}).get("properties", {}).get(
+        "pages", {}
+    ).get("items", {}).get("properties", {})
+    pages = _PACKED_PAGE.findall(prompt) if packed else [
+        (None, n) for n in _PAGE_NUMBER.findall(prompt)
+    ]
+    picked = random.sample(pages, min(len(pages), random.randint(0, 3)))
+    results = []
+    for document, n in picked:
+        entry = {
+            "page_number": int(n),
+            "relevance": round(random.random(), 2),
+            "justification": f"page {n} mentions the topic",
+        }
+        if packed:
+            entry = {"document": int(document), **entry}
+        results.append(entry)
+    return json.dumps({"pages": results})
+
+
+def _content_for(body: dict, prompt: str) -> str:
+    """A plausible reply for each of the app's prompt kinds"""
+    response_format = body.get("response_format", {})
+    if response_format.get("type") == "json_schema":
+        return _structured_content(response_format.get("json_schema", {}), prompt)
+    if '"sufficient"' in prompt:
+        labeled = _PACKED_PAGE.findall(prompt)[:2]
+        return json.dumps(
+            {
+                "pages": [
+                    {"document": int(document), "page_number": int(n)}
+                    for document, n in labeled
+                ],
+                "sufficient": random.random() < 0.5,
+            }
+        )
+    if "Available Documents" in prompt:
+        ids = sorted({int(n) for n in _DOCUMENT_ID.findall(prompt)})
+        return json.dumps(ids[: max(1, min(3, len(ids)))])
+    return "Summary of the conversation so far: the user asked about the documents."
+
+
+def create_app(settings: FakeSettings) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    random.seed(settings.seed)
+    stats = {"requests": 0, "rate_limited": 0, "failed": 0, "streams": 0}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        prompt = "".join(m.get("content") or "" for m in body.get("messages", []))
+        model = body.get("model", "gpt-5-mini")
+        request_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+
+        roll = random.random()
+        if roll < settings.rate_limit:
+            stats["rate_limited"] += 1
+            await asyncio.sleep(0.01)
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after-ms": "200", "retry-after": "1"},
+            )
+        if roll < settings.rate_limit + settings.failure_rate:
+            stats["failed"] += 1
+            await asyncio.sleep(settings.latency(settings.latency_ms / 2))
+            return JSONResponse(
+                {"error": {"message": "The server had an error", "type": "server_error"}},
+                status_code=500,
+            )
+
+        if body.get("stream"):
+            stats["streams"] += 1
+            include_usage = body.get("stream_options", {}).get("include_usage")
+            return StreamingResponse(
+                _stream(settings, request_id, model, prompt, include_usage),
+                media_type="text/event-stream",
+            )
+
+        await asyncio.sleep(settings.latency(settings.latency_ms))
+        content = _content_for(body, prompt)
+        return {
+            "id": request_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content, "refusal": None},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": _usage(prompt, max(1, len(content) // 4)),
+        }
+
+    return app
+
+
+async def _stream(settings: FakeSettings, request_id, model, prompt, include_usage):
+    def chunk(choices, usage=None):
+        data = {
+            "id": request_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+        }
+        if usage is not None:
+            data["usage"] = usage
+        return f"data: {json.dumps(data)}\n\n"
+
+    await asyncio.sleep(settings.latency(settings.ttft_ms))
+    interval = 1 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0
+    for index in range(settings.answer_tokens):
+        text = "$PAGE_STARTdoc.pdf:1$PAGE_END " if index == 10 else f"word{index} "
+        yield chunk([{"index": 0, "delta": {"content": text}, "finish_reason": None}])
+        if interval:
+            await asyncio.sleep(interval)
+    yield chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    if include_usage:
+        yield chunk([], _usage(prompt, settings.answer_tokens))
+    yield "data: [DONE]\n\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=800, help="Median non-streaming latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread")
+    parser.add_argument("--ttft-ms", type=float, default=400, help="Median time to first streamed token")
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Share of requests answered 429")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share answered 500")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    uvicorn.run(create_app(FakeSettings(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
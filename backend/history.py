@@ -0,0 +1,114 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+# Histories shorter than this are passed through verbatim instead of summarized
+COMPACT_THRESHOLD_CHARS = 2000
+MAX_CACHED_SUMMARIES = 1000
+
+ChatHistory = Union[List[Dict[str, Any]], str, None]
+
+
+def message_fields(msg) -> tuple[str, str]:
+    """Return (role, content) for a ChatMessage model or a plain dict"""
+    if hasattr(msg, "role"):
+        return msg.role, msg.content
+    return msg.get("role", "unknown"), msg.get("content", "")
+
+
+def format_history(chat_history: ChatHistory, header: str, suffix: str = "") -> str:
+    """
+    Format chat history for a prompt. A string is treated as an already
+    compacted history and is used as-is under the header.
+    """
+    if not chat_history:
+        return ""
+    if isinstance(chat_history, str):
+        return f"\n\n{header}\n{chat_history}\n"
+    history_context = f"\n\n{header}\n"
+    for msg in chat_history:
+        role, content = message_fields(msg)
+        history_context += f"{role.capitalize()}: {content}{suffix}\n"
+    return history_context
+
+
+def plain_history(chat_history: ChatHistory) -> ChatHistory:
+    """JSON-serializable copy of a history (ChatMessage models become dicts)"""
+    if not chat_history or isinstance(chat_history, str):
+        return chat_history
+    plain = []
+    for msg in chat_history:
+        role, content = message_fields(msg)
+        plain.append({"role": role, "content": content})
+    return plain
+
+
+def recent_history(
+    chat_history: List[Any], max_chars: int = COMPACT_THRESHOLD_CHARS
+) -> List[Any]:
+    """Latest messages of a history that fit in `max_chars`, without a summary call"""
+    recent = []
+    used_chars = 0
+    for msg in reversed(chat_history or []):
+        used_chars += len(message_fields(msg)[1])
+        if recent and used_chars > max_chars:
+            break
+        recent.append(msg)
+    return list(reversed(recent))
+
+
+def history_hash(chat_history: List[Any]) -> str:
+    digest = hashlib.sha256()
+    for msg in chat_history:
+        role, content = message_fields(msg)
+        digest.update(json.dumps([role, content]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class HistoryCompactor:
+    """
+    Keeps a rolling condensed summary of each conversation, cached by the hash
+    of the history it covers. When a conversation grows, the summary of its
+    longest cached prefix is extended with only the new messages.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHED_SUMMARIES):
+        self.summaries: "OrderedDict[str, str]" = OrderedDict()
+        self.max_entries = max_entries
+
+    def get(self, key: str) -> Optional[str]:
+        summary = self.summaries.get(key)
+        if summary is not None:
+            self.summaries.move_to_end(key)
+        return summary
+
+    def put(self, key: str, summary: str):
+        self.summaries[key] = summary
+        self.summaries.move_to_end(key)
+        while len(self.summaries) > self.max_entries:
+            self.summaries.popitem(last=False)
+
+    def cached_prefix(self, chat_history: List[Any]) -> tuple[int, Optional[str]]:
+        """Return the length and summary of the longest cached history prefix"""
+        for length in range(len(chat_history), 0, -1):
+            summary = self.get(history_hash(chat_history[:length]))
+            if summary is not None:
+                return length, summary
+        return 0, None
+
+    def build_prompt(self, previous_summary: Optional[str], new_messages: List[Any]) -> str:
+        return f"""
+            Condense the following conversation into a short summary (at most 150
+            words) that a search assistant can use to understand follow-up
+            questions. Keep the topics, named entities, documents, page numbers
+            and any open questions. Return only the summary.
+
+            <Previous Summary>
+            {previous_summary or ""}
+            <Previous Summary>
+
+            <New Messages>
+            {format_history(new_messages, "Messages:")}
+            <New Messages>
+            """
@@ -0,0 +1,455 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from metrics import metrics
+
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "4"))
+INGEST_DIR = os.environ.get("INGEST_DIR") or os.path.join(
+    tempfile.gettempdir(), "no-vector-ingest"
+)
+# Finished jobs (and their results) are deleted this long after finishing
+INGEST_RETENTION_SECONDS = float(os.environ.get("INGEST_RETENTION_SECONDS", "86400"))
+# How often expired jobs are looked for
+RETENTION_CHECK_SECONDS = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    description TEXT NOT NULL,
+    lazy INTEGER,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total_pages INTEGER,
+    started REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT,
+    owner INTEGER,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+# File statuses: queued -> processing -> done | failed
+# Job statuses: queued -> running -> complete | failed
+FINISHED = ("done", "failed")
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """SQLite-backed ingestion jobs and their per-file progress"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(job_files)")}
+        if "owner" not in columns:
+            # Databases created before files were claimed by a process
+            self._db.execute("ALTER TABLE job_files ADD COLUMN owner INTEGER")
+        self._lock = threading.Lock()
+
+    def create_job(self, job_id: str, description: str, lazy: Optional[bool], files: List[tuple]):
+        """`files` are (filename, spooled path) pairs"""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, description, lazy, created, updated) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, description, lazy, now, now),
+            )
+            self._db.executemany(
+                "INSERT INTO job_files (job_id, idx, filename, path, status) "
+                "VALUES (?, ?, ?, ?, 'queued')",
+                [(job_id, idx, filename, path) for idx, (filename, path) in enumerate(files)],
+            )
+
+    def update_job(self, job_id: str, **fields):
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._db:
+            self._db.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+            )
+
+    def update_file(self, job_id: str, idx: int, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._db:
+            self._db.execute(
+                f"UPDATE job_files SET {columns} WHERE job_id = ? AND idx = ?",
+                (*fields.values(), job_id, idx),
+            )
+            self._db.execute(
+                "UPDATE jobs SET updated = ? WHERE id = ?", (time.time(), job_id)
+            )
+
+    def claim_file(self, job_id: str, idx: int, owner: int) -> bool:
+        """
+        Atomically move a queued file to processing for process `owner`.
+        Every process sharing the database may have queued the same file;
+        only the one whose claim succeeds extracts it.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            claimed = self._db.execute(
+                "UPDATE job_files SET status = 'processing', started = ?, owner = ? "
+                "WHERE job_id = ? AND idx = ? AND status = 'queued'",
+                (now, owner, job_id, idx),
+            ).rowcount
+            if claimed:
+                self._db.execute(
+                    "UPDATE jobs SET status = CASE WHEN status = 'queued' THEN 'running' "
+                    "ELSE status END, updated = ? WHERE id = ?",
+                    (now, job_id),
+                )
+        return claimed == 1
+
+    def requeue_file(self, job_id: str, idx: int, owner: Optional[int]) -> bool:
+        """Put a file `owner` was processing back in the queue, unless someone already did"""
+        with self._lock, self._db:
+            return (
+                self._db.execute(
+                    "UPDATE job_files SET status = 'queued', started = NULL, owner = NULL "
+                    "WHERE job_id = ? AND idx = ? AND status = 'processing' AND owner IS ?",
+                    (job_id, idx, owner),
+                ).rowcount
+                == 1
+            )
+
+    def clear_results(self, job_id: str):
+        """Drop per-file results once the job result holds the documents"""
+        with self._lock, self._db:
+            self._db.execute("UPDATE job_files SET result = NULL WHERE job_id = ?", (job_id,))
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            files = self._db.execute(
+                "SELECT * FROM job_files WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+        job = dict(row)
+        job["files"] = [dict(file) for file in files]
+        return job
+
+    def pending_files(self) -> List[Dict[str, Any]]:
+        """Files not finished (job_id, idx, status, owner, started), oldest job first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT f.job_id, f.idx, f.status, f.owner, f.started "
+                "FROM job_files f JOIN jobs j ON j.id = f.job_id "
+                "WHERE f.status NOT IN ('done', 'failed') ORDER BY j.created, f.idx"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_finished(self, before: float) -> int:
+        """Delete complete and failed jobs last updated before `before`"""
+        with self._lock, self._db:
+            ids = [
+                row["id"]
+                for row in self._db.execute(
+                    "SELECT id FROM jobs WHERE status IN ('complete', 'failed') AND updated < ?",
+                    (before,),
+                ).fetchall()
+            ]
+            for job_id in ids:
+                self._db.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(ids)
+
+    def unfinished_jobs(self) -> List[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created"
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def job_progress(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public view of a job: status and per-file progress, without results"""
+    files = job["files"]
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "error": job["error"],
+        "created": job["created"],
+        "updated": job["updated"],
+        "files_total": len(files),
+        "files_done": sum(1 for file in files if file["status"] in FINISHED),
+        "files": [
+            {
+                "filename": file["filename"],
+                "status": file["status"],
+                "total_pages": file["total_pages"],
+                "time_taken": (
+                    file["finished"] - file["started"]
+                    if file["finished"] and file["started"]
+                    else None
+                ),
+                "error": file["error"],
+            }
+            for file in files
+        ],
+    }
+
+
+class IngestionQueue:
+    """
+    Persistent queue of upload jobs worked by a local pool.
+
+    Uploaded files are spooled to `directory` and recorded in SQLite, so
+    queued and interrupted jobs resume after a restart. Several processes
+    (uvicorn workers) may share the database: each file is claimed by one
+    of them before it is extracted, and a file left processing by a
+    process that is gone is requeued. SQLite calls run in threads. Each file is
+    extracted by `process_file(path, filename, document_id, lazy)` in a
+    worker thread; when the last file of a job finishes,
+    `finish_job(documents)` turns the extracted documents into the job
+    result (dedup, digests, the same response /upload returns). Finished
+    jobs are deleted `retention_seconds` after they finish.
+    """
+
+    def __init__(
+        self,
+        process_file: Callable[[str, str, int, Optional[bool]], Dict[str, Any]],
+        finish_job: Callable[[List[Dict[str, Any]]], Awaitable[Dict[str, Any]]],
+        directory: str = INGEST_DIR,
+        workers: int = INGEST_WORKERS,
+        retention_seconds: float = INGEST_RETENTION_SECONDS,
+    ):
+        self.process_file = process_file
+        self.finish_job = finish_job
+        self.directory = directory
+        self.workers = max(1, workers)
+        self.retention_seconds = retention_seconds
+        os.makedirs(directory, exist_ok=True)
+        self.store = JobStore(
+            os.environ.get("INGEST_DB") or os.path.join(directory, "jobs.sqlite3")
+        )
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._changed: Optional[asyncio.Event] = None
+        self._finishing = set()
+        self._started = 0.0
+
+    async def start(self):
+        """Start the workers and requeue whatever a previous run left unfinished"""
+        self._queue = asyncio.Queue()
+        self._changed = asyncio.Event()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="ingest")
+        self._started = time.time()
+        resumed = await asyncio.to_thread(self._requeue_interrupted)
+        for job_id, idx in resumed:
+            self._queue.put_nowait((job_id, idx))
+        if resumed:
+            print(f"Ingestion: resuming {len(resumed)} files")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._expire_jobs()))
+        # Jobs whose files all finished before the restart only need finishing
+        for job_id in await asyncio.to_thread(self.store.unfinished_jobs):
+            await self._maybe_finish(job_id)
+        metrics.set_gauge("ingest_queued_files", self._queue.qsize())
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, description: str, lazy: Optional[bool], files: List[tuple]) -> str:
+        """Queue a job for (filename, content) pairs; returns its id"""
+        job_id = uuid.uuid4().hex
+        # Spooling and the SQLite insert stay off the event loop
+        spooled = await asyncio.to_thread(self._spool_job, job_id, description, lazy, files)
+        for idx in range(len(spooled)):
+            self._queue.put_nowait((job_id, idx))
+        metrics.incr("ingest_jobs_submitted")
+        metrics.set_gauge("ingest_queued_files", self._queue.qsize())
+        self._notify()
+        return job_id
+
+    def _spool_job(
+        self, job_id: str, description: str, lazy: Optional[bool], files: List[tuple]
+    ) -> List[tuple]:
+        job_dir = os.path.join(self.directory, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        spooled = []
+        for idx, (filename, content) in enumerate(files):
+            path = os.path.join(job_dir, f"{idx}.pdf")
+            with open(path, "wb") as file:
+                file.write(content)
+            spooled.append((filename, path))
+        self.store.create_job(job_id, description, lazy, spooled)
+        return spooled
+
+    async def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.job, job_id)
+
+    def _requeue_interrupted(self) -> List[tuple]:
+        """
+        (job_id, idx) of queued files, and of files whose processing process
+        is gone: not running any more, or this process's pid reused after a
+        restart. Files other live processes are extracting are left to them.
+        """
+        pid = os.getpid()
+        resumed = []
+        for file in self.store.pending_files():
+            if file["status"] == "processing":
+                owner = file["owner"]
+                alive = owner is not None and _process_alive(owner)
+                if owner == pid:
+                    alive = (file["started"] or 0) >= self._started
+                if alive or not self.store.requeue_file(file["job_id"], file["idx"], owner):
+                    continue
+            resumed.append((file["job_id"], file["idx"]))
+        return resumed
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, timeout: float):
+        """Wait until any job changes (or the timeout passes)"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def expire_jobs(self) -> int:
+        """Delete jobs that finished more than `retention_seconds` ago"""
+        expired = self.store.delete_finished(time.time() - self.retention_seconds)
+        if expired:
+            print(f"Ingestion: deleted {expired} expired jobs")
+            metrics.incr("ingest_jobs_expired", expired)
+        return expired
+
+    async def _expire_jobs(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.expire_jobs)
+            except Exception as e:
+                print(f"Ingestion: could not delete expired jobs: {e}")
+            await asyncio.sleep(RETENTION_CHECK_SECONDS)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id, idx = await self._queue.get()
+            metrics.set_gauge("ingest_queued_files", self._queue.qsize())
+            # Another process sharing the database may have taken the file
+            if not await asyncio.to_thread(self.store.claim_file, job_id, idx, os.getpid()):
+                continue
+            job = await asyncio.to_thread(self.store.job, job_id)
+            if job is None:
+                continue
+            file = job["files"][idx]
+            self._notify()
+            try:
+                document = await loop.run_in_executor(
+                    self._executor,
+                    self.process_file,
+                    file["path"],
+                    file["filename"],
+                    idx + 1,
+                    None if job["lazy"] is None else bool(job["lazy"]),
+                )
+                await asyncio.to_thread(
+                    lambda: self.store.update_file(
+                        job_id,
+                        idx,
+                        status="done",
+                        finished=time.time(),
+                        total_pages=document.get("total_pages", len(document["pages"])),
+                        result=json.dumps(document),
+                    )
+                )
+                metrics.incr("ingest_files_done")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ingestion error for {file['filename']}: {e}")
+                await asyncio.to_thread(
+                    self.store.update_file,
+                    job_id,
+                    idx,
+                    status="failed",
+                    finished=time.time(),
+                    error=str(e),
+                )
+                metrics.incr("ingest_files_failed")
+            self._notify()
+            await self._maybe_finish(job_id)
+
+    async def _maybe_finish(self, job_id: str):
+        job = await asyncio.to_thread(self.store.job, job_id)
+        if job is None or job["status"] in ("complete", "failed") or job_id in self._finishing:
+            return
+        if any(file["status"] not in FINISHED for file in job["files"]):
+            return
+        self._finishing.add(job_id)
+        documents = await asyncio.to_thread(
+            lambda: [
+                json.loads(file["result"]) for file in job["files"] if file["status"] == "done"
+            ]
+        )
+        if not documents:
+            await asyncio.to_thread(
+                self.store.update_job, job_id, status="failed", error="No file could be processed"
+            )
+        else:
+            try:
+                result = await self.finish_job(documents)
+                await asyncio.to_thread(
+                    lambda: self.store.update_job(
+                        job_id, status="complete", result=json.dumps(result)
+                    )
+                )
+            except Exception as e:
+                print(f"Ingestion job {job_id} failed: {e}")
+                await asyncio.to_thread(
+                    self.store.update_job, job_id, status="failed", error=str(e)
+                )
+        self._finishing.discard(job_id)
+        # The job result now holds the documents
+        await asyncio.to_thread(self.store.clear_results, job_id)
+        await asyncio.to_thread(
+            shutil.rmtree, os.path.join(self.directory, job_id), ignore_errors=True
+        )
+        print(f"Ingestion job {job_id} finished: {len(documents)} of {len(job['files'])} files")
+        self._notify()
@@ -1,12 +1,182 @@
 import asyncio
 import os
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Optional
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
 import json
 
+from budget import CHARS_PER_TOKEN
+from disconnect import RequestScope, current_scope, record_fallback, request_scope
+from scheduler import (
+    PRIORITY_ANSWER,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_SCAN,
+    FairScheduler,
+    parse_weights,
+)
+from digests import (
+    DIGEST_BATCH_PAGES,
+    DIGEST_SCAN_PAGES,
+    DIGEST_SOURCE_CHARS,
+    PAGE_DIGEST_SCHEMA,
+    DigestStore,
+    format_digest,
+    valid_digest,
+)
+from metrics import metrics
+from resilience import (
+    LatencyTracker,
+    RetryBudget,
+    backoff_delay,
+    hedged_call,
+    is_transient_error,
+)
+from history import (
+    COMPACT_THRESHOLD_CHARS,
+    ChatHistory,
+    HistoryCompactor,
+    format_history,
+    history_hash,
+    message_fields,
+    plain_history,
+)
+from work_queue import PAGE_SCAN_QUEUE, create_work_queue
+from toc import TOC_SECTION_SCHEMA, format_toc
+
 load_dotenv()
 
+# Structured output of a page-scan call: each relevant page with a score and
+# the span of text that makes it relevant
+PAGE_SCAN_SCHEMA = {
+    "name": "relevant_pages",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "pages": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "page_number": {"type": "integer"},
+                        "relevance": {"type": "number"},
+                        "justification": {"type": "string"},
+                    },
+                    "required": ["page_number", "relevance", "justification"],
+                    "additionalProperties": False,
+                },
+            }
+        },
+        "required": ["pages"],
+        "additionalProperties": False,
+    },
+}
+
+
+class ScanStats:
+    """Per-request accounting of the step 2 screen/escalation cascade"""
+
+    def __init__(self, screen_model: Optional[str], scan_model: str):
+        self.screen_model = screen_model
+        self.scan_model = scan_model
+        # Model that read page digests, if any page had one
+        self.digest_model = None
+        self.digest_pages = 0
+        self.digest_passed = 0
+        self.digest_cost = 0.0
+        # Model that picked table-of-contents sections, if any document had a TOC
+        self.toc_model = None
+        self.toc_documents = 0
+        self.toc_pages_deferred = 0
+        self.toc_fallbacks = 0
+        self.toc_cost = 0.0
+        self.chunks = 0
+        self.escalated_chunks = 0
+        self.escalated_pages = 0
+        self.screen_cost = 0.0
+        self.scan_cost = 0.0
+
+    # Cascade counters a chunk task reports back from its worker
+    TASK_COUNTERS = ("chunks", "escalated_chunks", "escalated_pages", "screen_cost", "scan_cost")
+
+    def counters(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.TASK_COUNTERS}
+
+    def merge(self, counters: Dict[str, Any]):
+        for name in self.TASK_COUNTERS:
+            setattr(self, name, getattr(self, name) + counters.get(name, 0))
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "digests": {
+                "model": self.digest_model,
+                "cost": self.digest_cost,
+                "pages": self.digest_pages,
+                "passed": self.digest_passed,
+            },
+            "toc": {
+                "model": self.toc_model,
+                "cost": self.toc_cost,
+                "documents": self.toc_documents,
+                "pages_deferred": self.toc_pages_deferred,
+                "fallbacks": self.toc_fallbacks,
+            },
+            "screen": {"model": self.screen_model, "cost": self.screen_cost},
+            "escalation": {
+                "model": self.scan_model,
+                "cost": self.scan_cost,
+                "chunks": self.escalated_chunks,
+                "pages": self.escalated_pages,
+            },
+            "chunks": self.chunks,
+            "escalation_rate": (
+                self.escalated_chunks / self.chunks
+                if self.screen_model and self.chunks
+                else None
+            ),
+        }
+
+
+# Page scan of several small documents in one call: every page is labeled
+# with its document, so results can be demultiplexed
+PACKED_PAGE_SCAN_SCHEMA = {
+    "name": "relevant_pages",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "pages": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "document": {"type": "integer"},
+                        "page_number": {"type": "integer"},
+                        "relevance": {"type": "number"},
+                        "justification": {"type": "string"},
+                    },
+                    "required": ["document", "page_number", "relevance", "justification"],
+                    "additionalProperties": False,
+                },
+            }
+        },
+        "required": ["pages"],
+        "additionalProperties": False,
+    },
+}
+# Upper bound on pages in one packed chunk, on top of its character budget
+PACKED_CHUNK_PAGES = 40
+
+
+# Outline titles (two top levels) shown to document selection
+OUTLINE_PREVIEW_ENTRIES = 40
+
+# Pages kept without a score (reused from a previous turn) rank in the
+# middle; pages whose scan failed (flagged scan_failed) rank after all others
+UNSCORED_RELEVANCE = 0.5
+
 
 class LLMService:
     def __init__(self):
@@ -18,11 +188,113 @@ class LLMService:
             self.client = AsyncOpenAI(api_key=api_key)
         self.model = "gpt-5-mini"
 
+        # Screen-only models are priced but never a budget fallback for a
+        # whole stage (selection, page scan, answer)
         self.pricing = {
             "gpt-5": {"input": 1.25, "output": 10.0},
             "gpt-5-mini": {"input": 0.25, "output": 2.0},
+            "gpt-5-nano": {"input": 0.05, "output": 0.4, "screen_only": True},
         }
 
+        # Per-stage models. Step 2 is a cascade: the screen model scans every
+        # chunk and only pages it scores inside the escalation band are
+        # rescanned with the page-scan model. An empty screen model disables it.
+        self.selection_model = os.environ.get("DOCUMENT_SELECTION_MODEL", "gpt-5")
+        # Collections above this many documents are selected in parallel
+        # shards followed by a final round (0: one call for everything)
+        self.selection_shard_size = int(os.environ.get("DOCUMENT_SELECTION_SHARD_SIZE", "25"))
+        self.scan_model = os.environ.get("PAGE_SCAN_MODEL", self.model)
+        self.screen_model = os.environ.get("PAGE_SCAN_SCREEN_MODEL", "gpt-5-nano")
+        self.escalate_min = float(os.environ.get("PAGE_SCAN_ESCALATE_MIN", "0.3"))
+        self.escalate_max = float(os.environ.get("PAGE_SCAN_ESCALATE_MAX", "0.7"))
+
+        # Page digests built in the background after upload; step 2 scans the
+        # digests first and reads full text only for pages scoring at least
+        # PAGE_DIGEST_PASS_MIN. An empty digest model disables both.
+        self.digest_model = os.environ.get("PAGE_DIGEST_MODEL", "gpt-5-nano")
+        self.digest_pass_min = float(os.environ.get("PAGE_DIGEST_PASS_MIN", "0.3"))
+        self.digests = DigestStore(os.environ.get("PAGE_DIGEST_STORE") or None)
+
+        # Documents of at least TOC_MIN_PAGES pages with a table of contents
+        # are scanned section-first: TOC_MODEL picks sections and only their
+        # pages are read unless they turn out to hold nothing relevant. Picks
+        # covering more than TOC_MAX_FRACTION of the pages are not worth it.
+        self.toc_model = os.environ.get("TOC_MODEL", "gpt-5-nano")
+        self.toc_min_pages = int(os.environ.get("TOC_MIN_PAGES", "40"))
+        self.toc_max_fraction = float(os.environ.get("TOC_MAX_FRACTION", "0.5"))
+
+        # Documents with fewer than PAGE_SCAN_PACK_MAX_PAGES pages to scan are
+        # packed together into chunks of up to PAGE_SCAN_PACK_CHARS of text
+        self.pack_max_pages = int(os.environ.get("PAGE_SCAN_PACK_MAX_PAGES", "10"))
+        self.pack_chars = int(os.environ.get("PAGE_SCAN_PACK_CHARS", "48000"))
+
+        # Page-scan resilience: per-call timeout, p95-based hedging, a shared
+        # retry budget and bisection of chunks that keep failing
+        self.chunk_timeout = float(os.environ.get("PAGE_SCAN_TIMEOUT_SECONDS", "60"))
+        self.chunk_max_retries = int(os.environ.get("PAGE_SCAN_MAX_RETRIES", "2"))
+        self.chunk_min_split_size = 1
+        self.chunk_latency = LatencyTracker(default=self.chunk_timeout / 2)
+        self.retry_budget = RetryBudget()
+
+        # Rolling conversation summaries used by steps 1 and 2
+        self.history_compactor = HistoryCompactor()
+
+        # Highest-scoring pages passed to the answer (at least one), cut down
+        # to the passages matching the question when longer than
+        # ANSWER_PASSAGE_CHARS (0: off)
+        self.answer_top_k = max(1, int(os.environ.get("ANSWER_TOP_K", "15")))
+        self.passage_chars = int(os.environ.get("ANSWER_PASSAGE_CHARS", "1500"))
+
+        # Weighted fair queuing of upstream calls across concurrent requests
+        self.scheduler = FairScheduler(
+            max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "32")),
+            weights=parse_weights(os.environ.get("LLM_TENANT_WEIGHTS", "")),
+        )
+
+        # Where step 2 chunk tasks run: this event loop, local worker
+        # processes or worker nodes behind Redis (PAGE_SCAN_QUEUE). Tasks
+        # without a deadline get as long as a scan with all its retries
+        self.work_queue = create_work_queue(
+            PAGE_SCAN_QUEUE,
+            self.run_chunk_task,
+            task_timeout=self.chunk_timeout * (self.chunk_max_retries + 1),
+        )
+
+    def _llm_slot(self, priority: int, messages: List[Dict[str, Any]]):
+        """Scheduler slot for one call, charged by its estimated input tokens"""
+        scope = current_scope()
+        chars = sum(len(message["content"]) for message in messages)
+        return self.scheduler.slot(
+            scope.flow if scope else "default",
+            priority,
+            cost=max(1.0, chars / CHARS_PER_TOKEN / 1000),
+            weight=scope.weight if scope else 1.0,
+        )
+
+    async def _create_completion(
+        self,
+        priority: Optional[int] = PRIORITY_INTERACTIVE,
+        record_cancelled: bool = True,
+        **kwargs,
+    ):
+        """
+        Every OpenAI call goes through here: it waits for a fair-queuing slot
+        (unless `priority` is None because the caller holds one) and calls
+        abandoned because the client disconnected are counted as released
+        capacity (unless `record_cancelled` is False because the caller
+        counts them itself).
+        """
+        try:
+            if priority is None:
+                return await self.client.chat.completions.create(**kwargs)
+            async with self._llm_slot(priority, kwargs["messages"]):
+                return await self.client.chat.completions.create(**kwargs)
+        except asyncio.CancelledError:
+            scope = current_scope()
+            if scope and record_cancelled:
+                scope.record_cancelled_call("llm_call")
+            raise
+
     def calculate_cost(self, usage_data, model="gpt-5-mini"):
         print(usage_data)
         """Calculate cost based on token usage"""
@@ -37,17 +309,98 @@ class LLMService:
 
         return input_cost + output_cost
 
+    async def compact_history(
+        self, chat_history: List[Dict[str, Any]] = None
+    ) -> tuple[ChatHistory, float]:
+        """
+        Condense chat history for the selection and page-scan prompts, which
+        otherwise repeat the full history in every call. Short histories are
+        returned unchanged; longer ones become a cached rolling summary.
+        """
+        if not chat_history:
+            return chat_history, 0.0
+        total_chars = sum(len(message_fields(msg)[1]) for msg in chat_history)
+        if total_chars < COMPACT_THRESHOLD_CHARS:
+            return chat_history, 0.0
+
+        key = history_hash(chat_history)
+        summary = self.history_compactor.get(key)
+        if summary is not None:
+            return summary, 0.0
+
+        prefix_length, previous_summary = self.history_compactor.cached_prefix(
+            chat_history
+        )
+        prompt = self.history_compactor.build_prompt(
+            previous_summary, chat_history[prefix_length:]
+        )
+
+        try:
+            response = await self._create_completion(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+            )
+            summary = response.choices[0].message.content.strip()
+            cost = self.calculate_cost(response.usage, model=self.model)
+            self.history_compactor.put(key, summary)
+            return summary, cost
+
+        except Exception as e:
+            print(f"Error in history compaction: {e}")
+            # Fallback: use the full history
+            return chat_history, 0.0
+
     async def select_documents(
         self,
         description: str,
         documents: List[Dict[str, Any]],
         question: str,
-        chat_history: List[Dict[str, Any]] = None,
+        chat_history: ChatHistory = None,
+        model: Optional[str] = None,
     ) -> tuple[List[Dict[str, Any]], float]:
         """
-        Select relevant documents based on description, question, and chat history
+        Select relevant documents based on description, question, and chat history.
+
+        Collections larger than the shard size are selected hierarchically:
+        each shard of summaries is screened in parallel, then a final round
+        picks among the shard candidates (sharded again if still too many).
         """
+        model = model or self.selection_model
+        history_context = format_history(chat_history, "Chat History:")
+
+        shard_size = self.selection_shard_size
+        if shard_size <= 0 or len(documents) <= shard_size:
+            return await self._select_batch(description, documents, question, history_context, model)
 
+        shards = [documents[i : i + shard_size] for i in range(0, len(documents), shard_size)]
+        print(f"Document selection: {len(documents)} documents in {len(shards)} shards")
+        results = await asyncio.gather(
+            *[
+                self._select_batch(description, shard, question, history_context, model)
+                for shard in shards
+            ]
+        )
+        candidates = [doc for selected, _ in results for doc in selected]
+        cost = sum(shard_cost for _, shard_cost in results)
+
+        if len(candidates) <= 1 or len(candidates) == len(documents):
+            # Nothing to narrow down (or no shard narrowed anything)
+            return candidates, cost
+        print(f"Document selection: final round over {len(candidates)} candidates")
+        selected, final_cost = await self.select_documents(
+            description, candidates, question, chat_history, model
+        )
+        return selected, cost + final_cost
+
+    async def _select_batch(
+        self,
+        description: str,
+        documents: List[Dict[str, Any]],
+        question: str,
+        history_context: str,
+        model: str,
+    ) -> tuple[List[Dict[str, Any]], float]:
+        """One selection call over the summaries of `documents`"""
         doc_summaries = []
         for doc in documents:
             doc_summaries.append(
@@ -58,19 +411,11 @@ class LLMService:
                     "first_page_preview": (doc["pages"][0]["text"][:500] + "..."),
                 }
             )
-
-        # Format chat history
-        history_context = ""
-        if chat_history:
-            history_context = "\n\nChat History:\n"
-            for msg in chat_history:
-                if hasattr(msg, "role"):
-                    role = msg.role
-                    content = msg.content
-                else:
-                    role = msg.get("role", "unknown")
-                    content = msg.get("content", "")
-                history_context += f"{role.capitalize()}: {content}\n"
+            if doc.get("outline"):
+                # Lazily extracted documents are previewed by their outline
+                doc_summaries[-1]["outline"] = [
+                    entry["title"] for entry in doc["outline"] if entry["level"] <= 1
+                ][:OUTLINE_PREVIEW_ENTRIES]
 
         prompt = f"""
             Based on the following document collection description, chat history, 
@@ -100,13 +445,13 @@ class LLMService:
             """
 
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-5",
+            response = await self._create_completion(
+                model=model,
                 messages=[{"role": "user", "content": prompt}],
             )
 
             selected_ids = json.loads(response.choices[0].message.content)
-            cost = self.calculate_cost(response.usage, self.model)
+            cost = self.calculate_cost(response.usage, model)
 
             # Return full document objects for selected IDs
             selected_docs = []
@@ -118,6 +463,7 @@ class LLMService:
 
         except Exception as e:
             print(f"Error in document selection: {e}")
+            record_fallback("document_selection")
             # Fallback: return all documents
             return documents, 0.0
 
@@ -126,36 +472,283 @@ class LLMService:
         pages: List[Dict[str, Any]],
         question: str,
         filename: str,
-        chat_history: List[Dict[str, Any]] = None,
+        chat_history: ChatHistory = None,
+        model: Optional[str] = None,
+        max_chunks: Optional[int] = None,
+        deadline: Optional[float] = None,
+        stats: Optional[ScanStats] = None,
+        toc: Optional[List[Dict[str, Any]]] = None,
     ) -> tuple[List[Dict[str, Any]], float]:
+        """
+        Find relevant pages by processing 20 pages at a time in parallel.
+
+        `max_chunks` caps how many chunks are scanned and `deadline` (a
+        time.monotonic() value) stops waiting for chunks that are still
+        running, keeping whatever finished in time. Cascade accounting is
+        added to `stats` when given. With a table of contents (`toc`), the
+        pages of the sections it points to are scanned first and the rest
+        only if those hold nothing relevant.
+        """
+        model = model or self.scan_model
+        stats = stats or self.new_scan_stats(model)
         print("find_relevant_pages")
         print(filename)
-        """Find relevant pages by processing 20 pages at a time in parallel"""
+
+        # Pages flagged blank at extraction carry no content worth scanning
+        pages = [page for page in pages if not page.get("is_blank")]
+
+        deferred_pages = []
+        toc_cost = 0.0
+        if toc and self.toc_model and len(pages) >= self.toc_min_pages:
+            pages, deferred_pages, toc_cost = await self._toc_pass(
+                pages, toc, question, filename, chat_history, stats
+            )
+
+        relevant_pages, total_cost, chunk_count = await self._scan_pages(
+            pages, question, filename, chat_history, model, max_chunks, deadline, stats
+        )
+        if (
+            deferred_pages
+            and not relevant_pages
+            and (max_chunks is None or chunk_count < max_chunks)
+            and (deadline is None or time.monotonic() < deadline)
+        ):
+            # The chosen sections held nothing: scan the rest of the document
+            print(f"TOC sections of {filename} had no relevant pages, scanning the rest")
+            stats.toc_fallbacks += 1
+            metrics.incr("toc_fallbacks")
+            relevant_pages, fallback_cost, _ = await self._scan_pages(
+                deferred_pages,
+                question,
+                filename,
+                chat_history,
+                model,
+                None if max_chunks is None else max_chunks - chunk_count,
+                deadline,
+                stats,
+            )
+            total_cost += fallback_cost
+        return relevant_pages, total_cost + toc_cost
+
+    async def _scan_pages(
+        self,
+        pages: List[Dict[str, Any]],
+        question: str,
+        filename: str,
+        chat_history: ChatHistory,
+        model: str,
+        max_chunks: Optional[int],
+        deadline: Optional[float],
+        stats: ScanStats,
+    ) -> tuple[List[Dict[str, Any]], float, int]:
+        """Digest pass and chunked scan of `pages`; returns pages, cost and chunks used"""
+        # Pages with a digest are read in full only if their digest passes
+        pages, digest_cost = await self._digest_pass(
+            pages, question, filename, chat_history, stats
+        )
 
         # Create chunks of 20 pages
         chunks = []
         for i in range(0, len(pages), 20):
             chunk = pages[i : i + 20]
             chunks.append(chunk)
+        if max_chunks is not None:
+            chunks = chunks[:max_chunks]
+
+        relevant_pages, total_cost = await self._scan_chunks(
+            chunks, question, filename, chat_history, model, deadline, stats
+        )
+        return relevant_pages, total_cost + digest_cost, len(chunks)
+
+    async def _toc_pass(
+        self,
+        pages: List[Dict[str, Any]],
+        toc: List[Dict[str, Any]],
+        question: str,
+        filename: str,
+        chat_history: ChatHistory,
+        stats: ScanStats,
+    ) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]], float]:
+        """
+        Pick the table-of-contents sections likely to answer the question with
+        one small call. Returns the pages inside them, the deferred rest and
+        the cost; all pages are kept when the pick does not narrow the scan.
+        """
+        listing, shown = format_toc(toc)
+        if len(shown) < 2:
+            return pages, [], 0.0
+        history_context = format_history(chat_history, "Recent Chat History:")
+        prompt = f"""
+            Below is the table of contents of document "{filename}". Choose the 
+            sections most likely to contain the information needed to answer 
+            the user's question. Prefer a few specific sections over broad 
+            parents. Return the bracketed indices of the chosen sections, or an 
+            empty list if the table of contents gives no clue.
+            {history_context}
+            <Table of Contents>
+            {listing}
+            <Table of Contents>
+
+            User Question: {question}
+            """
+        try:
+            response = await self._create_completion(
+                PRIORITY_SCAN,
+                model=self.toc_model,
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_schema", "json_schema": TOC_SECTION_SCHEMA},
+            )
+            chosen = json.loads(response.choices[0].message.content)["sections"]
+            cost = self.calculate_cost(response.usage, self.toc_model)
+        except Exception as e:
+            print(f"Error in TOC section selection: {e}")
+            return pages, [], 0.0
 
+        stats.toc_model = self.toc_model
+        stats.toc_cost += cost
+        selected_numbers = set()
+        for index in chosen:
+            if 0 <= index < len(shown):
+                section = shown[index]
+                selected_numbers.update(range(section["start_page"], section["end_page"] + 1))
+        selected = [page for page in pages if page["page_number"] in selected_numbers]
+        if not selected or len(selected) > self.toc_max_fraction * len(pages):
+            print(f"TOC pass for {filename}: no useful narrowing, scanning all pages")
+            return pages, [], cost
+
+        deferred = [page for page in pages if page["page_number"] not in selected_numbers]
+        stats.toc_documents += 1
+        stats.toc_pages_deferred += len(deferred)
+        metrics.incr("toc_pages_deferred", len(deferred))
+        print(
+            f"TOC pass for {filename}: {len(chosen)} sections, "
+            f"scanning {len(selected)} of {len(pages)} pages first"
+        )
+        return selected, deferred, cost
+
+    def partition_small_documents(
+        self, documents: List[Dict[str, Any]]
+    ) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Split documents into (small ones to scan packed, the rest)"""
+        if self.pack_max_pages <= 0:
+            return [], documents
+        small, large = [], []
+        for doc in documents:
+            pages = [page for page in doc["pages"] if not page.get("is_blank")]
+            (small if len(pages) < self.pack_max_pages else large).append(doc)
+        if len(small) < 2:
+            # Nothing to share a call with
+            return [], documents
+        return small, large
+
+    async def find_relevant_pages_packed(
+        self,
+        documents: List[Dict[str, Any]],
+        question: str,
+        chat_history: ChatHistory = None,
+        model: Optional[str] = None,
+        max_chunks: Optional[int] = None,
+        deadline: Optional[float] = None,
+        stats: Optional[ScanStats] = None,
+    ) -> tuple[List[Dict[str, Any]], float]:
+        """
+        Scan several small documents together: their pages are packed into
+        shared chunks of at most `pack_chars` characters, each page labeled
+        with its document's index in `documents` (filenames may repeat), and
+        the results carry the right source_document and document_id.
+        """
+        model = model or self.scan_model
+        stats = stats or self.new_scan_stats(model)
+        filtered = await asyncio.gather(
+            *[
+                self._digest_pass(
+                    [page for page in doc["pages"] if not page.get("is_blank")],
+                    question,
+                    doc["filename"],
+                    chat_history,
+                    stats,
+                )
+                for doc in documents
+            ]
+        )
+
+        chunks = []
+        chunk = []
+        chunk_chars = 0
+        digest_cost = 0.0
+        for doc_index, (doc, (pages, cost)) in enumerate(zip(documents, filtered)):
+            digest_cost += cost
+            for page in pages:
+                page_chars = len(page["text"])
+                if chunk and (
+                    chunk_chars + page_chars > self.pack_chars
+                    or len(chunk) >= PACKED_CHUNK_PAGES
+                ):
+                    chunks.append(chunk)
+                    chunk, chunk_chars = [], 0
+                labeled = page.copy()
+                labeled["source_document"] = doc["filename"]
+                labeled["pack_document"] = doc_index
+                chunk.append(labeled)
+                chunk_chars += page_chars
+        if chunk:
+            chunks.append(chunk)
+        if max_chunks is not None:
+            chunks = chunks[:max_chunks]
+        print(f"Packed {len(documents)} small documents into {len(chunks)} page-scan chunks")
+
+        relevant_pages, total_cost = await self._scan_chunks(
+            chunks, question, None, chat_history, model, deadline, stats
+        )
+        for page in relevant_pages:
+            page["document_id"] = documents[page.pop("pack_document")]["id"]
+        return relevant_pages, total_cost + digest_cost
+
+    async def _scan_chunks(
+        self,
+        chunks: List[List[Dict[str, Any]]],
+        question: str,
+        filename: Optional[str],
+        chat_history: ChatHistory,
+        model: str,
+        deadline: Optional[float],
+        stats: ScanStats,
+    ) -> tuple[List[Dict[str, Any]], float]:
+        """Scan chunks in parallel, keeping what finished before `deadline`"""
         # Process all chunks in parallel
         chunk_tasks = []
         for chunk_index, chunk in enumerate(chunks):
-            task = self._process_page_chunk(
-                chunk, question, filename, chunk_index, chat_history
+            task = asyncio.ensure_future(
+                self._dispatch_chunk(
+                    chunk, question, filename, chunk_index, chat_history, model, stats, deadline
+                )
             )
             chunk_tasks.append(task)
 
-        # Wait for all chunks to complete
-        chunk_results = await asyncio.gather(*chunk_tasks, return_exceptions=True)
+        # Wait for all chunks to complete, or until the deadline
+        timeout = None
+        if deadline is not None:
+            timeout = max(0.0, deadline - time.monotonic())
+        if chunk_tasks:
+            try:
+                done, pending = await asyncio.wait(chunk_tasks, timeout=timeout)
+            finally:
+                # Also runs when this request is cancelled (client disconnect)
+                for task in chunk_tasks:
+                    task.cancel()
+            if pending:
+                print(f"Deadline reached, cancelled {len(pending)} chunks of {filename or 'packed documents'}")
 
-        # Combine results from all chunks
+        # Combine results from all completed chunks
         relevant_pages = []
         total_cost = 0.0
-        for result in chunk_results:
-            if isinstance(result, Exception):
-                print(f"Error in chunk processing: {result}")
+        for task in chunk_tasks:
+            if not task.done() or task.cancelled():
+                continue
+            if task.exception() is not None:
+                print(f"Error in chunk processing: {task.exception()}")
                 continue
+            result = task.result()
             if isinstance(result, tuple) and len(result) == 2:
                 pages, cost = result
                 relevant_pages.extend(pages)
@@ -166,19 +759,524 @@ class LLMService:
 
         return relevant_pages, total_cost
 
+    async def _dispatch_chunk(
+        self,
+        chunk: List[Dict[str, Any]],
+        question: str,
+        filename: Optional[str],
+        chunk_index: int,
+        chat_history: ChatHistory,
+        model: str,
+        stats: ScanStats,
+        deadline: Optional[float],
+    ) -> tuple[List[Dict[str, Any]], float]:
+        """
+        Run one chunk scan through the work queue. Remote backends get plain
+        page dicts (lazy pages are extracted here first); if the queue fails,
+        the chunk is scanned in this process instead.
+        """
+        scope = current_scope()
+        task = {
+            "pages": chunk,
+            "question": question,
+            "filename": filename,
+            "chunk_index": chunk_index,
+            "chat_history": chat_history,
+            "model": model,
+            "screen_model": stats.screen_model,
+            "flow": scope.flow if scope else None,
+            "weight": scope.weight if scope else 1.0,
+            # Wall clock, as workers may run on other machines
+            "deadline": None if deadline is None else time.time() + deadline - time.monotonic(),
+        }
+        if self.work_queue.remote:
+            await self._materialize(chunk)
+            task["pages"] = [dict(page) for page in chunk]
+            task["chat_history"] = plain_history(chat_history)
+        try:
+            result = await self.work_queue.run(task)
+        except Exception as e:
+            print(f"    Chunk {chunk_index + 1} failed on the work queue ({e}), scanning locally")
+            metrics.incr("work_queue_fallbacks")
+            return await self._process_page_chunk(
+                chunk, question, filename, chunk_index, chat_history, model, stats
+            )
+        stats.merge(result["stats"])
+        if any(page.get("scan_failed") for page in result["pages"]):
+            # Recorded on the worker's scope, not this request's
+            record_fallback("page_detection")
+        return result["pages"], result["cost"]
+
+    async def run_chunk_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """Scan one chunk task (see work_queue) and return its result"""
+        if current_scope() is None:
+            # On a worker: fair-queue under the originating request's flow
+            request_scope.set(RequestScope(task["flow"], task["weight"]))
+        stats = ScanStats(task["screen_model"], task["model"])
+        pages, cost = await self._process_page_chunk(
+            task["pages"],
+            task["question"],
+            task["filename"],
+            task["chunk_index"],
+            task["chat_history"],
+            task["model"],
+            stats,
+        )
+        return {"pages": pages, "cost": cost, "stats": stats.counters()}
+
+    async def _digest_pass(
+        self,
+        pages: List[Dict[str, Any]],
+        question: str,
+        filename: str,
+        chat_history: ChatHistory,
+        stats: ScanStats,
+    ) -> tuple[List[Dict[str, Any]], float]:
+        """
+        Scan the digests of digested pages in large chunks and drop the pages
+        whose digest scores below `digest_pass_min`. Pages without a digest
+        (and those of chunks whose digest scan failed) are kept for the full
+        scan.
+        """
+        if not self.digest_model or not len(self.digests):
+            return pages, 0.0
+        digests = {}
+        for page in pages:
+            # Lazily extracted pages are never digested
+            if isinstance(page, dict):
+                digest = self.digests.get(page["text"])
+                if digest is not None:
+                    digests[page["page_number"]] = format_digest(digest)
+        if not digests:
+            return pages, 0.0
+
+        digested = [page for page in pages if page["page_number"] in digests]
+        chunks = [
+            digested[i : i + DIGEST_SCAN_PAGES]
+            for i in range(0, len(digested), DIGEST_SCAN_PAGES)
+        ]
+        model = stats.screen_model or stats.scan_model
+        results = await asyncio.gather(
+            *[
+                self._scan_chunk_with_retries(
+                    chunk, question, filename, chat_history, model, digests
+                )
+                for chunk in chunks
+            ],
+            return_exceptions=True,
+        )
+        passed = set()
+        cost = 0.0
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, BaseException):
+                print(f"Digest scan failed, reading {len(chunk)} pages in full: {result}")
+                passed.update(page["page_number"] for page in chunk)
+                continue
+            found, chunk_cost = result
+            cost += chunk_cost
+            passed.update(
+                page["page_number"]
+                for page in found
+                if page["relevance_score"] >= self.digest_pass_min
+            )
+
+        stats.digest_model = model
+        stats.digest_pages += len(digested)
+        stats.digest_passed += len(passed)
+        stats.digest_cost += cost
+        print(
+            f"Digest pass: {len(passed)} of {len(digested)} digested pages of {filename} read in full"
+        )
+        kept = [
+            page
+            for page in pages
+            if page["page_number"] not in digests or page["page_number"] in passed
+        ]
+        return kept, cost
+
+    async def build_digests(self, pages: List[Dict[str, Any]], filename: str) -> float:
+        """
+        Background job run after upload: digest every page not digested yet
+        in batched calls to the digest model, at background priority.
+        Returns the cost.
+        """
+        if not self.digest_model or self.client is None:
+            return 0.0
+        todo = [
+            page
+            for page in pages
+            if not page.get("is_blank")
+            and not page.get("duplicate_of")
+            and not self.digests.has(page["text"])
+        ]
+        if not todo:
+            return 0.0
+        start = time.time()
+        batches = [
+            todo[i : i + DIGEST_BATCH_PAGES] for i in range(0, len(todo), DIGEST_BATCH_PAGES)
+        ]
+        results = await asyncio.gather(
+            *[self._digest_batch(batch, filename) for batch in batches],
+            return_exceptions=True,
+        )
+        built = 0
+        cost = 0.0
+        for result in results:
+            if isinstance(result, BaseException):
+                print(f"Digest batch of {filename} failed: {result}")
+                continue
+            built += result[0]
+            cost += result[1]
+        metrics.incr("page_digests_built", built)
+        metrics.incr("page_digest_cost", cost)
+        print(
+            f"Digested {built} of {len(todo)} pages of {filename} in "
+            f"{time.time() - start:.2f}s, cost: ${cost:.4f}"
+        )
+        return cost
+
+    async def _digest_batch(
+        self, batch: List[Dict[str, Any]], filename: str
+    ) -> tuple[int, float]:
+        """One digest call for a batch of pages; returns (pages digested, cost)"""
+        pages_content = [
+            {
+                "page_number": page["page_number"],
+                "page_content": page["text"][:DIGEST_SOURCE_CHARS],
+            }
+            for page in batch
+        ]
+        prompt = f"""
+            Write a short digest of each of the following pages from document 
+            "{filename}". For every page return its page number, a one-line 
+            summary, its headings, its key entities (names, products, 
+            organizations, terms) and its important numbers with their units 
+            or meaning. Keep each list short and copy values exactly.
+
+            <Document Page Content>
+            {json.dumps(pages_content, indent=2)}
+            <Document Page Content>
+            """
+        response = await self._create_completion(
+            PRIORITY_BACKGROUND,
+            model=self.digest_model,
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_schema", "json_schema": PAGE_DIGEST_SCHEMA},
+        )
+        content = response.choices[0].message.content
+        by_number = {
+            entry.get("page_number"): entry
+            for entry in json.loads(content)["pages"]
+            if valid_digest(entry)
+        }
+        items = []
+        for page in batch:
+            entry = by_number.get(page["page_number"])
+            if entry is not None:
+                entry.pop("page_number")
+                items.append((page["text"], entry))
+        self.digests.put_many(items)
+        return len(items), self.calculate_cost(response.usage, self.digest_model)
+
+    async def check_candidate_pages(
+        self,
+        candidate_docs: List[Dict[str, Any]],
+        question: str,
+        chat_history: ChatHistory = None,
+    ) -> tuple[List[Dict[str, Any]], bool, float]:
+        """
+        Check pages remembered from earlier turns (and their neighbors) for a
+        follow-up question. Returns the relevant pages, whether they are judged
+        sufficient to answer without a full scan, and the cost. Pages are
+        labeled with their document's index in `candidate_docs`, since
+        filenames may repeat.
+        """
+        for doc in candidate_docs:
+            await self._materialize(doc["pages"])
+        pages_content = []
+        for doc_index, doc in enumerate(candidate_docs):
+            for page in doc["pages"]:
+                pages_content.append(
+                    {
+                        "document": doc_index,
+                        "filename": doc["filename"],
+                        "page_number": page["page_number"],
+                        "page_content": page["text"],
+                    }
+                )
+        if not pages_content:
+            return [], False, 0.0
+
+        history_context = format_history(chat_history, "Recent Chat History:")
+
+        prompt = f"""
+            The following pages were used to answer earlier turns of this
+            conversation. Determine which of them are relevant to the current
+            question, and whether together they contain enough information to
+            answer it fully without searching the rest of the documents.
+
+            <Chat History>
+            {history_context}
+            <Chat History>
+
+            <Current Question>
+            {question}
+            <Current Question>
+
+            <Document Page Content>
+            {json.dumps(pages_content, indent=2)}
+            <Document Page Content>
+
+            Return a JSON object with the relevant pages, each given by its
+            document number and page number, and your judgement.
+            Only return the JSON object, no other text.
+            Example: {{"pages": [{{"document": 0, "page_number": 3}}], "sufficient": true}}
+            """
+
+        try:
+            response = await self._create_completion(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+            )
+
+            result = json.loads(response.choices[0].message.content)
+            cost = self.calculate_cost(response.usage, model=self.model)
+
+            selected = {
+                (item["document"], item["page_number"]) for item in result["pages"]
+            }
+            relevant_pages = []
+            for doc_index, doc in enumerate(candidate_docs):
+                for page in doc["pages"]:
+                    if (doc_index, page["page_number"]) in selected:
+                        page_with_source = page.copy()
+                        page_with_source["source_document"] = doc["filename"]
+                        page_with_source["document_id"] = doc["id"]
+                        relevant_pages.append(page_with_source)
+
+            sufficient = bool(result.get("sufficient")) and bool(relevant_pages)
+            return relevant_pages, sufficient, cost
+
+        except Exception as e:
+            print(f"Error checking remembered pages: {e}")
+            return [], False, 0.0
+
     async def _process_page_chunk(
         self,
         chunk: List[Dict[str, Any]],
         question: str,
         filename: str,
         chunk_index: int,
-        chat_history: List[Dict[str, Any]] = None,
+        chat_history: ChatHistory = None,
+        model: Optional[str] = None,
+        stats: Optional[ScanStats] = None,
     ) -> tuple[List[Dict[str, Any]], float]:
-        """Process a single chunk of pages"""
-        import time
-
+        """
+        Process a single chunk of pages, retrying with jittered backoff and
+        bisecting the chunk when it keeps failing for a reason a smaller chunk
+        may avoid. Splits draw from the retry budget; pages that still cannot
+        be scanned are kept unscored and flagged scan_failed.
+        """
         chunk_start = time.time()
         print(f"    Processing chunk {chunk_index + 1} with {len(chunk)} pages...")
+        await self._materialize(chunk)
+
+        try:
+            relevant_pages, cost = await self._cascade_scan(
+                chunk, question, filename, chat_history, model, stats
+            )
+            chunk_time = time.time() - chunk_start
+            print(
+                f"    Chunk {chunk_index + 1} completed in {chunk_time:.2f}s, found {len(relevant_pages)} relevant pages"
+            )
+            return relevant_pages, cost
+
+        except Exception as e:
+            chunk_time = time.time() - chunk_start
+            print(f"    Chunk {chunk_index + 1} failed in {chunk_time:.2f}s: {e}")
+            error = e
+
+        if (
+            self.client is None
+            or is_transient_error(error)
+            or len(chunk) <= self.chunk_min_split_size
+            or not self.retry_budget.try_withdraw()
+        ):
+            # Splitting cannot help (or the budget is spent): keep the pages
+            # flagged, ranked after every scored page
+            record_fallback("page_detection")
+            metrics.incr("page_scan_failed_pages", len(chunk))
+            failed_pages = []
+            for page in chunk:
+                page_with_source = page.copy()
+                page_with_source["source_document"] = page.get("source_document") or filename
+                page_with_source["scan_failed"] = True
+                failed_pages.append(page_with_source)
+            return failed_pages, 0.0
+
+        # Bisect the failing chunk and scan both halves independently
+        middle = len(chunk) // 2
+        print(f"    Splitting chunk {chunk_index + 1} into halves of {middle} and {len(chunk) - middle} pages")
+        halves = await asyncio.gather(
+            self._process_page_chunk(
+                chunk[:middle], question, filename, chunk_index, chat_history, model, stats
+            ),
+            self._process_page_chunk(
+                chunk[middle:], question, filename, chunk_index, chat_history, model, stats
+            ),
+        )
+        relevant_pages = []
+        total_cost = 0.0
+        for pages, cost in halves:
+            relevant_pages.extend(pages)
+            total_cost += cost
+        return relevant_pages, total_cost
+
+    async def _materialize(self, pages: List[Dict[str, Any]]):
+        """
+        Extract lazily stored pages (pdf_store.LazyPage) in a worker thread,
+        so each chunk's PDF extraction overlaps other chunks' LLM calls
+        instead of blocking the event loop.
+        """
+        pending = [page for page in pages if getattr(page, "materialized", True) is False]
+        if pending:
+            await asyncio.to_thread(lambda: [page["text"] for page in pending])
+
+    def new_scan_stats(self, model: Optional[str] = None) -> ScanStats:
+        """Cascade accounting for one request; no screen if it is the scan model"""
+        model = model or self.scan_model
+        screen = self.screen_model if self.screen_model != model else None
+        return ScanStats(screen or None, model)
+
+    def scan_passes(self, documents: List[Dict[str, Any]], model: str) -> Dict[str, Any]:
+        """
+        The step 2 passes run besides the chunk scans, for
+        RequestBudget.plan_chunk_caps: the screen model, the pages per
+        document with a digest, and the TOC pass settings
+        """
+        stats = self.new_scan_stats(model)
+        digested_pages = {}
+        if self.digest_model and len(self.digests):
+            for doc in documents:
+                # Lazily extracted pages are never digested
+                digested_pages[doc["id"]] = sum(
+                    1
+                    for page in doc["pages"]
+                    if isinstance(page, dict) and self.digests.has(page["text"])
+                )
+        return {
+            "screen_model": stats.screen_model,
+            "digest_model": stats.screen_model or model,
+            "digested_pages": digested_pages,
+            "toc_model": self.toc_model,
+            "toc_min_pages": self.toc_min_pages,
+        }
+
+    async def _cascade_scan(
+        self,
+        chunk: List[Dict[str, Any]],
+        question: str,
+        filename: str,
+        chat_history: ChatHistory,
+        model: str,
+        stats: ScanStats,
+    ) -> tuple[List[Dict[str, Any]], float]:
+        """
+        Screen a chunk with the cheap model, then rescan only the pages it
+        scored as borderline with `model`. Confident pages keep the screen's
+        score and pages scored below the band are dropped.
+        """
+        stats.chunks += 1
+        if not stats.screen_model:
+            pages, cost = await self._scan_chunk_with_retries(
+                chunk, question, filename, chat_history, model
+            )
+            stats.scan_cost += cost
+            return pages, cost
+
+        screened, screen_cost = await self._scan_chunk_with_retries(
+            chunk, question, filename, chat_history, stats.screen_model
+        )
+        stats.screen_cost += screen_cost
+        def key(page):
+            # Packed chunks hold pages of several documents
+            return page.get("pack_document"), page.get("page_number")
+
+        confident = []
+        borderline = set()
+        for page in screened:
+            if page["relevance_score"] >= self.escalate_max:
+                confident.append(page)
+            elif page["relevance_score"] >= self.escalate_min:
+                borderline.add(key(page))
+        if not borderline:
+            return confident, screen_cost
+
+        stats.escalated_chunks += 1
+        stats.escalated_pages += len(borderline)
+        recheck = [page for page in chunk if key(page) in borderline]
+        try:
+            escalated, scan_cost = await self._scan_chunk_with_retries(
+                recheck, question, filename, chat_history, model
+            )
+        except Exception as e:
+            # Keep the screen's verdict rather than losing the pages
+            print(f"    Escalation to {model} failed, keeping screened pages: {e}")
+            return confident + [
+                page for page in screened if key(page) in borderline
+            ], screen_cost
+        stats.scan_cost += scan_cost
+        pages = sorted(confident + escalated, key=key)
+        return pages, screen_cost + scan_cost
+
+    async def _scan_chunk_with_retries(
+        self,
+        chunk: List[Dict[str, Any]],
+        question: str,
+        filename: str,
+        chat_history: ChatHistory = None,
+        model: Optional[str] = None,
+        digests: Optional[Dict[int, str]] = None,
+    ) -> tuple[List[Dict[str, Any]], float]:
+        """Run a hedged, timed-out chunk scan, retrying while the budget allows"""
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await hedged_call(
+                    lambda: self._scan_chunk(
+                        chunk, question, filename, chat_history, model, digests
+                    ),
+                    timeout=self.chunk_timeout,
+                    hedge_delay=self.chunk_latency.percentile(95),
+                    budget=self.retry_budget,
+                )
+            except Exception as e:
+                attempt += 1
+                if attempt > self.chunk_max_retries or not self.retry_budget.try_withdraw():
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"    Retrying chunk scan in {delay:.2f}s after error: {e!r}")
+                await asyncio.sleep(delay)
+
+    async def _scan_chunk(
+        self,
+        chunk: List[Dict[str, Any]],
+        question: str,
+        filename: str,
+        chat_history: ChatHistory = None,
+        model: Optional[str] = None,
+        digests: Optional[Dict[int, str]] = None,
+    ) -> tuple[List[Dict[str, Any]], float]:
+        """
+        Single LLM call that selects relevant pages from a chunk, reading the
+        pages' digests instead of their text when `digests` is given. Without
+        a `filename` the chunk is packed from several documents and each page
+        is labeled with its source_document.
+        """
+        packed = filename is None
+        model = model or self.model
+        call_start = time.time()
 
         # Prepare content for LLM
         pages_content = []
@@ -191,28 +1289,36 @@ class LLMService:
                 print(f"Warning: page missing 'text': {page.keys()}")
                 continue
 
-            pages_content.append(
-                {
-                    "page_number": page["page_number"],
-                    "page_content": (page["text"]),
+            entry = {
+                "page_number": page["page_number"],
+                "page_content": (
+                    digests[page["page_number"]] if digests else page["text"]
+                ),
+            }
+            if packed:
+                entry = {
+                    "document": page["pack_document"],
+                    "filename": page["source_document"],
+                    **entry,
                 }
-            )
+            pages_content.append(entry)
 
         # Format chat history for context
-        history_context = ""
-        if chat_history:
-            history_context = "\n\nRecent Chat History:\n"
-            for msg in chat_history:
-                if hasattr(msg, "role"):
-                    role = msg.role
-                    content = msg.content
-                else:
-                    role = msg.get("role", "unknown")
-                    content = msg.get("content", "")
-                history_context += f"{role.capitalize()}: {content}...\n"
+        history_context = format_history(chat_history, "Recent Chat History:", "...")
 
+        pages_label = (
+            "page digests (summary, headings, entities and numbers of each page)"
+            if digests
+            else "pages"
+        )
+        source = (
+            "several documents (each page names its document number and filename)"
+            if packed
+            else f'document "{filename}"'
+        )
+        page_label = "document number and page number" if packed else "page number"
         prompt = f"""
-            Analyze the following pages from document "{filename}" and determine 
+            Analyze the following {pages_label} from {source} and determine 
             which pages are relevant to the current question, considering the conversation context. 
             Return empty array if no pages are relevant.
             
@@ -228,45 +1334,64 @@ class LLMService:
             {json.dumps(pages_content, indent=2)}
             <Document Page Content>
 
-            Return a JSON array of page numbers relevant to the current question
-            Only return the JSON array, no other text.
-            Example: [1, 3, 5]
+            For each page relevant to the current question, return its {page_label},
+            a relevance score from 0.0 (barely related) to 1.0 (directly answers
+            the question) and a short justification quoting the relevant span.
             """
 
-        try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-            )
+        response = await self._create_completion(
+            PRIORITY_SCAN,
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            response_format={
+                "type": "json_schema",
+                "json_schema": PACKED_PAGE_SCAN_SCHEMA if packed else PAGE_SCAN_SCHEMA,
+            },
+        )
 
-            relevant_page_numbers = json.loads(response.choices[0].message.content)
-            cost = self.calculate_cost(response.usage, model=self.model)
-
-            # Add full page data for relevant pages
-            relevant_pages = []
-            for page in chunk:
-                if "page_number" not in page:
-                    continue
-                if page["page_number"] in relevant_page_numbers:
-                    page_with_source = page.copy()
-                    page_with_source["source_document"] = filename
-                    relevant_pages.append(page_with_source)
+        message = response.choices[0].message
+        if not message.content:
+            raise Exception(f"Page scan returned no content: {message.refusal}")
+        scored = {}
+        for entry in json.loads(message.content)["pages"]:
+            scored[(entry.get("document"), entry["page_number"])] = entry
+        cost = self.calculate_cost(response.usage, model=model)
+        self.chunk_latency.record(time.time() - call_start)
 
-            chunk_time = time.time() - chunk_start
-            print(
-                f"    Chunk {chunk_index + 1} completed in {chunk_time:.2f}s, found {len(relevant_pages)} relevant pages"
+        # Add full page data for relevant pages
+        relevant_pages = []
+        for page in chunk:
+            if "page_number" not in page:
+                continue
+            entry = scored.get(
+                (page["pack_document"] if packed else None, page["page_number"])
             )
-            return relevant_pages, cost
+            if entry is not None:
+                page_with_source = page.copy()
+                page_with_source["source_document"] = page.get("source_document") or filename
+                page_with_source["relevance_score"] = min(1.0, max(0.0, entry["relevance"]))
+                page_with_source["relevance_reason"] = entry["justification"]
+                relevant_pages.append(page_with_source)
 
-        except Exception as e:
-            chunk_time = time.time() - chunk_start
-            print(f"    Chunk {chunk_index + 1} failed in {chunk_time:.2f}s: {e}")
-            # Fallback: include first page of chunk
-            if chunk:
-                first_page = chunk[0].copy()
-                first_page["source_document"] = filename
-                return [first_page], 0.0
-            return [], 0.0
+        return relevant_pages, cost
+
+    def rank_pages(
+        self, relevant_pages: List[Dict[str, Any]], top_k: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Most relevant pages first, keeping the top `top_k` (ANSWER_TOP_K)"""
+        if top_k is None:
+            top_k = self.answer_top_k
+        ranked = sorted(
+            relevant_pages,
+            key=lambda page: (
+                not page.get("scan_failed"),
+                page.get("relevance_score", UNSCORED_RELEVANCE),
+            ),
+            reverse=True,
+        )
+        if len(ranked) > top_k:
+            print(f"Keeping top {top_k} of {len(ranked)} relevant pages")
+        return ranked[:top_k]
 
     async def generate_answer_stream(
         self,
@@ -286,18 +1411,24 @@ class LLMService:
             return
 
         # Format chat history for conversational context
-        history_context = ""
-        if chat_history:
-            history_context = "\n\nConversation History:\n"
-            for msg in chat_history:  # Include last 4 messages for context
-                if hasattr(msg, "role"):
-                    role = msg.role
-                    content = msg.content
-                else:
-                    role = msg.get("role", "unknown")
-                    content = msg.get("content", "")
-                history_context += f"{role.capitalize()}: {content}\n"
+        history_context = format_history(chat_history, "Conversation History:")
         print(relevant_pages)
+
+        # Only send the fields the answer needs, not extraction metadata
+        answer_context = []
+        for page in relevant_pages:
+            entry = {
+                "source_document": page.get("source_document"),
+                "page_number": page["page_number"],
+            }
+            if page.get("passages"):
+                entry["passages"] = page["passages"]
+            else:
+                entry["text"] = page["text"]
+            if page.get("also_in"):
+                entry["also_in"] = page["also_in"]
+            answer_context.append(entry)
+
         prompt = f"""
             Based on the following chat history context, PDF document context, and current question, answer the question. 
             Provide answer and cite which documents and pages you're referencing.
@@ -310,6 +1441,13 @@ class LLMService:
             - For multiple pages: $PAGE_STARTanalysis.pdf:2,7,12$PAGE_END 
             - For page range: $PAGE_STARTmanual.pdf:15-18$PAGE_END
 
+            Long pages are given as "passages": excerpts with their line range on
+            the page. When a citation comes from one passage, add its lines to
+            the reference, e.g. $PAGE_STARTreport.pdf:5#L12-18$PAGE_END
+
+            A page with an "also_in" list has near-identical text at those
+            "filename:page" locations; cite them too where relevant.
+
             <Chat History>
             {history_context}
             <Chat History>
@@ -319,34 +1457,52 @@ class LLMService:
             <Current Question>
 
             <Document Page Content>
-            {json.dumps(relevant_pages)}
+            {json.dumps(answer_context)}
             <Document Page Content>
 
             Please provide answer based on the information in the documents and use the special page reference format when citing specific pages.
             No need to mention the chat history in the answer, just focus on the current question.
             """
 
+        messages = [{"role": "user", "content": prompt}]
+        stream = None
         try:
-            stream = await self.client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-                stream_options={"include_usage": True},
-            )
+            # The answer holds its slot for the whole stream and jumps ahead
+            # of queued page scans, since it gates time-to-first-token
+            async with self._llm_slot(PRIORITY_ANSWER, messages):
+                stream = await self._create_completion(
+                    None,
+                    # A cancelled stream is counted once, below
+                    record_cancelled=False,
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
 
-            async for chunk in stream:
-                if chunk.usage:
-                    yield {
-                        "type": "cost",
-                        "cost": self.calculate_cost(chunk.usage, model=model),
-                    }
-                if len(chunk.choices) > 0:
-                    if chunk.choices[0].delta.content is not None:
+                async for chunk in stream:
+                    if chunk.usage:
                         yield {
-                            "type": "content",
-                            "content": chunk.choices[0].delta.content,
+                            "type": "cost",
+                            "cost": self.calculate_cost(chunk.usage, model=model),
                         }
+                    if len(chunk.choices) > 0:
+                        if chunk.choices[0].delta.content is not None:
+                            yield {
+                                "type": "content",
+                                "content": chunk.choices[0].delta.content,
+                            }
 
+        except asyncio.CancelledError:
+            scope = current_scope()
+            if scope:
+                scope.record_cancelled_call("answer_stream")
+            raise
         except Exception as e:
+            record_fallback("answer_generation")
             yield {"type": "content", "content": f"Error generating answer: {str(e)}"}
             yield {"type": "cost", "cost": 0.0}
+        finally:
+            # Close the HTTP response so OpenAI stops generating
+            if stream is not None:
+                await stream.close()
@@ -0,0 +1,411 @@
+"""
+Load test for the FastAPI backend against a local fake OpenAI server.
+
+By default this starts fake_openai.py and `uvicorn main:app` as
+subprocesses, uploads a generated PDF corpus, then drives /upload and
+/chat/stream at each concurrency level:
+
+    python load_test.py --concurrency 1,4,16,64 --requests 40
+    python load_test.py --workers 4 --fake-args "--latency-ms 300 --rate-limit 0.05"
+    python load_test.py --target http://127.0.0.1:8000 --pid 1234
+
+Per level it reports p50/p95/p99 time to first SSE event (TTFE), time to
+first answer token (TTFT) and total latency, upload latency, throughput,
+errors, and the backend's CPU use and peak RSS (from /proc, Linux only).
+
+Every chat request asks a unique question (it carries a request number), and
+the backend started here runs with the answer cache off
+(ANSWER_CACHE_MAX_ENTRIES=0), so the levels measure the pipeline rather than
+cache replays. A backend given with --target should have its cache off too.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+_WORDS = (
+    "pump valve pressure flow maintenance warranty safety install motor "
+    "sensor filter seal bearing torque voltage schedule inspection manual"
+).split()
+# Numbers every chat question, so no two requests share an answer cache key
+_request_numbers = itertools.count(1)
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """Minimal text-only PDF, enough for PyPDF2 to extract the lines"""
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>", None]
+    page_ids = []
+    for lines in pages:
+        ops = ["BT /F1 11 Tf 50 750 Td 14 TL"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"({escaped}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 1 0 R >> >> >>" % (len(objects))
+        )
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % i for i in page_ids),
+        len(page_ids),
+    )
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        len(objects),
+        xref,
+    )
+    with open(path, "wb") as file:
+        file.write(out)
+
+
+def make_corpus(directory: str, documents: int, pages: int) -> List[str]:
+    rng = random.Random(7)
+    paths = []
+    for doc in range(documents):
+        path = os.path.join(directory, f"manual_{doc + 1}.pdf")
+        write_pdf(
+            path,
+            [
+                [" ".join(rng.choice(_WORDS) for _ in range(12)) for _ in range(30)]
+                for _ in range(pages)
+            ],
+        )
+        paths.append(path)
+    return paths
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class ProcessSampler:
+    """CPU and RSS of a process and its children, read from /proc"""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.enabled = pid is not None and os.path.exists(f"/proc/{pid}")
+        self.ticks = os.sysconf("SC_CLK_TCK") if self.enabled else 100
+        self.peak_rss_mb = 0.0
+        self._cpu_start = None
+        self._time_start = None
+
+    def _tree(self) -> List[int]:
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as file:
+                        ppid = int(file.read().rsplit(")", 1)[1].split()[1])
+                    children.setdefault(ppid, []).append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    pass
+        tree, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            tree.append(pid)
+            stack.extend(children.get(pid, []))
+        return tree
+
+    def _cpu_seconds(self, pids: List[int]) -> float:
+        total = 0
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/stat") as file:
+                    fields = file.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+            except (OSError, IndexError):
+                pass
+        return total / self.ticks
+
+    def _rss_mb(self, pids: List[int]) -> float:
+        total = 0
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/status") as file:
+                    for line in file:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1])
+            except OSError:
+                pass
+        return total / 1024
+
+    def start(self):
+        self.peak_rss_mb = 0.0
+        if self.enabled:
+            self._cpu_start = self._cpu_seconds(self._tree())
+            self._time_start = time.monotonic()
+
+    def sample(self):
+        if self.enabled:
+            self.peak_rss_mb = max(self.peak_rss_mb, self._rss_mb(self._tree()))
+
+    def cpu_percent(self) -> Optional[float]:
+        if not self.enabled:
+            return None
+        elapsed = time.monotonic() - self._time_start
+        used = self._cpu_seconds(self._tree()) - self._cpu_start
+        return 100 * used / elapsed if elapsed > 0 else None
+
+
+async def upload(client: httpx.AsyncClient, paths: List[str]) -> dict:
+    files = [("files", (os.path.basename(p), open(p, "rb"), "application/pdf")) for p in paths]
+    start = time.perf_counter()
+    try:
+        response = await client.post("/upload", files=files, data={"description": "Equipment manuals"})
+        response.raise_for_status()
+        return {"kind": "upload", "total": time.perf_counter() - start, "body": response.json()}
+    finally:
+        for _, (_, handle, _) in files:
+            handle.close()
+
+
+async def chat(client: httpx.AsyncClient, body: dict) -> dict:
+    result = {"kind": "chat", "ttfe": None, "ttft": None, "error": None}
+    start = time.perf_counter()
+    async with client.stream("POST", "/chat/stream", json=body) as response:
+        if response.status_code != 200:
+            result["error"] = f"HTTP {response.status_code}"
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            now = time.perf_counter() - start
+            if result["ttfe"] is None:
+                result["ttfe"] = now
+            event = json.loads(line[6:])
+            if event["type"] == "content" and result["ttft"] is None:
+                result["ttft"] = now
+            elif event["type"] == "error":
+                result["error"] = event["error"]
+    result["total"] = time.perf_counter() - start
+    return result
+
+
+async def run_level(
+    base_url: str,
+    concurrency: int,
+    requests: int,
+    upload_share: float,
+    corpus: List[str],
+    documents: list,
+    sampler: ProcessSampler,
+) -> dict:
+    questions = [f"What does the manual say about {w} {random.choice(_WORDS)}?" for w in _WORDS]
+    jobs = ["upload" if i < requests * upload_share else "chat" for i in range(requests)]
+    random.shuffle(jobs)
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    results, errors = [], []
+
+    async def worker(client):
+        while not queue.empty():
+            job = queue.get_nowait()
+            try:
+                if job == "upload":
+                    outcome = await upload(client, corpus[:1])
+                    outcome.pop("body")
+                else:
+                    outcome = await chat(
+                        client,
+                        {
+                            "question": (
+                                f"{random.choice(questions)} (request {next(_request_numbers)})"
+                            ),
+                            "documents": documents,
+                            "description": "Equipment manuals",
+                        },
+                    )
+                if outcome.get("error"):
+                    errors.append(outcome["error"])
+                results.append(outcome)
+            except Exception as e:
+                errors.append(repr(e))
+
+    async def sample_loop():
+        while True:
+            sampler.sample()
+            await asyncio.sleep(0.5)
+
+    sampler.start()
+    sampling = asyncio.create_task(sample_loop())
+    start = time.perf_counter()
+    limits = httpx.Limits(max_connections=concurrency + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    sampling.cancel()
+    sampler.sample()
+
+    chats = [r for r in results if r["kind"] == "chat" and not r.get("error")]
+    uploads = [r for r in results if r["kind"] == "upload"]
+
+    def stats(values):
+        return {f"p{p}": percentile(values, p) for p in (50, 95, 99)}
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:3],
+        "elapsed_s": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else None,
+        "ttfe_s": stats([r["ttfe"] for r in chats if r["ttfe"] is not None]),
+        "ttft_s": stats([r["ttft"] for r in chats if r["ttft"] is not None]),
+        "chat_total_s": stats([r["total"] for r in chats]),
+        "upload_total_s": stats([r["total"] for r in uploads]),
+        "cpu_percent": sampler.cpu_percent(),
+        "peak_rss_mb": sampler.peak_rss_mb if sampler.enabled else None,
+    }
+
+
+def _wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+def _fmt(value: Optional[float], scale: float = 1000) -> str:
+    return "-" if value is None else f"{value * scale:.0f}"
+
+
+def print_report(rows: List[dict]):
+    print(
+        f"\n{'conc':>5}{'reqs':>6}{'err':>5}{'rps':>7}"
+        f"{'TTFE p50/p95/p99 ms':>22}{'TTFT p50/p95/p99 ms':>22}"
+        f"{'total p50/p95/p99 ms':>23}{'upload p50 ms':>15}{'cpu%':>7}{'rss MB':>8}"
+    )
+    def triple(stats):
+        return "/".join(_fmt(stats[f"p{p}"]) for p in (50, 95, 99))
+
+    for row in rows:
+        print(
+            f"{row['concurrency']:>5}{row['requests']:>6}{row['errors']:>5}"
+            f"{row['throughput_rps']:>7.2f}{triple(row['ttfe_s']):>22}"
+            f"{triple(row['ttft_s']):>22}{triple(row['chat_total_s']):>23}"
+            f"{_fmt(row['upload_total_s']['p50']):>15}"
+            f"{_fmt(row['cpu_percent'], 1):>7}{_fmt(row['peak_rss_mb'], 1):>8}"
+        )
+        for sample in row["error_samples"]:
+            print(f"      error: {sample[:120]}")
+
+
+async def run(args, base_url: str, sampler: ProcessSampler) -> List[dict]:
+    corpus_dir = tempfile.mkdtemp(prefix="loadtest-")
+    corpus = make_corpus(corpus_dir, args.documents, args.pages)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        documents = (await upload(client, corpus))["body"]["documents"]
+    print(f"Uploaded {len(documents)} documents of {args.pages} pages")
+
+    rows = []
+    for level in args.concurrency:
+        print(f"Running concurrency {level}...")
+        rows.append(
+            await run_level(
+                base_url, level, args.requests, args.upload_share, corpus, documents, sampler
+            )
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", default="1,4,16", type=lambda s: [int(x) for x in s.split(",")])
+    parser.add_argument("--requests", type=int, default=20, help="Requests per level")
+    parser.add_argument("--upload-share", type=float, default=0.1, help="Share of requests that are uploads")
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--target", help="Test an already running backend instead of starting one")
+    parser.add_argument("--pid", type=int, help="Backend PID for CPU/RSS when using --target")
+    parser.add_argument("--port", type=int, default=8300)
+    parser.add_argument("--workers", type=int, default=1, help="Uvicorn workers for the started backend")
+    parser.add_argument("--fake-port", type=int, default=8100)
+    parser.add_argument("--fake-args", default="", help="Extra arguments for fake_openai.py")
+    parser.add_argument("--json", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    processes = []
+    try:
+        if args.target:
+            base_url = args.target.rstrip("/")
+            pid = args.pid
+        else:
+            fake = subprocess.Popen(
+                [sys.executable, os.path.join(HERE, "fake_openai.py"), "--port", str(args.fake_port)]
+                + shlex.split(args.fake_args),
+                cwd=HERE,
+            )
+            processes.append(fake)
+            env = dict(
+                os.environ,
+                OPENAI_API_KEY="loadtest",
+                OPENAI_BASE_URL=f"http://127.0.0.1:{args.fake_port}/v1",
+                # Measure the pipeline, not answer cache replays
+                ANSWER_CACHE_MAX_ENTRIES="0",
+            )
+            backend = subprocess.Popen(
+                [
+                    sys.executable, "-m", "uvicorn", "main:app",
+                    "--port", str(args.port), "--workers", str(args.workers),
+                    "--log-level", "warning",
+                ],
+                cwd=HERE,
+                env=env,
+                stdout=subprocess.DEVNULL,
+            )
+            processes.append(backend)
+            base_url = f"http://127.0.0.1:{args.port}"
+            _wait_ready(f"http://127.0.0.1:{args.fake_port}/stats")
+            _wait_ready(f"{base_url}/health")
+            pid = backend.pid
+
+        rows = asyncio.run(run(args, base_url, ProcessSampler(pid)))
+        print_report(rows)
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump(rows, file, indent=2)
+            print(f"Saved results to {args.json}")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,16 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    File,
+    UploadFile,
+    HTTPException,
+    Form,
+    Request,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from typing import List
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
 import json
 import tempfile
 import os
@@ -14,9 +23,29 @@ from models import (
     DocumentPage,
 )
 from pdf_processor import PDFProcessor
+from dedup import find_duplicates
+from collection_store import load_collections
+from pdf_store import LAZY_PAGE_THRESHOLD, PdfStore
 from llm_service import LLMService
+from budget import RequestBudget
+from chat_pipeline import chat_pipeline
+from disconnect import RequestScope, stream_until_disconnect
+from answer_cache import AnswerCache, collection_hash
+from admission import AdmissionController, estimate_request_tokens
+from metrics import metrics
+from ingest import IngestionQueue, job_progress
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Resume ingestion jobs left queued or interrupted by a restart
+    await ingestion_queue.start()
+    yield
+    await ingestion_queue.stop()
+    await llm_service.work_queue.close()
+
 
-app = FastAPI(title="PDF Chatbot API")
+app = FastAPI(title="PDF Chatbot API", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -38,13 +67,118 @@ app.add_middleware(
 pdf_processor = PDFProcessor()
 llm_service = LLMService()
 
+# Prebuilt collections (see build_collection.py), memory-mapped at startup
+collection_stores = load_collections(os.environ.get("COLLECTION_PATHS", ""))
+
+# Uploaded PDFs kept server-side for lazy page extraction
+pdf_store = PdfStore(os.environ.get("PDF_STORE_DIR") or None)
+lazy_page_threshold = int(os.environ.get("LAZY_PAGE_THRESHOLD", LAZY_PAGE_THRESHOLD))
+
+# Final answers replayed for repeated questions against the same documents
+answer_cache = AnswerCache()
+admission = AdmissionController()
+
+
+def extract_upload(
+    pdf_path: str, filename: str, document_id: int, lazy: Optional[bool]
+) -> Dict[str, Any]:
+    """
+    Extract one uploaded PDF. In lazy mode (`lazy=True`, or automatically for
+    PDFs with at least LAZY_PAGE_THRESHOLD pages) the PDF is kept server-side
+    and only its outline and sampled pages are extracted.
+    """
+    if lazy or (
+        lazy is None and pdf_processor.count_pages(pdf_path) >= lazy_page_threshold
+    ):
+        stored = pdf_store.add(pdf_path, filename)
+        print(
+            f"{filename}: stored for lazy extraction, "
+            f"{len(stored['samples'])} of {stored['total_pages']} pages sampled"
+        )
+        return {
+            "id": document_id,
+            "filename": filename,
+            "pages": stored["samples"],
+            "total_pages": stored["total_pages"],
+            "store_id": stored["store_id"],
+            "outline": stored["outline"],
+            "toc": stored["toc"],
+        }
+
+    # Extract and normalize text from PDF
+    pages_data, stats = pdf_processor.extract_document(pdf_path)
+    print(
+        f"{filename}: normalization saved ~{stats['estimated_tokens_saved']} tokens, "
+        f"{len(stats['blank_pages'])} blank pages"
+    )
+    return {
+        "id": document_id,
+        "filename": filename,
+        "pages": pages_data,
+        "normalization": stats,
+        "toc": pdf_processor.extract_toc(pdf_path),
+    }
+
+
+def build_upload_response(extracted: List[Dict[str, Any]], message: str) -> UploadResponse:
+    """Dedup the extracted documents and convert them for the client"""
+    # Record near-duplicate pages and documents across the upload (lazy
+    # documents are only sampled, so they are left out)
+    duplicates = find_duplicates([doc for doc in extracted if not doc.get("store_id")])
+    print(
+        f"Dedup: {duplicates['duplicate_pages']} duplicate pages, "
+        f"{duplicates['duplicate_documents']} duplicate documents"
+    )
+    documents = [
+        DocumentData(
+            id=doc["id"],
+            filename=doc["filename"],
+            pages=[
+                DocumentPage(
+                    page_number=page["page_number"],
+                    text=page["text"],
+                    is_blank=page["is_blank"],
+                    duplicate_of=page.get("duplicate_of"),
+                    extraction_error=page.get("extraction_error"),
+                )
+                for page in doc["pages"]
+            ],
+            total_pages=doc.get("total_pages", len(doc["pages"])),
+            normalization=doc.get("normalization"),
+            duplicate_of=doc.get("duplicate_of"),
+            store_id=doc.get("store_id"),
+            outline=doc.get("outline"),
+            toc=doc.get("toc") or None,
+        )
+        for doc in extracted
+    ]
+    return UploadResponse(documents=documents, message=message, duplicates=duplicates)
+
+
+async def finish_ingestion(extracted: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Result of an ingestion job: the /upload response, digests in the background"""
+    # Dedup fingerprints every page (CPU-bound): keep it off the event loop
+    result = await asyncio.to_thread(
+        lambda: build_upload_response(
+            extracted, f"Successfully processed {len(extracted)} documents"
+        ).model_dump()
+    )
+    for doc in extracted:
+        if not doc.get("store_id"):
+            task = asyncio.create_task(
+                llm_service.build_digests(doc["pages"], doc["filename"])
+            )
+            background_jobs.add(task)
+            task.add_done_callback(background_jobs.discard)
+    return result
 
-@app.post("/upload", response_model=UploadResponse)
-async def upload_documents(
-    files: List[UploadFile] = File(...), description: str = Form(...)
-):
-    """Process PDF documents and return extracted text to client"""
 
+# Background ingestion: uploads queued in SQLite and extracted by a local pool
+ingestion_queue = IngestionQueue(extract_upload, finish_ingestion)
+background_jobs = set()
+
+
+def validate_upload(files: List[UploadFile]):
     if len(files) > 100:
         raise HTTPException(status_code=400, detail="Maximum 100 documents allowed")
 
@@ -53,8 +187,25 @@ async def upload_documents(
         if not file.filename.endswith(".pdf"):
             raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
+
+@app.post("/upload", response_model=UploadResponse)
+async def upload_documents(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    description: str = Form(...),
+    lazy: Optional[bool] = Form(None),
+):
+    """
+    Process PDF documents and return extracted text to client.
+
+    Lazy mode is described in extract_upload. Fully extracted documents get
+    per-page digests built in the background. For large batches use
+    /ingest, which returns a job id right away.
+    """
+    validate_upload(files)
+
     # Process files and extract text
-    documents = []
+    extracted = []
     for i, file in enumerate(files):
         # Create temporary file for processing
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
@@ -62,22 +213,9 @@ async def upload_documents(
             temp_file_path = temp_file.name
 
         try:
-            # Extract text from PDF
-            pages_data = pdf_processor.extract_pages(temp_file_path)
-
-            # Convert to DocumentPage objects
-            pages = [
-                DocumentPage(page_number=page["page_number"], text=page["text"])
-                for page in pages_data
-            ]
-
-            documents.append(
-                DocumentData(
-                    id=i + 1,
-                    filename=file.filename,
-                    pages=pages,
-                    total_pages=len(pages),
-                )
+            # Extraction blocks (sandbox round trips); keep the event loop free
+            extracted.append(
+                await asyncio.to_thread(extract_upload, temp_file_path, file.filename, i + 1, lazy)
             )
         except Exception as e:
             print(f"PDF processing error for {file.filename}: {str(e)}")
@@ -91,13 +229,89 @@ async def upload_documents(
             except:
                 pass
 
-    return UploadResponse(
-        documents=documents, message=f"Successfully processed {len(files)} documents"
+    for doc in extracted:
+        if not doc.get("store_id"):
+            background_tasks.add_task(
+                llm_service.build_digests, doc["pages"], doc["filename"]
+            )
+
+    return await asyncio.to_thread(
+        build_upload_response, extracted, f"Successfully processed {len(files)} documents"
+    )
+
+
+@app.post("/ingest")
+async def ingest_documents(
+    files: List[UploadFile] = File(...),
+    description: str = Form(...),
+    lazy: Optional[bool] = Form(None),
+):
+    """
+    Queue PDF documents for background extraction and return a job id
+    immediately. Poll GET /ingest/{job_id} (or stream /ingest/{job_id}/events)
+    for per-file progress; the finished job's result has the same shape as
+    the /upload response.
+    """
+    validate_upload(files)
+    contents = [(file.filename, await file.read()) for file in files]
+    job_id = await ingestion_queue.submit(description, lazy, contents)
+    print(f"Ingestion job {job_id} queued with {len(contents)} files")
+    return {"job_id": job_id, "status": "queued", "files": len(contents)}
+
+
+async def _ingestion_job(job_id: str) -> Dict[str, Any]:
+    job = await ingestion_queue.job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingestion job")
+    return job
+
+
+@app.get("/ingest/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """Job status and per-file progress; includes `result` once complete"""
+    job = await _ingestion_job(job_id)
+    progress = job_progress(job)
+    if job["status"] == "complete":
+        progress["result"] = json.loads(job["result"])
+    return progress
+
+
+@app.get("/ingest/{job_id}/events")
+async def stream_ingestion_job(job_id: str, http_request: Request):
+    """Server-sent progress events until the job completes or fails"""
+    await _ingestion_job(job_id)
+
+    async def events():
+        last = None
+        while True:
+            job = await ingestion_queue.job(job_id)
+            if job is None:
+                # Deleted after its retention period
+                return
+            progress = job_progress(job)
+            finished = job["status"] in ("complete", "failed")
+            if finished and job["status"] == "complete":
+                progress["result"] = json.loads(job["result"])
+            if progress != last:
+                last = progress
+                yield f"data: {json.dumps(dict(progress, type='progress'))}\n\n"
+            if finished or await http_request.is_disconnected():
+                return
+            await ingestion_queue.wait_for_change(timeout=15)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/plain",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Content-Type": "text/event-stream",
+        },
     )
 
 
 @app.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(request: ChatRequest, http_request: Request):
     """Handle chat requests with streaming response - stateless"""
     import time
 
@@ -106,172 +320,91 @@ async def chat_stream(request: ChatRequest):
     print(f"📝 Question: {request.question}")
     print(f"📊 Received {len(request.documents)} documents")
 
-    async def stream_response():
-        try:
-            total_cost = 0.0
-
-            # Convert DocumentData to the format expected by LLMService
-            documents_dict = []
-            for doc in request.documents:
-                pages_dict = []
-                for page in doc.pages:
-                    pages_dict.append(
-                        {"page_number": page.page_number, "text": page.text}
-                    )
-
-                documents_dict.append(
-                    {
-                        "id": doc.id,
-                        "filename": doc.filename,
-                        "pages": pages_dict,
-                        "total_pages": doc.total_pages,
-                    }
-                )
-
-            # Step 1: Select relevant documents
-            step1_start = time.time()
-            doc_selection_status = {
-                "type": "status",
-                "step": "document_selection",
-                "message": "Finding relevant documents...",
-                "step_number": 1,
-                "total_steps": 3,
-            }
-            yield f"data: {json.dumps(doc_selection_status)}\n\n"
-
-            print("Step 1: Starting document selection...")
-            selected_docs, step1_cost = await llm_service.select_documents(
-                request.description,
-                documents_dict,
-                request.question,
-                request.chat_history,
+    store = None
+    if request.collection:
+        store = collection_stores.get(request.collection)
+        if store is None:
+            raise HTTPException(
+                status_code=404, detail=f"Unknown collection: {request.collection}"
             )
-            total_cost += step1_cost
-            step1_time = time.time() - step1_start
-            print(f"Step 1 complete in {step1_time:.2f}s")
-
-            # Send completion status for document selection
-            doc_selection_complete = {
-                "type": "step_complete",
-                "step": "document_selection",
-                "selected_documents": [
-                    {"id": doc["id"], "filename": doc["filename"]}
-                    for doc in selected_docs
-                ],
-                "cost": step1_cost,
-                "time_taken": step1_time,
-            }
-            yield f"data: {json.dumps(doc_selection_complete)}\n\n"
-
-            # Step 2: Find relevant pages
-            step2_start = time.time()
-            page_selection_status = {
-                "type": "status",
-                "step": "page_selection",
-                "message": "Finding relevant pages in selected documents...",
-                "step_number": 2,
-                "total_steps": 3,
-            }
-            yield f"data: {json.dumps(page_selection_status)}\n\n"
-
-            print("Step 2: Starting page selection...")
-            # Process documents in parallel to maintain filename context
 
-            async def process_document(doc):
-                return await llm_service.find_relevant_pages(
-                    doc["pages"],
-                    request.question,
-                    doc["filename"],
-                    request.chat_history,
-                )
-
-            # Create tasks for all documents
-            doc_tasks = [process_document(doc) for doc in selected_docs]
-
-            # Wait for all documents to complete
-            doc_results = await asyncio.gather(*doc_tasks)
-
-            # Combine results
-            all_relevant_pages = []
-            step2_cost = 0.0
-            for doc_relevant_pages, doc_cost in doc_results:
-                all_relevant_pages.extend(doc_relevant_pages)
-                step2_cost += doc_cost
-
-            relevant_pages = all_relevant_pages
-            total_cost += step2_cost
-            step2_time = time.time() - step2_start
-            print(f"Step 2 complete in {step2_time:.2f}s")
-
-            # Send completion status for page selection
-            page_selection_complete = {
-                "type": "step_complete",
-                "step": "page_selection",
-                "relevant_pages_count": len(relevant_pages),
-                "cost": step2_cost,
-                "time_taken": step2_time,
-            }
-            yield f"data: {json.dumps(page_selection_complete)}\n\n"
-
-            # Step 3: Generate answer
-            step3_start = time.time()
-            answer_generation_status = {
-                "type": "status",
-                "step": "answer_generation",
-                "message": "Generating comprehensive answer...",
-                "step_number": 3,
-                "total_steps": 3,
-            }
-            yield f"data: {json.dumps(answer_generation_status)}\n\n"
-
-            print("Step 3: Starting answer generation...")
-
-            # Stream the answer generation
-            async for chunk in llm_service.generate_answer_stream(
-                relevant_pages, request.question, request.chat_history, request.model
-            ):
-                if chunk.get("type") == "content":
-                    content_data = {
-                        "type": "content",
-                        "content": chunk["content"],
-                    }
-                    yield f"data: {json.dumps(content_data)}\n\n"
-                elif chunk.get("type") == "cost":
-                    total_cost += chunk["cost"]
-
-            step3_time = time.time() - step3_start
-            print(f"Step 3 complete in {step3_time:.2f}s")
-
-            # Send final completion
-            total_time = time.time() - start_time
-            completion_data = {
-                "type": "complete",
-                "timing_breakdown": {
-                    "document_selection": step1_time,
-                    "page_detection": step2_time,
-                    "answer_generation": step3_time,
-                    "total_time": total_time,
-                },
-                "cost_breakdown": {
-                    "document_selection": step1_cost,
-                    "page_detection": step2_cost,
-                    "answer_generation": total_cost - step1_cost - step2_cost,
-                    "total_cost": total_cost,
-                },
-            }
-            yield f"data: {json.dumps(completion_data)}\n\n"
+    # Exact answer cache: the same question, history and documents replay
+    # the stored event sequence instead of running the pipeline
+    cache_key = None
+    cached = None
+    if answer_cache.enabled:
+        collection_key = collection_hash(
+            request.documents, request.description, store.version if store else None
+        )
+        if store is not None:
+            # Only the collection's own content decides whether it changed
+            answer_cache.observe_collection(store.name, store.version)
+        cache_key = answer_cache.key(
+            collection_key,
+            request.question,
+            request.chat_history,
+            f"{request.model}:{request.max_cost}:{request.max_latency_ms}",
+        )
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            print("Answer cache hit, replaying stored response")
+
+    # Admission control: requests that cannot meet the latency target under
+    # the current load get a cheaper plan or a 429, before anything is spent
+    admitted = None
+    if cached is None and admission.enabled:
+        admitted = admission.admit(
+            estimate_request_tokens(request.documents, store.num_pages if store else 0),
+            llm_service.scheduler.queued,
+            request.max_latency_ms,
+        )
+        print(
+            f"Admission: {admitted.action} ({admitted.reason}), "
+            f"estimated {admitted.estimated_ms / 1000:.1f}s"
+        )
+        if not admitted.admitted:
+            raise HTTPException(
+                status_code=429,
+                detail="Server is busy, please retry later",
+                headers={"Retry-After": str(admitted.retry_after)},
+            )
+    degraded = admitted is not None and admitted.degraded
 
-            print(
-                f"Request completed in {total_time:.2f}s, total cost: ${total_cost:.4f}"
+    async def stream_response():
+        max_cost, max_latency_ms = request.max_cost, request.max_latency_ms
+        if degraded:
+            # Under load: cap cost and latency so the budget picks cheaper
+            # models and scans fewer chunks
+            max_cost = min(max_cost or admission.degraded_max_cost, admission.degraded_max_cost)
+            max_latency_ms = min(
+                max_latency_ms or admission.target_latency_ms, admission.target_latency_ms
             )
+        budget = RequestBudget(max_cost, max_latency_ms, llm_service.pricing)
+        if degraded:
+            budget.note("admission: degraded plan under load")
+        async for frame in chat_pipeline(
+            request, llm_service, budget, pdf_store, store, degraded, start_time
+        ):
+            yield frame
+
+    # LLM calls are fair-queued per tenant (or per request without one)
+    scope = RequestScope(
+        flow=request.tenant,
+        weight=llm_service.scheduler.weight_for(request.tenant, request.collection),
+    )
 
-        except Exception as e:
-            error_data = {"type": "error", "error": str(e)}
-            yield f"data: {json.dumps(error_data)}\n\n"
-            print(f"Error in stream_response: {str(e)}")
+    if cached is not None:
+        events = answer_cache.replay(cached)
+    elif cache_key is not None and not degraded:
+        events = answer_cache.record(cache_key, stream_response(), request.collection)
+    else:
+        events = stream_response()
+    if admitted is not None:
+        events = admission.hold(admitted.ticket, events)
 
+    # Cancel selection, page scans and the answer stream if the client leaves
     return StreamingResponse(
-        stream_response(),
+        stream_until_disconnect(events, http_request.is_disconnected, scope),
         media_type="text/plain",
         headers={
             "Cache-Control": "no-cache",
@@ -281,6 +414,49 @@ async def chat_stream(request: ChatRequest):
     )
 
 
+@app.delete("/cache")
+async def invalidate_answer_cache(collection: Optional[str] = None):
+    """Drop cached answers for one prebuilt collection, or all of them"""
+    return {"invalidated": answer_cache.invalidate(collection)}
+
+
+@app.get("/collections")
+async def list_collections():
+    """List the prebuilt collections opened at startup"""
+    return {
+        "collections": [
+            {
+                "name": name,
+                "description": store.description,
+                "documents": len(store.document_meta),
+                "pages": store.num_pages,
+                "compressed": store.compressed,
+            }
+            for name, store in collection_stores.items()
+        ]
+    }
+
+
+@app.get("/documents/{store_id}/pages/{page_number}")
+async def get_document_page(store_id: str, page_number: int):
+    """Extract (or return the cached) text of one page of a lazily stored PDF"""
+    doc = pdf_store.document(store_id)
+    if doc is None or not 1 <= page_number <= doc.total_pages:
+        raise HTTPException(status_code=404, detail="Page not found")
+    page = await asyncio.to_thread(pdf_store.page, store_id, page_number)
+    return {
+        "page_number": page["page_number"],
+        "text": page["text"],
+        "is_blank": page["is_blank"],
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Process-wide counters, e.g. LLM calls released by client disconnects"""
+    return metrics.snapshot()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
@@ -12,6 +12,9 @@ class ChatMessage(BaseModel):
 class DocumentPage(BaseModel):
     page_number: int
     text: str
+    is_blank: Optional[bool] = False  # No meaningful text after normalization
+    duplicate_of: Optional[str] = None  # "document id:page" of a near-identical page
+    extraction_error: Optional[str] = None  # Why extraction skipped the page (timeout, memory...)
 
 
 class DocumentData(BaseModel):
@@ -19,14 +22,25 @@ class DocumentData(BaseModel):
     filename: str
     pages: List[DocumentPage]
     total_pages: int
+    normalization: Optional[Dict[str, Any]] = None  # Per-document token savings
+    duplicate_of: Optional[str] = None  # Filename of a near-identical document
+    # Lazy mode: PDF kept server-side, pages are samples
+    store_id: Optional[str] = Field(None, pattern=r"^[0-9a-f]{32}$")
+    outline: Optional[List[Dict[str, Any]]] = None  # {title, page_number, level}
+    toc: Optional[List[Dict[str, Any]]] = None  # {title, level, start_page, end_page, label}
 
 
 class ChatRequest(BaseModel):
     question: str
-    documents: List[DocumentData]  # Documents sent from client
-    description: str  # Collection description
+    documents: List[DocumentData] = []  # Documents sent from client
+    description: str = ""  # Collection description
+    collection: Optional[str] = None  # Name of a prebuilt server-side collection
     chat_history: Optional[List[ChatMessage]] = []
     model: Optional[str] = "gpt-5-mini"
+    max_cost: Optional[float] = Field(None, gt=0)  # USD budget for the whole pipeline
+    max_latency_ms: Optional[int] = Field(None, gt=0)  # Wall-clock budget for the whole pipeline
+    relevance_token: Optional[str] = None  # Pages used by the previous turn
+    tenant: Optional[str] = None  # Fair-queuing flow shared by a user's requests
 
 
 class ChatResponse(BaseModel):
@@ -39,6 +53,7 @@ class ChatResponse(BaseModel):
 class UploadResponse(BaseModel):
     documents: List[DocumentData]  # Return processed documents to client
     message: str
+    duplicates: Optional[Dict[str, Any]] = None  # Near-duplicate clustering stats
 
 
 class UpdateDescriptionRequest(BaseModel):
@@ -0,0 +1,112 @@
+import re
+from typing import Any, Dict, List, Optional
+
+# Lines of context kept on each side of a matching line
+CONTEXT_LINES = 2
+# Pages at or under this size are sent whole
+MAX_PASSAGE_CHARS = 1500
+# A line quoted by the page scan's justification outweighs question words
+HINT_WEIGHT = 2.0
+
+_WORD = re.compile(r"\w+")
+_STOPWORDS = set(
+    "the and for are was were with that this what which who whom how why when "
+    "where does did from into about there their they them have has had not but "
+    "can could would should will its any all you your our also than then these "
+    "those".split()
+)
+
+
+def _terms(text: Optional[str]) -> set:
+    return {
+        word
+        for word in _WORD.findall((text or "").lower())
+        if len(word) > 2 and word not in _STOPWORDS
+    }
+
+
+def extract_passages(
+    text: str,
+    question: str,
+    hint: Optional[str] = None,
+    max_chars: int = MAX_PASSAGE_CHARS,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Pick the lines of a page that match the question (and the page scan's
+    justification, when given) plus a few lines of context, up to `max_chars`.
+
+    Returns passages as {"lines": "12-18", "text": ...} with 1-based line
+    numbers of the page text, or None when the page should be sent whole:
+    it is already small, or nothing on it matches lexically (the page was
+    judged relevant on meaning, so cutting it would be a guess).
+    """
+    if not text or len(text) <= max_chars:
+        return None
+    lines = text.split("\n")
+    question_terms = _terms(question)
+    hint_terms = _terms(hint)
+    scores = []
+    for line in lines:
+        words = _terms(line)
+        scores.append(
+            len(words & question_terms) + HINT_WEIGHT * len(words & hint_terms)
+        )
+    hits = sorted(
+        (index for index, score in enumerate(scores) if score > 0),
+        key=lambda index: -scores[index],
+    )
+    if not hits:
+        return None
+
+    selected = [False] * len(lines)
+    used_chars = 0
+    for index in hits:
+        start = max(0, index - CONTEXT_LINES)
+        end = min(len(lines), index + CONTEXT_LINES + 1)
+        added = sum(len(lines[i]) + 1 for i in range(start, end) if not selected[i])
+        if used_chars and used_chars + added > max_chars:
+            continue
+        for i in range(start, end):
+            selected[i] = True
+        used_chars += added
+
+    passages = []
+    index = 0
+    while index < len(lines):
+        if not selected[index]:
+            index += 1
+            continue
+        start = index
+        while index < len(lines) and selected[index]:
+            index += 1
+        passages.append(
+            {"lines": f"{start + 1}-{index}", "text": "\n".join(lines[start:index])}
+        )
+    return passages
+
+
+def focus_pages(
+    pages: List[Dict[str, Any]], question: str, max_chars: int = MAX_PASSAGE_CHARS
+) -> List[Dict[str, Any]]:
+    """Copies of `pages`, with `passages` set on pages that can be cut down"""
+    focused = []
+    for page in pages:
+        passages = (
+            extract_passages(
+                page.get("text", ""), question, page.get("relevance_reason"), max_chars
+            )
+            if max_chars
+            else None
+        )
+        if passages:
+            page = page.copy()
+            page["passages"] = passages
+        focused.append(page)
+    return focused
+
+
+def context_chars(page: Dict[str, Any]) -> int:
+    """Characters of a page that the answer prompt will actually carry"""
+    if page.get("passages"):
+        return sum(len(passage["text"]) for passage in page["passages"])
+    return len(page.get("text", ""))
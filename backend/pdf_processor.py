@@ -1,13 +1,73 @@
 import PyPDF2
 from typing import List, Dict, Any
 
+from pdf_sandbox import default_sandbox
+from text_normalizer import normalize_pages
+from toc import read_navigation_file
+
 
 class PDFProcessor:
     def __init__(self):
         pass
 
+    def count_pages(self, pdf_path: str) -> int:
+        """Page count without extracting any text, read in the extraction sandbox if enabled"""
+        sandbox = default_sandbox()
+        if sandbox is not None:
+            return sandbox.count_pages(pdf_path)
+        with open(pdf_path, "rb") as file:
+            return len(PyPDF2.PdfReader(file).pages)
+
+    def extract_navigation(self, pdf_path: str) -> Dict[str, List[Dict[str, Any]]]:
+        """Outline and table of contents, read in the extraction sandbox if enabled"""
+        sandbox = default_sandbox()
+        if sandbox is not None:
+            return sandbox.read_navigation(pdf_path)
+        try:
+            return read_navigation_file(pdf_path)
+        except Exception as e:
+            print(f"Could not read table of contents: {e}")
+            return {"outline": [], "toc": []}
+
+    def extract_toc(self, pdf_path: str) -> List[Dict[str, Any]]:
+        """Table of contents from the outline, named destinations and page labels"""
+        return self.extract_navigation(pdf_path)["toc"]
+
     def extract_pages(self, pdf_path: str) -> List[Dict[str, Any]]:
-        """Extract text from all pages of a PDF file"""
+        """Extract normalized text from all pages of a PDF file"""
+        pages, _ = self.extract_document(pdf_path)
+        return pages
+
+    def extract_document(
+        self, pdf_path: str, normalize: bool = True
+    ) -> tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Extract text from all pages of a PDF file, returning the pages and
+        the normalization statistics for the document. With the extraction
+        sandbox enabled, pages that exceed its time or memory limits come
+        back empty with an `extraction_error` and are listed under
+        `skipped_pages` in the statistics.
+        """
+        sandbox = default_sandbox()
+        if sandbox is not None:
+            try:
+                result = sandbox.extract(pdf_path)
+            except Exception as e:
+                raise Exception(f"Error extracting text from PDF: {str(e)}")
+            pages = []
+            for page_number in range(1, result.total_pages + 1):
+                text = result.texts.get(page_number, "")
+                page = {"page_number": page_number, "text": text, "char_count": len(text)}
+                if page_number in result.skipped:
+                    page["extraction_error"] = result.skipped[page_number]
+                pages.append(page)
+            stats = normalize_pages(pages) if normalize else {}
+            stats["skipped_pages"] = [
+                {"page_number": number, "reason": reason}
+                for number, reason in sorted(result.skipped.items())
+            ]
+            return pages, stats
+
         pages = []
 
         try:
@@ -27,7 +87,8 @@ class PDFProcessor:
         except Exception as e:
             raise Exception(f"Error extracting text from PDF: {str(e)}")
 
-        return pages
+        stats = normalize_pages(pages) if normalize else {}
+        return pages, stats
 
     def get_page_chunks(self, pages: List[Dict], chunk_size: int = 20):
         """Split pages into chunks of specified size"""
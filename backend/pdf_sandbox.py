@@ -0,0 +1,342 @@
+"""
+Page text extraction in sandboxed worker processes.
+
+A malformed page can make PyPDF2's extract_text() spin for minutes or
+balloon memory. Extraction therefore runs in separate Python processes
+(this file run as a script) with an address-space limit; the parent waits
+at most PDF_PAGE_TIMEOUT_SECONDS for each page and PDF_DOCUMENT_TIMEOUT_SECONDS
+for the whole document. A page that times out, runs out of memory or kills
+its worker is skipped and reported with a reason; the document continues on
+a fresh worker from the next page.
+
+Protocol: one JSON object per line. Requests on stdin are
+{"path": ..., "pages": [page numbers] | null}; the worker answers with
+{"total": n}, then {"page": n, "text": ...} or {"page": n, "error": reason}
+per page, and finally {"done": true} (or {"error": message} if the PDF
+cannot be opened). {"path": ..., "count": true} is answered with just
+{"total": n}, and {"path": ..., "toc": true} with
+{"outline": [entries], "toc": [sections]}.
+"""
+
+import collections
+import json
+import os
+import select
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from metrics import metrics
+
+PAGE_TIMEOUT_SECONDS = float(os.environ.get("PDF_PAGE_TIMEOUT_SECONDS", "10"))
+DOCUMENT_TIMEOUT_SECONDS = float(os.environ.get("PDF_DOCUMENT_TIMEOUT_SECONDS", "120"))
+WORKER_MEMORY_MB = int(os.environ.get("PDF_WORKER_MEMORY_MB", "1024"))
+# Idle workers kept warm between documents
+IDLE_WORKERS = 4
+# Readers a worker keeps open, for repeated single-page requests (lazy mode)
+OPEN_READERS = 4
+
+# Skip reasons
+PAGE_TIMEOUT = "timeout"
+PAGE_MEMORY = "memory"
+PAGE_CRASHED = "crashed"
+DOCUMENT_TIMEOUT = "document_timeout"
+
+
+class ExtractionResult:
+    def __init__(self, total_pages: int, texts: Dict[int, str], skipped: Dict[int, str]):
+        self.total_pages = total_pages
+        self.texts = texts
+        # page number -> reason it was skipped
+        self.skipped = skipped
+
+
+class _Worker:
+    def __init__(self, memory_mb: int):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--memory-mb", str(memory_mb)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        self._buffer = b""
+        # Set after a memory error: the process may be in a bad state
+        self.dirty = False
+
+    def send(self, message: dict):
+        self.process.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.process.stdin.flush()
+
+    def receive(self, timeout: float) -> Optional[dict]:
+        """
+        Next message, None on timeout. Raises EOFError if the worker died.
+        """
+        deadline = time.monotonic() + timeout
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                return None
+            data = os.read(fd, 1 << 16)
+            if not data:
+                raise EOFError("extraction worker exited")
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except Exception:
+            pass
+
+
+class ExtractionSandbox:
+    """Pool of warm extraction workers, safe to use from several threads"""
+
+    def __init__(
+        self,
+        page_timeout: float = PAGE_TIMEOUT_SECONDS,
+        document_timeout: float = DOCUMENT_TIMEOUT_SECONDS,
+        memory_mb: int = WORKER_MEMORY_MB,
+    ):
+        self.page_timeout = page_timeout
+        self.document_timeout = document_timeout
+        self.memory_mb = memory_mb
+        self._idle: List[_Worker] = []
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.poll() is None:
+                    return worker
+        return _Worker(self.memory_mb)
+
+    def _release(self, worker: _Worker):
+        if worker.dirty:
+            worker.kill()
+            return
+        with self._lock:
+            if len(self._idle) < IDLE_WORKERS:
+                self._idle.append(worker)
+                return
+        worker.kill()
+
+    def extract(self, pdf_path: str, pages: Optional[List[int]] = None) -> ExtractionResult:
+        """
+        Extract the raw text of `pages` (1-based, default all). Pages that
+        cannot be extracted within the limits are left out of `texts` and
+        listed in `skipped`. Raises if the PDF itself cannot be opened.
+        """
+        # Workers run in this directory, not the caller's
+        pdf_path = os.path.abspath(pdf_path)
+        deadline = time.monotonic() + self.document_timeout
+        remaining = collections.deque(pages) if pages is not None else None
+        total_pages = None
+        texts: Dict[int, str] = {}
+        skipped: Dict[int, str] = {}
+
+        while remaining is None or remaining:
+            worker = self._acquire()
+            worker.send({"path": pdf_path, "pages": list(remaining) if remaining is not None else None})
+            opened = False
+            while True:
+                now = time.monotonic()
+                # Opening the PDF (each worker does) may take longer than one page
+                wait = deadline - now if not opened else min(self.page_timeout, deadline - now)
+                try:
+                    message = worker.receive(max(0.0, wait))
+                except EOFError:
+                    message = {"crashed": True}
+
+                if message is None or "crashed" in message:
+                    worker.kill()
+                    if remaining is None:
+                        raise Exception(
+                            "PDF could not be opened: "
+                            + ("worker crashed" if message else "timed out")
+                        )
+                    if message is None and time.monotonic() >= deadline:
+                        metrics.incr("pdf_document_timeouts")
+                        for number in remaining:
+                            skipped[number] = DOCUMENT_TIMEOUT
+                        remaining.clear()
+                        break
+                    number = remaining.popleft()
+                    if message is None:
+                        skipped[number] = PAGE_TIMEOUT
+                        metrics.incr("pdf_page_timeouts")
+                    else:
+                        skipped[number] = PAGE_CRASHED
+                        metrics.incr("pdf_page_crashes")
+                    metrics.incr("pdf_sandbox_restarts")
+                    print(f"Skipping page {number} of {os.path.basename(pdf_path)}: {skipped[number]}")
+                    break
+
+                if "total" in message:
+                    opened = True
+                    total_pages = message["total"]
+                    if remaining is None:
+                        remaining = collections.deque(range(1, total_pages + 1))
+                elif "page" in message:
+                    number = message["page"]
+                    if remaining and remaining[0] == number:
+                        remaining.popleft()
+                    if "error" in message:
+                        skipped[number] = message["error"]
+                        if message["error"] == PAGE_MEMORY:
+                            worker.dirty = True
+                            metrics.incr("pdf_page_memory_errors")
+                        else:
+                            metrics.incr("pdf_page_errors")
+                        print(f"Skipping page {number} of {os.path.basename(pdf_path)}: {message['error']}")
+                    else:
+                        texts[number] = message["text"]
+                elif "error" in message:
+                    self._release(worker)
+                    raise Exception(message["error"])
+                elif message.get("done"):
+                    self._release(worker)
+                    break
+
+        return ExtractionResult(total_pages or 0, texts, skipped)
+
+    def count_pages(self, pdf_path: str) -> int:
+        """
+        Page count from the worker's {"total": n} reply. Raises if the PDF
+        cannot be opened within the document timeout.
+        """
+        worker = self._acquire()
+        worker.send({"path": os.path.abspath(pdf_path), "count": True})
+        try:
+            message = worker.receive(self.document_timeout)
+        except EOFError:
+            message = {"crashed": True}
+        if message is None or "crashed" in message:
+            worker.kill()
+            raise Exception(
+                "PDF could not be opened: " + ("worker crashed" if message else "timed out")
+            )
+        self._release(worker)
+        if "error" in message:
+            raise Exception(message["error"])
+        return message["total"]
+
+    def read_navigation(self, pdf_path: str) -> Dict[str, List[Dict]]:
+        """
+        Outline and table of contents (see toc.read_navigation); both empty
+        if they cannot be read in time
+        """
+        worker = self._acquire()
+        worker.send({"path": os.path.abspath(pdf_path), "toc": True})
+        try:
+            message = worker.receive(self.document_timeout)
+        except EOFError:
+            message = None
+        if message is None or "toc" not in message:
+            print(f"Could not read table of contents of {os.path.basename(pdf_path)}")
+            worker.kill()
+            return {"outline": [], "toc": []}
+        self._release(worker)
+        return {"outline": message["outline"], "toc": message["toc"]}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.kill()
+
+
+_sandbox: Optional[ExtractionSandbox] = None
+_sandbox_lock = threading.Lock()
+
+
+def default_sandbox() -> Optional[ExtractionSandbox]:
+    """The shared sandbox, or None when PDF_SANDBOX=0 (extract in-process)"""
+    global _sandbox
+    if os.environ.get("PDF_SANDBOX", "1") in ("0", "false", "no"):
+        return None
+    with _sandbox_lock:
+        if _sandbox is None:
+            _sandbox = ExtractionSandbox()
+        return _sandbox
+
+
+def _worker_main(memory_mb: int):
+    """Serve extraction requests on stdin until it closes"""
+    if memory_mb > 0:
+        import resource
+
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    import PyPDF2
+
+    from toc import read_navigation
+
+    out = sys.stdout.buffer
+    # Library output must not corrupt the protocol
+    sys.stdout = sys.stderr
+
+    def send(message: dict):
+        out.write(json.dumps(message).encode("utf-8") + b"\n")
+        out.flush()
+
+    readers = collections.OrderedDict()
+    for line in sys.stdin.buffer:
+        request = json.loads(line)
+        path = request["path"]
+        try:
+            reader = readers.get(path)
+            if reader is None:
+                reader = PyPDF2.PdfReader(path)
+                readers[path] = reader
+                while len(readers) > OPEN_READERS:
+                    readers.popitem(last=False)
+            readers.move_to_end(path)
+            total = len(reader.pages)
+        except MemoryError:
+            readers.clear()
+            send({"error": "out of memory opening PDF"})
+            continue
+        except Exception as e:
+            send({"error": f"Error extracting text from PDF: {e}"})
+            continue
+
+        if request.get("count"):
+            send({"total": total})
+            continue
+
+        if request.get("toc"):
+            try:
+                send(read_navigation(reader))
+            except Exception as e:
+                send({"error": f"Error reading table of contents: {e}"})
+            continue
+
+        send({"total": total})
+        numbers = request["pages"] or range(1, total + 1)
+        for number in numbers:
+            try:
+                text = reader.pages[number - 1].extract_text() or ""
+                send({"page": number, "text": text})
+            except MemoryError:
+                send({"page": number, "error": PAGE_MEMORY})
+            except Exception as e:
+                send({"page": number, "error": f"error: {e}"})
+        send({"done": True})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PDF extraction worker")
+    parser.add_argument("--memory-mb", type=int, default=WORKER_MEMORY_MB)
+    _worker_main(parser.parse_args().memory_mb)
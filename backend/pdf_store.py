@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional
+
+import PyPDF2
+
+from pdf_processor import PDFProcessor
+from pdf_sandbox import default_sandbox
+from text_normalizer import MIN_PAGE_CHARS, clean_text, find_boilerplate
+
+# Pages extracted at upload: the first few plus evenly spaced ones, enough to
+# preview the document and learn its running headers and footers
+SAMPLE_PAGES = 12
+LEADING_PAGES = 3
+# Uploads with at least this many pages are stored and extracted lazily
+LAZY_PAGE_THRESHOLD = 300
+CACHED_PAGES = 5000
+OPEN_DOCUMENTS = 32
+# Store ids are the first 32 hex digits of the PDF's SHA-256
+STORE_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def sample_page_numbers(total_pages: int, count: int = SAMPLE_PAGES) -> List[int]:
+    """1-based page numbers to extract up front"""
+    numbers = set(range(1, min(LEADING_PAGES, total_pages) + 1))
+    spread = max(1, count - len(numbers))
+    for i in range(spread):
+        numbers.add(1 + (i * (total_pages - 1)) // max(1, spread - 1))
+    return sorted(n for n in numbers if 1 <= n <= total_pages)
+
+
+def extract_raw_pages(
+    path: str, numbers: List[int], reader: Optional[PyPDF2.PdfReader] = None
+) -> tuple[Dict[int, str], Dict[int, str]]:
+    """
+    Raw text of the given pages, through the extraction sandbox when it is
+    enabled (otherwise with `reader`, or a reader opened on `path`). Returns
+    the texts and the skipped page numbers with their reasons.
+    """
+    sandbox = default_sandbox()
+    if sandbox is not None:
+        result = sandbox.extract(path, numbers)
+        return result.texts, result.skipped
+    if reader is None:
+        with open(path, "rb") as file:
+            return extract_raw_pages(path, numbers, PyPDF2.PdfReader(file))
+    return {number: reader.pages[number - 1].extract_text() or "" for number in numbers}, {}
+
+
+class LazyPdf:
+    """A stored PDF whose page text is extracted one page at a time"""
+
+    def __init__(self, path: str, meta: Dict[str, Any]):
+        self.path = path
+        self.store_id = meta["store_id"]
+        self.filename = meta["filename"]
+        self.total_pages = meta["total_pages"]
+        self.outline = meta["outline"]
+        self.toc = meta.get("toc") or []
+        self.boilerplate = set(meta["boilerplate"])
+        self._reader = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def extract(self, page_number: int) -> Dict[str, Any]:
+        if default_sandbox() is not None:
+            texts, skipped = extract_raw_pages(self.path, [page_number])
+        else:
+            with self._lock:
+                if self._reader is None:
+                    self._file = open(self.path, "rb")
+                    self._reader = PyPDF2.PdfReader(self._file)
+                texts, skipped = extract_raw_pages(self.path, [page_number], self._reader)
+        raw = texts.get(page_number, "")
+        lines = [line for line in raw.splitlines() if line.strip()]
+        text = clean_text(lines, self.boilerplate)
+        page = {
+            "page_number": page_number,
+            "text": text,
+            "char_count": len(text),
+            "is_blank": len(text) < MIN_PAGE_CHARS,
+        }
+        if page_number in skipped:
+            page["extraction_error"] = skipped[page_number]
+        return page
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._reader = None
+            self._file = None
+
+
+class LazyPage(Mapping):
+    """Page view that extracts its text from the stored PDF on first access"""
+
+    _KEYS = ("page_number", "text", "is_blank", "duplicate_of")
+
+    def __init__(self, store: "PdfStore", store_id: str, page_number: int):
+        self._store = store
+        self._store_id = store_id
+        self._page_number = page_number
+
+    def __getitem__(self, key):
+        if key == "page_number":
+            return self._page_number
+        if key in ("text", "char_count"):
+            return self._store.page(self._store_id, self._page_number)[key]
+        if key == "is_blank":
+            # Unknown until extracted; only known-blank pages are skipped
+            cached = self._store.cached_page(self._store_id, self._page_number)
+            return bool(cached and cached["is_blank"])
+        if key == "duplicate_of":
+            return None
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+    @property
+    def materialized(self) -> bool:
+        return self._store.cached_page(self._store_id, self._page_number) is not None
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self)
+
+
+class PdfStore:
+    """
+    Server-side store of uploaded PDFs for lazy mode. Each PDF is kept on
+    disk next to a small JSON file with its outline and learned boilerplate;
+    pages are extracted when the pipeline first reads them and kept in an
+    LRU cache shared by all documents.
+    """
+
+    def __init__(self, directory: Optional[str] = None, cached_pages: int = CACHED_PAGES):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "no-vector-pdfs")
+        os.makedirs(self.directory, exist_ok=True)
+        self.cached_pages = cached_pages
+        self._pages: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._documents: "OrderedDict[str, LazyPdf]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _paths(self, store_id: str):
+        if not STORE_ID.fullmatch(store_id):
+            raise ValueError(f"Invalid store id: {store_id!r}")
+        base = os.path.join(self.directory, store_id)
+        return base + ".pdf", base + ".json"
+
+    def add(self, pdf_path: str, filename: str) -> Dict[str, Any]:
+        """
+        Store a PDF and extract its cheap signals: page count, outline and
+        sampled pages (normalized with boilerplate learned from the samples).
+        Returns the stored metadata plus the sampled pages.
+        """
+        digest = hashlib.sha256()
+        with open(pdf_path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        store_id = digest.hexdigest()[:32]
+        stored_pdf, stored_meta = self._paths(store_id)
+        if not os.path.exists(stored_pdf):
+            shutil.copyfile(pdf_path, stored_pdf)
+
+        # Page count, outline and TOC come from the sandbox: a malformed
+        # outline or name tree must not hang this process
+        processor = PDFProcessor()
+        total_pages = processor.count_pages(stored_pdf)
+        navigation = processor.extract_navigation(stored_pdf)
+        texts, skipped = extract_raw_pages(stored_pdf, sample_page_numbers(total_pages))
+        # Skipped samples stay uncached, so a later request can retry them
+        raw_samples = {
+            number: [line for line in raw.splitlines() if line.strip()]
+            for number, raw in texts.items()
+        }
+
+        meta = {
+            "store_id": store_id,
+            "filename": filename,
+            "total_pages": total_pages,
+            "outline": navigation["outline"],
+            "toc": navigation["toc"],
+            "boilerplate": sorted(find_boilerplate(list(raw_samples.values()))),
+        }
+        with open(stored_meta, "w") as file:
+            json.dump(meta, file)
+
+        samples = []
+        for number, lines in raw_samples.items():
+            text = clean_text(lines, set(meta["boilerplate"]))
+            page = {
+                "page_number": number,
+                "text": text,
+                "char_count": len(text),
+                "is_blank": len(text) < MIN_PAGE_CHARS,
+            }
+            self._cache(store_id, page)
+            samples.append(page)
+        return dict(meta, samples=samples)
+
+    def document(self, store_id: str) -> Optional[LazyPdf]:
+        if not STORE_ID.fullmatch(store_id):
+            return None
+        with self._lock:
+            doc = self._documents.get(store_id)
+            if doc is not None:
+                self._documents.move_to_end(store_id)
+                return doc
+        stored_pdf, stored_meta = self._paths(store_id)
+        if not os.path.exists(stored_meta):
+            return None
+        with open(stored_meta) as file:
+            doc = LazyPdf(stored_pdf, json.load(file))
+        with self._lock:
+            self._documents[store_id] = doc
+            while len(self._documents) > OPEN_DOCUMENTS:
+                _, evicted = self._documents.popitem(last=False)
+                evicted.close()
+        return doc
+
+    def _cache(self, store_id: str, page: Dict[str, Any]):
+        with self._lock:
+            self._pages[(store_id, page["page_number"])] = page
+            while len(self._pages) > self.cached_pages:
+                self._pages.popitem(last=False)
+
+    def cached_page(self, store_id: str, page_number: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            page = self._pages.get((store_id, page_number))
+            if page is not None:
+                self._pages.move_to_end((store_id, page_number))
+            return page
+
+    def page(self, store_id: str, page_number: int) -> Dict[str, Any]:
+        page = self.cached_page(store_id, page_number)
+        if page is None:
+            page = self.document(store_id).extract(page_number)
+            self._cache(store_id, page)
+        return page
+
+    def lazy_pages(self, store_id: str) -> Optional[List[LazyPage]]:
+        doc = self.document(store_id)
+        if doc is None:
+            return None
+        return [LazyPage(self, store_id, n) for n in range(1, doc.total_pages + 1)]
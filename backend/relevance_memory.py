@@ -0,0 +1,107 @@
+import base64
+import json
+import zlib
+from typing import Any, Dict, List, Optional
+
+TOKEN_VERSION = 2
+NEIGHBOR_PAGES = 1
+MAX_CANDIDATE_PAGES = 40
+
+
+class RelevanceMemory:
+    """
+    Documents and pages used to answer earlier turns of a conversation.
+
+    The memory is round-tripped to the client as a compact token so the
+    backend stays stateless. Documents are keyed by id (filenames may
+    repeat) and must still match their filename and page count, so a token
+    silently stops matching a document that was replaced or re-uploaded with
+    different content length.
+    """
+
+    def __init__(self, pages_by_document: Optional[Dict[int, Dict[str, Any]]] = None):
+        # id -> {"filename": str, "total_pages": int, "pages": [page_number, ...]}
+        self.pages_by_document = pages_by_document or {}
+
+    @classmethod
+    def from_relevant_pages(
+        cls, relevant_pages: List[Dict[str, Any]], documents: List[Dict[str, Any]]
+    ) -> "RelevanceMemory":
+        by_id = {doc["id"]: doc for doc in documents}
+        pages_by_document: Dict[int, Dict[str, Any]] = {}
+        for page in relevant_pages:
+            doc = by_id.get(page.get("document_id"))
+            if doc is None:
+                continue
+            entry = pages_by_document.setdefault(
+                doc["id"],
+                {"filename": doc["filename"], "total_pages": doc["total_pages"], "pages": []},
+            )
+            if page["page_number"] not in entry["pages"]:
+                entry["pages"].append(page["page_number"])
+        return cls(pages_by_document)
+
+    def encode(self) -> str:
+        payload = {
+            "v": TOKEN_VERSION,
+            "d": [
+                [doc_id, entry["filename"], entry["total_pages"], sorted(entry["pages"])]
+                for doc_id, entry in self.pages_by_document.items()
+            ],
+        }
+        raw = zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @classmethod
+    def decode(cls, token: Optional[str]) -> Optional["RelevanceMemory"]:
+        """Parse a token, returning None if it is missing or malformed"""
+        if not token:
+            return None
+        try:
+            payload = json.loads(zlib.decompress(base64.urlsafe_b64decode(token)))
+            if payload.get("v") != TOKEN_VERSION:
+                return None
+            pages_by_document = {
+                int(doc_id): {
+                    "filename": str(filename),
+                    "total_pages": int(total),
+                    "pages": [int(p) for p in pages],
+                }
+                for doc_id, filename, total, pages in payload["d"]
+            }
+        except Exception as e:
+            print(f"Ignoring invalid relevance token: {e}")
+            return None
+        return cls(pages_by_document)
+
+    def candidate_documents(
+        self, documents: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Return remembered documents still present in the collection, each
+        restricted to its remembered pages plus their neighbors
+        """
+        candidates = []
+        budget = MAX_CANDIDATE_PAGES
+        for doc in documents:
+            entry = self.pages_by_document.get(doc["id"])
+            if (
+                not entry
+                or entry["filename"] != doc["filename"]
+                or entry["total_pages"] != doc["total_pages"]
+            ):
+                continue
+            wanted = set()
+            for page_number in entry["pages"]:
+                for offset in range(-NEIGHBOR_PAGES, NEIGHBOR_PAGES + 1):
+                    wanted.add(page_number + offset)
+            pages = [page for page in doc["pages"] if page["page_number"] in wanted]
+            pages = pages[:budget]
+            budget -= len(pages)
+            if pages:
+                candidate = doc.copy()
+                candidate["pages"] = pages
+                candidates.append(candidate)
+            if budget <= 0:
+                break
+        return candidates
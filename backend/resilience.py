@@ -0,0 +1,143 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import openai
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Rolling window of recent call latencies used to derive hedge delays"""
+
+    def __init__(self, window: int = 200, default: float = 10.0, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.default = default
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> float:
+        """Return the given percentile, or the default until enough samples exist"""
+        if len(self.samples) < self.min_samples:
+            return self.default
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class RetryBudget:
+    """
+    Shared budget that caps retries and hedges to a fraction of normal traffic.
+
+    Every first attempt deposits `ratio` tokens; every retry or hedge withdraws
+    one. Below `min_tokens` the balance also refills over time (up to
+    `min_tokens` per `refill_period` seconds), so low-traffic periods can
+    still retry. This prevents retry storms when the upstream API is degraded.
+    """
+
+    def __init__(
+        self,
+        ratio: float = 0.2,
+        min_tokens: float = 10.0,
+        max_tokens: float = 100.0,
+        refill_period: float = 60.0,
+    ):
+        self.ratio = ratio
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.refill_period = refill_period
+        self.tokens = min_tokens
+        self._refilled_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.tokens < self.min_tokens:
+            elapsed = now - self._refilled_at
+            self.tokens = min(
+                self.min_tokens, self.tokens + elapsed * self.min_tokens / self.refill_period
+            )
+        self._refilled_at = now
+
+    def deposit(self):
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        self._refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Connection errors, rate limits and 5xx responses: an upstream condition
+    that smaller requests would hit just the same. Timeouts are not transient
+    here, since a smaller request may well finish in time.
+    """
+    if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError)):
+        return False
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Full-jitter exponential backoff for the given retry attempt (1-based)"""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+async def hedged_call(
+    call: Callable[[], Awaitable[T]],
+    timeout: float,
+    hedge_delay: Optional[float] = None,
+    budget: Optional[RetryBudget] = None,
+) -> T:
+    """
+    Run `call` with a hard timeout, starting a duplicate attempt if the first
+    has not finished after `hedge_delay` seconds. The first successful result
+    wins and the other attempt is cancelled. Raises the last error (or
+    asyncio.TimeoutError) if no attempt succeeds in time.
+    """
+    deadline = time.monotonic() + timeout
+    tasks = [asyncio.ensure_future(call())]
+    hedged = hedge_delay is None or hedge_delay >= timeout
+    last_error: Optional[BaseException] = None
+
+    try:
+        while tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_for = remaining if hedged else min(remaining, hedge_delay)
+            done, _ = await asyncio.wait(
+                tasks, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            for task in done:
+                tasks.remove(task)
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+
+            if not hedged and not done:
+                # Primary is slower than the hedge delay: fire a duplicate
+                hedged = True
+                if budget is None or budget.try_withdraw():
+                    tasks.append(asyncio.ensure_future(call()))
+            elif not hedged and done:
+                # Primary failed fast; leave retrying to the caller
+                hedged = True
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if last_error is not None and not tasks:
+        raise last_error
+    raise asyncio.TimeoutError(f"call did not complete within {timeout:.1f}s")
@@ -0,0 +1,253 @@
+"""
+Minimal Redis protocol (RESP) support for the network work queue.
+
+`RespClient` speaks just enough RESP to push and pop list items on a real
+Redis server. `MiniRedis` is a local stand-in serving the same subset
+(PING, LPUSH, RPUSH, RPOP, BRPOP, LLEN, DEL, EXPIRE) from memory, for
+development and tests without a Redis install:
+
+    python resp.py --port 6380
+"""
+
+import asyncio
+import collections
+import time
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import urlparse
+
+
+class RespError(Exception):
+    pass
+
+
+def encode_command(*args: Any) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode("utf-8")
+    if kind == b"-":
+        raise RespError(rest.decode("utf-8"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RespError(f"unexpected reply: {line!r}")
+
+
+class RespClient:
+    """One connection; commands are serialized, so a blocking BRPOP needs its own"""
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._call("AUTH", self.password)
+        if self.db:
+            await self._call("SELECT", self.db)
+
+    async def _call(self, *args: Any) -> Any:
+        self._writer.write(encode_command(*args))
+        await self._writer.drain()
+        return await read_reply(self._reader)
+
+    async def execute(self, *args: Any) -> Any:
+        async with self._lock:
+            if self._writer is None:
+                await self._connect()
+            try:
+                return await self._call(*args)
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+                # The reply (if any) would be read by the next command: reconnect
+                self.close()
+                raise
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+
+class MiniRedis:
+    """In-memory server for the list commands the work queue uses"""
+
+    def __init__(self):
+        self._lists: Dict[bytes, Deque[bytes]] = collections.defaultdict(collections.deque)
+        self._expires: Dict[bytes, float] = {}
+        # key -> (future, connection) of clients blocked in BRPOP on it
+        self._waiters: Dict[bytes, Deque[tuple]] = collections.defaultdict(
+            collections.deque
+        )
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._connections = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Listen on `port` (0: any free one); returns the port"""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def _list(self, key: bytes) -> Deque[bytes]:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._lists.pop(key, None)
+            self._expires.pop(key, None)
+        return self._lists[key]
+
+    def _push(self, key: bytes, values: List[bytes], left: bool) -> int:
+        items = self._list(key)
+        for value in values:
+            # Hand the item straight to the longest-waiting BRPOP client that
+            # is still connected
+            waiters = self._waiters[key]
+            while waiters and (waiters[0][0].done() or waiters[0][1].at_eof()):
+                waiters.popleft()
+            if waiters:
+                waiters.popleft()[0].set_result((key, value))
+            elif left:
+                items.appendleft(value)
+            else:
+                items.append(value)
+        return len(items)
+
+    async def _brpop(
+        self, keys: List[bytes], timeout: float, reader: asyncio.StreamReader
+    ) -> Optional[List[bytes]]:
+        for key in keys:
+            items = self._list(key)
+            if items:
+                return [key, items.pop()]
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, reader)
+        for key in keys:
+            self._waiters[key].append(waiter)
+        try:
+            key, value = await asyncio.wait_for(future, timeout or None)
+            return [key, value]
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            for key in keys:
+                if waiter in self._waiters[key]:
+                    self._waiters[key].remove(waiter)
+
+    async def _execute(
+        self, command: str, args: List[bytes], reader: asyncio.StreamReader
+    ) -> Any:
+        if command == "PING":
+            return "PONG"
+        if command in ("LPUSH", "RPUSH"):
+            return self._push(args[0], args[1:], left=command == "LPUSH")
+        if command == "RPOP":
+            items = self._list(args[0])
+            return items.pop() if items else None
+        if command == "BRPOP":
+            return await self._brpop(args[:-1], float(args[-1]), reader)
+        if command == "LLEN":
+            return len(self._list(args[0]))
+        if command == "DEL":
+            removed = 0
+            for key in args:
+                removed += 1 if self._lists.pop(key, None) else 0
+                self._expires.pop(key, None)
+            return removed
+        if command == "EXPIRE":
+            self._expires[args[0]] = time.monotonic() + float(args[1])
+            return 1
+        if command in ("SELECT", "AUTH"):
+            return "OK"
+        raise RespError(f"ERR unknown command '{command}'")
+
+    @staticmethod
+    def _encode_reply(value: Any) -> bytes:
+        if value is None:
+            return b"*-1\r\n"
+        if isinstance(value, RespError):
+            return b"-%s\r\n" % str(value).encode("utf-8")
+        if isinstance(value, str):
+            return b"+%s\r\n" % value.encode("utf-8")
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        return b"*%d\r\n" % len(value) + b"".join(
+            MiniRedis._encode_reply(item) for item in value
+        )
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    request = await read_reply(reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    break
+                command, args = request[0].decode("utf-8").upper(), request[1:]
+                try:
+                    reply = await self._execute(command, args, reader)
+                except RespError as e:
+                    reply = e
+                if command == "RPOP" and reply is None:
+                    writer.write(b"$-1\r\n")
+                else:
+                    writer.write(self._encode_reply(reply))
+                await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="In-memory Redis stand-in for the work queue")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+
+    async def serve():
+        server = MiniRedis()
+        port = await server.start(args.host, args.port)
+        print(f"MiniRedis listening on {args.host}:{port}")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
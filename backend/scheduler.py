@@ -0,0 +1,130 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+from typing import Dict, Optional
+
+from metrics import metrics
+
+# Lower runs first. Answer streams gate time-to-first-token, interactive calls
+# (selection, follow-up checks, history compaction) are small and on the
+# critical path, page scans are the bulk work that may wait. Background work
+# (page digests built after upload) only runs in capacity no request wants.
+PRIORITY_ANSWER = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_SCAN = 2
+PRIORITY_BACKGROUND = 3
+PRIORITY_NAMES = {
+    PRIORITY_ANSWER: "answer",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_SCAN: "scan",
+    PRIORITY_BACKGROUND: "background",
+}
+
+# Forget idle flows once this many are tracked
+MAX_IDLE_FLOWS = 1000
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse "alice=3,manuals=2" into {"alice": 3.0, "manuals": 2.0}"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        try:
+            weights[name.strip()] = float(value)
+        except ValueError:
+            print(f"Ignoring invalid weight: {item}")
+    return weights
+
+
+class FairScheduler:
+    """
+    Start-time fair queuing of LLM calls with strict priority classes.
+
+    Each flow (a tenant, or a single request when no tenant is given) gets a
+    share of the `max_concurrency` upstream slots proportional to its weight.
+    A call's start tag is max(virtual time, the flow's last finish tag) and
+    its finish tag adds cost / weight, so a flow that queued hundreds of
+    chunk calls cannot push a newcomer's calls behind its whole backlog.
+    Within a priority class the lowest start tag is dispatched first.
+    """
+
+    def __init__(self, max_concurrency: int = 32, weights: Optional[Dict[str, float]] = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.weights = weights or {}
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        self._finish_tags: Dict[str, float] = {}
+        self._queue = []
+        self._sequence = itertools.count()
+
+    def weight_for(self, *keys: Optional[str]) -> float:
+        """Weight of the first key (tenant, collection, ...) that has one"""
+        for key in keys:
+            if key and key in self.weights:
+                return self.weights[key]
+        return 1.0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for entry in self._queue if entry[-1] is not None)
+
+    def _update_gauges(self):
+        metrics.set_gauge("llm_in_flight", self.in_flight)
+        metrics.set_gauge("llm_queued", self.queued)
+
+    async def acquire(self, flow: str, priority: int, cost: float = 1.0, weight: float = 1.0):
+        start = max(self.virtual_time, self._finish_tags.get(flow, 0.0))
+        self._finish_tags[flow] = start + cost / max(weight, 0.001)
+
+        if self.in_flight < self.max_concurrency and not self.queued:
+            self.in_flight += 1
+            self.virtual_time = max(self.virtual_time, start)
+            self._update_gauges()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, start, next(self._sequence), future]
+        heapq.heappush(self._queue, entry)
+        self._update_gauges()
+        queued_at = time.time()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted and cancelled in the same tick: hand the slot on
+                self.release()
+            else:
+                entry[-1] = None
+                self._update_gauges()
+            raise
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        metrics.incr(f"llm_queue_wait_seconds_{name}", time.time() - queued_at)
+        metrics.incr(f"llm_queued_calls_{name}")
+
+    def release(self):
+        self.in_flight -= 1
+        while self._queue and self.in_flight < self.max_concurrency:
+            _, start, _, future = heapq.heappop(self._queue)
+            if future is None or future.done():
+                continue
+            self.in_flight += 1
+            self.virtual_time = max(self.virtual_time, start)
+            future.set_result(None)
+        if len(self._finish_tags) > MAX_IDLE_FLOWS:
+            # Flows whose tags are behind virtual time would restart there anyway
+            self._finish_tags = {
+                flow: tag
+                for flow, tag in self._finish_tags.items()
+                if tag > self.virtual_time
+            }
+        self._update_gauges()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, flow: str, priority: int, cost: float = 1.0, weight: float = 1.0):
+        await self.acquire(flow, priority, cost, weight)
+        try:
+            yield
+        finally:
+            self.release()
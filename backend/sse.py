@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+# Buffered answer text is flushed as one content frame at least this often...
+FLUSH_INTERVAL_MS = float(os.environ.get("SSE_FLUSH_MS", "50"))
+# ...or as soon as this many bytes are waiting (0 for both: no coalescing)
+FLUSH_BYTES = int(os.environ.get("SSE_FLUSH_BYTES", "512"))
+
+
+def frame_type(frame: str) -> Optional[str]:
+    """The `type` of an SSE `data:` frame's JSON event, if it has one"""
+    if not frame.startswith("data:"):
+        return None
+    try:
+        event = json.loads(frame[len("data:"):])
+    except ValueError:
+        return None
+    return event.get("type") if isinstance(event, dict) else None
+
+
+async def coalesce_content(
+    events: AsyncIterator[Dict[str, Any]],
+    interval_ms: float = FLUSH_INTERVAL_MS,
+    max_bytes: int = FLUSH_BYTES,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Merge consecutive {"type": "content"} events from the answer stream into
+    fewer, larger ones. The first content event passes through untouched so
+    time-to-first-token is unchanged; after that, text is flushed every
+    `interval_ms` or once `max_bytes` are buffered, whichever comes first,
+    even when the model pauses between tokens. Other events flush the buffer
+    and pass through in order.
+    """
+    iterator = events.__aiter__()
+    buffer = []
+    buffered = 0
+    sent_first = False
+    flush_at = None
+    pending = None
+    try:
+        if interval_ms <= 0 and max_bytes <= 0:
+            async for event in iterator:
+                yield event
+            return
+
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None
+            if buffer and flush_at is not None:
+                timeout = max(0.0, flush_at - time.monotonic())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # Interval elapsed with no new token: flush what we have
+                yield {"type": "content", "content": "".join(buffer)}
+                buffer, buffered, flush_at = [], 0, None
+                continue
+
+            try:
+                event = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+
+            if event.get("type") != "content":
+                if buffer:
+                    yield {"type": "content", "content": "".join(buffer)}
+                    buffer, buffered, flush_at = [], 0, None
+                yield event
+                continue
+            if not sent_first:
+                sent_first = True
+                yield event
+                continue
+
+            buffer.append(event["content"])
+            buffered += len(event["content"].encode("utf-8"))
+            if flush_at is None and interval_ms > 0:
+                flush_at = time.monotonic() + interval_ms / 1000
+            if max_bytes > 0 and buffered >= max_bytes:
+                yield {"type": "content", "content": "".join(buffer)}
+                buffer, buffered, flush_at = [], 0, None
+
+        if buffer:
+            yield {"type": "content", "content": "".join(buffer)}
+    finally:
+        if pending is not None:
+            pending.cancel()
+            # Let the cancelled step unwind before closing the generator
+            await asyncio.wait({pending})
+            if not pending.cancelled():
+                pending.exception()
+        # Close the answer stream now (its OpenAI response and scheduler
+        # slot) rather than leaving it to the garbage collector
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,92 @@
+"""
+Throughput benchmark for answer streaming over SSE.
+
+A synthetic token stream is pushed through the same path step 3 uses
+(coalesce_content, then one `data: {...}` frame per content event) and
+parsed back the way the frontend does, with and without coalescing:
+
+    python sse_benchmark.py                      # unthrottled, 20k tokens
+    python sse_benchmark.py --rate 80            # model-like 80 tokens/s
+    python sse_benchmark.py --flush-ms 25 --flush-bytes 256
+
+Reports frames, bytes on the wire, frames (events) per second, tokens per
+second and time to the first content frame.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from sse import FLUSH_BYTES, FLUSH_INTERVAL_MS, coalesce_content
+
+
+async def _tokens(count: int, rate: float):
+    interval = 1 / rate if rate > 0 else 0
+    start = time.perf_counter()
+    for index in range(count):
+        if interval:
+            delay = start + index * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield {"type": "content", "content": f" token{index % 1000}"}
+    yield {"type": "cost", "cost": 0.0}
+
+
+async def measure(count: int, rate: float, flush_ms: float, flush_bytes: int) -> dict:
+    frames = 0
+    wire_bytes = 0
+    tokens_text = []
+    first_content_ms = None
+    start = time.perf_counter()
+    async for event in coalesce_content(_tokens(count, rate), flush_ms, flush_bytes):
+        frame = f"data: {json.dumps(event)}\n\n".encode()
+        wire_bytes += len(frame)
+        # Client side: split frames and decode them as the frontend does
+        for line in frame.decode().split("\n"):
+            if line.startswith("data: "):
+                parsed = json.loads(line[6:])
+                if parsed["type"] == "content":
+                    if first_content_ms is None:
+                        first_content_ms = (time.perf_counter() - start) * 1000
+                    tokens_text.append(parsed["content"])
+        frames += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "frames": frames,
+        "wire_bytes": wire_bytes,
+        "events_per_second": frames / elapsed,
+        "tokens_per_second": count / elapsed,
+        "first_content_ms": first_content_ms,
+        "elapsed_s": elapsed,
+        "text_chars": len("".join(tokens_text)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=0, help="Tokens per second, 0 = unthrottled")
+    parser.add_argument("--flush-ms", type=float, default=FLUSH_INTERVAL_MS)
+    parser.add_argument("--flush-bytes", type=int, default=FLUSH_BYTES)
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'frames':>9}{'wire KB':>10}{'events/s':>11}{'tokens/s':>11}{'first':>9}")
+    results = {}
+    for mode, flush_ms, flush_bytes in [
+        ("per-token", 0, 0),
+        ("coalesced", args.flush_ms, args.flush_bytes),
+    ]:
+        row = asyncio.run(measure(args.tokens, args.rate, flush_ms, flush_bytes))
+        results[mode] = row
+        print(
+            f"{mode:<12}{row['frames']:>9}{row['wire_bytes'] / 1024:>10.1f}"
+            f"{row['events_per_second']:>11.0f}{row['tokens_per_second']:>11.0f}"
+            f"{row['first_content_ms']:>7.2f}ms"
+        )
+    if results["per-token"]["text_chars"] != results["coalesced"]["text_chars"]:
+        print("WARNING: coalesced stream delivered different text")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Cold-start benchmark for the serverless entry points in api/.
+
+Each entry point is loaded in a fresh interpreter, the way a new function
+instance would load it, and a GET request is served through its handler:
+
+    python startup_benchmark.py                   # print a table
+    python startup_benchmark.py --save base.json  # record a baseline
+    python startup_benchmark.py --compare base.json
+
+`--importtime N` also lists the N slowest imports of each entry point
+(from `python -X importtime`).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ENTRY_POINTS = [
+    "api/index.py",
+    "api/health.py",
+    "api/upload.py",
+    "api/chat/stream.py",
+]
+
+_PROBE = """
+import io, json, runpy, time
+start = time.perf_counter()
+module = runpy.run_path({path!r})
+import_ms = (time.perf_counter() - start) * 1000
+
+
+class _Connection:
+    def __init__(self, data):
+        self.rfile = io.BytesIO(data)
+        self.wfile = io.BytesIO()
+
+    def makefile(self, mode, *args, **kwargs):
+        return self.rfile if "r" in mode else self.wfile
+
+    def sendall(self, data):
+        self.wfile.write(data)
+
+
+start = time.perf_counter()
+module["handler"](_Connection(b"GET / HTTP/1.0\\r\\n\\r\\n"), ("127.0.0.1", 0), None)
+get_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{"import_ms": import_ms, "get_ms": get_ms}}))
+"""
+
+
+def _run(path: str, extra_args=None) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    return subprocess.run(
+        [sys.executable, *(extra_args or []), "-c", _PROBE.format(path=path)],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def measure(path: str, runs: int) -> dict:
+    """Median process wall time, module import time and first GET time"""
+    wall, imports, gets = [], [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = _run(path)
+        wall.append((time.perf_counter() - start) * 1000)
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        imports.append(probe["import_ms"])
+        gets.append(probe["get_ms"])
+    return {
+        "cold_start_ms": statistics.median(wall),
+        "import_ms": statistics.median(imports),
+        "first_get_ms": statistics.median(gets),
+    }
+
+
+def slowest_imports(path: str, count: int) -> list:
+    """Top-level packages ranked by cumulative import time"""
+    stderr = _run(path, ["-X", "importtime"]).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--save", help="Write results to a JSON file")
+    parser.add_argument("--compare", help="Compare against a saved JSON file")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    results = {}
+    print(f"{'entry point':<22}{'cold start':>12}{'import':>10}{'first GET':>11}")
+    for path in ENTRY_POINTS:
+        results[path] = measure(path, args.runs)
+        row = results[path]
+        line = (
+            f"{path:<22}{row['cold_start_ms']:>10.0f}ms"
+            f"{row['import_ms']:>8.0f}ms{row['first_get_ms']:>9.1f}ms"
+        )
+        if path in baseline:
+            before = baseline[path]["cold_start_ms"]
+            line += f"   ({row['cold_start_ms'] - before:+.0f}ms vs baseline)"
+        print(line)
+        for ms, name in slowest_imports(path, args.importtime) if args.importtime else []:
+            print(f"    {ms:>8.1f}ms  {name}")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Saved results to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
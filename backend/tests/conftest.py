@@ -0,0 +1,77 @@
+import json
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# Backend modules import each other by their top-level names
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+_PAGE_NUMBER = re.compile(r'"page_number": (\d+)')
+
+
+def prompt_pages(kwargs) -> list:
+    """Page numbers a page-scan call was asked about"""
+    return [int(n) for n in _PAGE_NUMBER.findall(kwargs["messages"][0]["content"])]
+
+
+def completion(content: str, prompt_tokens: int = 1000, completion_tokens: int = 100):
+    """A chat completion shaped like the OpenAI SDK's"""
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content, refusal=None))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens),
+    )
+
+
+def scan_completion(pages: list, relevance: float = 0.9):
+    """A page-scan reply scoring every page in `pages`"""
+    return completion(
+        json.dumps(
+            {
+                "pages": [
+                    {"page_number": n, "relevance": relevance, "justification": f"page {n}"}
+                    for n in pages
+                ]
+            }
+        )
+    )
+
+
+class StubClient:
+    """AsyncOpenAI stand-in: every chat completion is answered by `handler(kwargs)`"""
+
+    def __init__(self, handler):
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.handler = handler
+
+    async def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        return await self.handler(kwargs)
+
+
+@pytest.fixture
+def make_service(monkeypatch):
+    """An LLMService scanning in-process with a stub client and no screen model"""
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setenv("PAGE_SCAN_SCREEN_MODEL", "")
+
+    def make(handler):
+        from llm_service import LLMService
+
+        service = LLMService()
+        service.client = StubClient(handler)
+        return service
+
+    return make
+
+
+def make_pages(count: int, filename: str = "doc.pdf") -> list:
+    return [
+        {"page_number": n, "text": f"text of page {n}", "source_document": filename}
+        for n in range(1, count + 1)
+    ]
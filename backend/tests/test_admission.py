@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import ADMIT, DEGRADE, REJECT, AdmissionController
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def _controller(**kwargs):
+    # 10s target with a 5s fixed part: 5000 tokens of load + request fit
+    settings = dict(
+        target_latency_ms=10000,
+        tokens_per_second=1000,
+        max_active=8,
+        max_queued_calls=100,
+        degraded_max_cost=0.01,
+    )
+    settings.update(kwargs)
+    return AdmissionController(**settings)
+
+
+def test_request_within_target_is_admitted(clock):
+    controller = _controller()
+    decision = controller.admit(1000)
+    assert decision.action == ADMIT
+    assert decision.estimated_ms == pytest.approx(6000)
+    assert decision.ticket is not None
+    assert controller.load == 1000
+
+
+def test_request_over_target_is_degraded(clock):
+    controller = _controller()
+    controller.admit(1000)
+    decision = controller.admit(8000)
+    assert decision.action == DEGRADE
+    assert decision.degraded
+    # A degraded plan reads a quarter of the tokens
+    assert controller.load == 1000 + 2000
+
+
+def test_request_that_cannot_fit_is_rejected_with_retry_after(clock):
+    controller = _controller()
+    controller.admit(4000)
+    decision = controller.admit(40000)
+    assert decision.action == REJECT
+    assert decision.reason == "latency_target"
+    assert decision.retry_after >= 1
+    assert decision.ticket is None
+    assert controller.load == 4000
+
+
+def test_request_on_an_idle_server_is_served(clock):
+    assert _controller().admit(100000).action == DEGRADE
+    decision = _controller(degraded_max_cost=0).admit(100000)
+    assert decision.action == ADMIT
+    assert decision.reason == "idle"
+
+
+def test_hard_limits(clock):
+    controller = _controller(max_active=1)
+    controller.admit(10)
+    assert controller.admit(10).reason == "max_active"
+    assert _controller().admit(10, queued_calls=100).reason == "queue_depth"
+
+
+def test_request_latency_budget_tightens_the_target(clock):
+    controller = _controller()
+    assert controller.admit(1000, max_latency_ms=5500).action == DEGRADE
+
+
+def test_completed_requests_calibrate_throughput(clock):
+    controller = _controller(degraded_max_cost=0)
+    ticket = controller.admit(60000).ticket
+    clock.now += 15
+    controller.release(ticket)
+    # 60000 tokens read in 15s minus the fixed 5s
+    assert controller.tokens_per_second == pytest.approx(1000 + 0.2 * (6000 - 1000))
+    assert controller.load == 0
+
+
+def test_unfinished_and_small_requests_do_not_calibrate(clock):
+    controller = _controller(degraded_max_cost=0)
+    ticket = controller.admit(60000).ticket
+    clock.now += 15
+    controller.release(ticket, completed=False)
+    ticket = controller.admit(100).ticket
+    clock.now += 6
+    controller.release(ticket)
+    assert controller.tokens_per_second == 1000
+    # Releasing twice is harmless
+    controller.release(ticket)
+    assert controller.load == 0
+
+
+def test_tickets_of_streams_never_consumed_expire(clock):
+    controller = _controller()
+    controller.admit(1000)
+    clock.now += admission.TICKET_TTL_SECONDS + 1
+    controller.admit(10)
+    assert controller.load == 10
+
+
+def _hold(controller, ticket, frames, stop_after=None):
+    async def produce():
+        for frame in frames:
+            yield frame
+
+    async def run():
+        seen = []
+        stream = controller.hold(ticket, produce())
+        async for frame in stream:
+            seen.append(frame)
+            if stop_after is not None and len(seen) == stop_after:
+                break
+        await stream.aclose()
+        return seen
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "complete",
+    [
+        'data: {"type": "complete", "cached": false}\n\n',
+        'data: {"cached":false,"type":"complete"}\n\n',
+    ],
+)
+def test_hold_releases_a_completed_stream(monkeypatch, complete):
+    controller = _controller()
+    released = []
+    monkeypatch.setattr(controller, "release", lambda ticket, completed: released.append((ticket, completed)))
+    frames = ['data: {"type": "content", "content": "complete"}\n\n', complete]
+    assert _hold(controller, 7, frames) == frames
+    assert released == [(7, True)]
+
+
+def test_hold_releases_an_abandoned_stream(monkeypatch):
+    controller = _controller()
+    released = []
+    monkeypatch.setattr(controller, "release", lambda ticket, completed: released.append((ticket, completed)))
+    frames = [
+        'data: {"type": "content", "content": "\\"complete\\""}\n\n',
+        'data: {"type": "complete"}\n\n',
+    ]
+    _hold(controller, 7, frames, stop_after=1)
+    assert released == [(7, False)]
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from budget import RequestBudget, exhausted_answer_stream
+from models import ChatRequest
+
+PRICING = {"gpt-5-mini": {"input": 0.25, "output": 2.0}}
+
+
+def _pages(count):
+    return [
+        {"page_number": n, "text": "x" * 2000, "source_document": "doc.pdf"}
+        for n in range(1, count + 1)
+    ]
+
+
+@pytest.mark.parametrize("max_latency_ms", [None, 100])
+def test_spent_cost_budget_keeps_one_page_whatever_the_latency_budget(max_latency_ms):
+    budget = RequestBudget(0.0001, max_latency_ms, PRICING)
+    budget.charge(0.0001)
+    assert len(budget.fit_answer_context(_pages(20), "gpt-5-mini")) == 1
+
+
+def test_low_latency_budget_caps_the_answer_context():
+    budget = RequestBudget(None, 100, PRICING)
+    assert len(budget.fit_answer_context(_pages(40), "gpt-5-mini")) == 20
+
+
+@pytest.mark.parametrize(
+    "limits", [{"max_cost": 0}, {"max_cost": -1}, {"max_latency_ms": 0}]
+)
+def test_non_positive_limits_are_rejected(limits):
+    with pytest.raises(ValidationError):
+        ChatRequest(question="q", **limits)
+
+
+def test_exhausted_answer_cites_the_best_pages_for_free():
+    async def run():
+        return [chunk async for chunk in exhausted_answer_stream(_pages(8))]
+
+    content, cost = asyncio.run(run())
+    assert "$PAGE_STARTdoc.pdf:1,2,3,4,5$PAGE_END" in content["content"]
+    assert cost == {"type": "cost", "cost": 0.0}
+
+
+SCAN_PRICING = {
+    "gpt-5-mini": {"input": 0.25, "output": 2.0},
+    "gpt-5-nano": {"input": 0.05, "output": 0.4},
+}
+
+
+def test_scan_model_is_sized_from_the_documents():
+    documents = [{"id": 0, "pages": _pages(40)}]
+    assert RequestBudget(1.0, None, SCAN_PRICING).choose_scan_model("gpt-5-mini", documents) == "gpt-5-mini"
+    # 80000 chars and two chunks cost about $0.0077 on gpt-5-mini
+    budget = RequestBudget(0.01, None, SCAN_PRICING)
+    assert budget.choose_scan_model("gpt-5-mini", documents) == "gpt-5-nano"
+    assert budget.stage_models == {"page_detection": "gpt-5-nano"}
+
+
+def test_chunk_caps_account_for_the_other_scan_passes():
+    documents = [{"id": 0, "pages": _pages(200), "toc": [{"title": "Intro"}]}]
+    budget = RequestBudget(0.026, None, SCAN_PRICING)
+    assert budget.plan_chunk_caps(documents, "gpt-5-mini") == {0: 4}
+
+    # Screened chunks are cheaper: only the borderline pages are rescanned
+    passes = {"screen_model": "gpt-5-nano"}
+    assert budget.plan_chunk_caps(documents, "gpt-5-mini", passes=passes) == {0: 8}
+
+    # The TOC call comes out of the share first
+    passes = {"toc_model": "gpt-5-mini", "toc_min_pages": 40}
+    assert budget.plan_chunk_caps(documents, "gpt-5-mini", passes=passes) == {0: 3}
+    passes["toc_min_pages"] = 400
+    assert budget.plan_chunk_caps(documents, "gpt-5-mini", passes=passes) == {0: 4}
+
+    # So do the digest calls, and digested pages count towards the chunks in part
+    passes = {"digest_model": "gpt-5-nano", "digested_pages": {0: 200}}
+    assert budget.plan_chunk_caps(documents, "gpt-5-mini", passes=passes) == {0: 3}
+    assert budget.actions[-1] == "page_detection: scanning 3 of 5 chunks"
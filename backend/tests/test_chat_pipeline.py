@@ -0,0 +1,104 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from budget import RequestBudget
+from chat_pipeline import chat_pipeline
+from conftest import completion, prompt_pages, scan_completion
+from models import ChatRequest
+
+
+class _AnswerStream:
+    def __init__(self, text):
+        usage = SimpleNamespace(prompt_tokens=1000, completion_tokens=10)
+        self.chunks = [
+            SimpleNamespace(
+                usage=None,
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=text))],
+            ),
+            SimpleNamespace(usage=usage, choices=[]),
+        ]
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+def _request():
+    return ChatRequest(
+        question="What was the revenue?",
+        documents=[
+            {
+                "id": 1,
+                "filename": "report.pdf",
+                "total_pages": 3,
+                "pages": [
+                    {"page_number": n, "text": f"text of page {n}"} for n in range(1, 4)
+                ],
+            }
+        ],
+    )
+
+
+def _events(service, budget):
+    async def run():
+        return [
+            json.loads(frame[len("data: "):])
+            async for frame in chat_pipeline(_request(), service, budget)
+        ]
+
+    return asyncio.run(run())
+
+
+def test_pipeline_streams_every_step(make_service):
+    streams = []
+
+    async def handler(kwargs):
+        if kwargs.get("stream"):
+            streams.append(_AnswerStream("Revenue grew."))
+            return streams[-1]
+        if "response_format" in kwargs:
+            return scan_completion(prompt_pages(kwargs))
+        return completion("[1]")
+
+    service = make_service(handler)
+    events = _events(service, RequestBudget(pricing=service.pricing))
+
+    assert [(event["type"], event.get("step")) for event in events] == [
+        ("status", "document_selection"),
+        ("step_complete", "document_selection"),
+        ("status", "page_selection"),
+        ("step_complete", "page_selection"),
+        ("status", "answer_generation"),
+        ("content", None),
+        ("complete", None),
+    ]
+    assert events[1]["selected_documents"] == [{"id": 1, "filename": "report.pdf"}]
+    assert events[3]["relevant_pages_count"] == 3
+    assert events[5]["content"] == "Revenue grew."
+    complete = events[-1]
+    assert complete["cost_breakdown"]["answer_generation"] > 0
+    assert not complete["failed"]
+    assert complete["relevance_token"]
+    assert streams[0].closed
+
+
+def test_pipeline_error_ends_the_stream_with_an_error_event(make_service):
+    async def handler(kwargs):
+        return completion("[1]")
+
+    service = make_service(handler)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("scan planning failed")
+
+    service.new_scan_stats = fail
+    events = _events(service, RequestBudget(pricing=service.pricing))
+    assert events[-1] == {"type": "error", "error": "scan planning failed"}
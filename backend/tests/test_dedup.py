@@ -0,0 +1,50 @@
+from dedup import attach_cluster_members, find_duplicates, plan_cluster_scan
+
+TEXT_A = "the quarterly report lists revenue by region and the growth of each segment"
+TEXT_B = "safety instructions for operating the hydraulic press in the north workshop"
+
+
+def _document(doc_id, filename, texts):
+    return {
+        "id": doc_id,
+        "filename": filename,
+        "pages": [
+            {"page_number": n, "text": text, "is_blank": False}
+            for n, text in enumerate(texts, start=1)
+        ],
+    }
+
+
+def test_same_named_documents_keep_their_own_clusters():
+    documents = [
+        _document(1, "report.pdf", [TEXT_A, TEXT_B]),
+        _document(2, "report.pdf", [TEXT_B, TEXT_A]),
+    ]
+    stats = find_duplicates(documents)
+    assert stats["duplicate_pages"] == 2
+    assert documents[1]["pages"][0]["duplicate_of"] == "1:2"
+    assert documents[1]["pages"][1]["duplicate_of"] == "1:1"
+
+    scan_docs, members = plan_cluster_scan(documents, documents)
+    assert [doc["id"] for doc in scan_docs] == [1]
+    assert members == {"1:1": ["report.pdf:2"], "1:2": ["report.pdf:1"]}
+
+    # Only the scanned document's pages stand in for the duplicates
+    relevant = [
+        {"document_id": 1, "source_document": "report.pdf", "page_number": 1},
+        {"document_id": 3, "source_document": "report.pdf", "page_number": 2},
+    ]
+    attach_cluster_members(relevant, members)
+    assert relevant[0]["also_in"] == ["report.pdf:2"]
+    assert "also_in" not in relevant[1]
+
+
+def test_pages_whose_representative_is_gone_are_scanned():
+    documents = [
+        _document(1, "a.pdf", [TEXT_A]),
+        _document(2, "b.pdf", [TEXT_A]),
+    ]
+    find_duplicates(documents)
+    scan_docs, members = plan_cluster_scan(documents[1:], documents[1:])
+    assert [doc["id"] for doc in scan_docs] == [2]
+    assert members == {"2:1": []}
@@ -0,0 +1,35 @@
+import asyncio
+
+from conftest import make_pages
+from disconnect import RequestScope, stream_until_disconnect
+
+
+def test_cancelled_answer_stream_is_counted_once(make_service):
+    async def handler(kwargs):
+        await asyncio.sleep(10)
+
+    service = make_service(handler)
+
+    async def run():
+        disconnected = asyncio.Event()
+
+        async def events():
+            async for event in service.generate_answer_stream(make_pages(2), "question"):
+                yield event
+
+        async def is_disconnected():
+            return disconnected.is_set()
+
+        scope = RequestScope()
+        stream = stream_until_disconnect(events(), is_disconnected, scope)
+        consumer = asyncio.create_task(stream.__anext__())
+        # Disconnect while the answer call is waiting on the model
+        while not service.client.calls:
+            await asyncio.sleep(0.01)
+        disconnected.set()
+        await asyncio.gather(consumer, return_exceptions=True)
+        return scope
+
+    scope = asyncio.run(run())
+    assert scope.disconnected
+    assert scope.cancelled_calls == 1
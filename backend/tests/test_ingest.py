@@ -0,0 +1,117 @@
+import asyncio
+import os
+
+from ingest import IngestionQueue
+
+
+def _queue(directory, processed):
+    def process_file(path, filename, document_id, lazy):
+        processed.append(filename)
+        with open(path, "rb") as file:
+            text = file.read().decode()
+        return {
+            "id": document_id,
+            "filename": filename,
+            "pages": [{"page_number": 1, "text": text}],
+            "total_pages": 1,
+        }
+
+    async def finish_job(documents):
+        return {"documents": documents}
+
+    return IngestionQueue(process_file, finish_job, directory=str(directory), workers=2)
+
+
+async def _wait_for(queue, job_id, status="complete"):
+    for _ in range(100):
+        job = await queue.job(job_id)
+        if job["status"] == status:
+            return job
+        await queue.wait_for_change(0.05)
+    raise AssertionError(f"job stayed {job['status']}")
+
+
+def test_job_runs_to_completion(tmp_path):
+    async def scenario():
+        processed = []
+        queue = _queue(tmp_path, processed)
+        await queue.start()
+        try:
+            job_id = await queue.submit("docs", None, [("a.pdf", b"alpha"), ("b.pdf", b"beta")])
+            await _wait_for(queue, job_id)
+            # Results and spooled files are cleaned up right after completion
+            for _ in range(100):
+                job = await queue.job(job_id)
+                if not os.path.exists(tmp_path / job_id) and not any(
+                    file["result"] for file in job["files"]
+                ):
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+        return processed, job
+
+    processed, job = asyncio.run(scenario())
+    assert sorted(processed) == ["a.pdf", "b.pdf"]
+    assert all(file["status"] == "done" and file["result"] is None for file in job["files"])
+    assert not os.path.exists(tmp_path / job["id"])
+
+
+def test_processes_sharing_the_database_extract_each_file_once(tmp_path):
+    async def scenario():
+        processed = []
+        first = _queue(tmp_path, processed)
+        second = _queue(tmp_path, processed)
+        await first.start()
+        job_id = await first.submit("docs", None, [(f"{n}.pdf", b"x") for n in range(6)])
+        # Queued before the second process starts: both now hold every file
+        await second.start()
+        try:
+            await _wait_for(first, job_id)
+        finally:
+            await first.stop()
+            await second.stop()
+        return processed
+
+    assert sorted(asyncio.run(scenario())) == [f"{n}.pdf" for n in range(6)]
+
+
+def test_files_of_a_dead_process_are_resumed(tmp_path):
+    async def scenario():
+        processed = []
+        queue = _queue(tmp_path, processed)
+        # A job recorded by another process, without starting this one
+        job_id = "job"
+        queue._spool_job(job_id, "docs", None, [("a.pdf", b"x")])
+        # Claimed by a process that no longer exists
+        queue.store.claim_file(job_id, 0, owner=2**22 + 1)
+        await queue.start()
+        try:
+            await _wait_for(queue, job_id)
+        finally:
+            await queue.stop()
+        return processed
+
+    assert asyncio.run(scenario()) == ["a.pdf"]
+
+
+def test_files_a_live_process_is_extracting_are_left_alone(tmp_path):
+    async def scenario():
+        processed = []
+        queue = _queue(tmp_path, processed)
+        # A job recorded by another process, without starting this one
+        job_id = "job"
+        queue._spool_job(job_id, "docs", None, [("a.pdf", b"x")])
+        queue.store.claim_file(job_id, 0, owner=os.getppid())
+        await queue.start()
+        try:
+            await asyncio.sleep(0.1)
+            job = await queue.job(job_id)
+        finally:
+            await queue.stop()
+        return processed, job
+
+    processed, job = asyncio.run(scenario())
+    assert processed == []
+    assert job["files"][0]["status"] == "processing"
+
@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+from conftest import completion, make_pages
+from relevance_memory import RelevanceMemory
+
+
+def _documents():
+    return [
+        {"id": 1, "filename": "report.pdf", "total_pages": 5, "pages": make_pages(5, "report.pdf")},
+        {"id": 2, "filename": "report.pdf", "total_pages": 5, "pages": make_pages(5, "report.pdf")},
+    ]
+
+
+def test_memory_tells_same_named_documents_apart():
+    documents = _documents()
+    relevant = [{"document_id": 2, "source_document": "report.pdf", "page_number": 3}]
+    token = RelevanceMemory.from_relevant_pages(relevant, documents).encode()
+
+    candidates = RelevanceMemory.decode(token).candidate_documents(documents)
+    assert [doc["id"] for doc in candidates] == [2]
+    assert [page["page_number"] for page in candidates[0]["pages"]] == [2, 3, 4]
+
+
+def test_memory_stops_matching_a_replaced_document():
+    relevant = [{"document_id": 1, "source_document": "report.pdf", "page_number": 3}]
+    token = RelevanceMemory.from_relevant_pages(relevant, _documents()).encode()
+    replaced = [{"id": 1, "filename": "other.pdf", "total_pages": 5, "pages": make_pages(5)}]
+    assert RelevanceMemory.decode(token).candidate_documents(replaced) == []
+    assert RelevanceMemory.decode("not a token") is None
+
+
+def test_candidate_check_matches_pages_by_document_number(make_service):
+    async def handler(kwargs):
+        return completion(
+            json.dumps({"pages": [{"document": 1, "page_number": 2}], "sufficient": True})
+        )
+
+    service = make_service(handler)
+    pages, sufficient, _ = asyncio.run(
+        service.check_candidate_pages(_documents(), "question")
+    )
+    assert sufficient
+    assert [(page["document_id"], page["page_number"]) for page in pages] == [(2, 2)]
@@ -0,0 +1,256 @@
+import asyncio
+
+import pytest
+
+import llm_service
+import resilience
+from conftest import make_pages, prompt_pages, scan_completion
+from disconnect import RequestScope, request_scope
+from llm_service import ScanStats
+from resilience import RetryBudget, hedged_call, is_transient_error
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def test_retry_budget_deposits_a_ratio_per_first_attempt(clock):
+    budget = RetryBudget(ratio=0.5, min_tokens=1.0, max_tokens=2.0)
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+    budget.deposit()
+    assert not budget.try_withdraw()
+    budget.deposit()
+    assert budget.try_withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 2.0
+
+
+def test_retry_budget_refills_up_to_its_floor(clock):
+    budget = RetryBudget(ratio=0.0, min_tokens=10.0, refill_period=60.0)
+    budget.tokens = 0.0
+    clock.now += 30
+    assert budget.try_withdraw()
+    assert budget.tokens == pytest.approx(4.0)
+    # Refilling never goes past the floor
+    clock.now += 3600
+    budget.deposit()
+    assert budget.tokens == pytest.approx(10.0)
+    # ...and deposits above it are not topped up
+    budget.tokens = 12.0
+    clock.now += 60
+    budget.deposit()
+    assert budget.tokens == pytest.approx(12.0)
+
+
+def test_retry_budget_refill_does_not_count_time_above_the_floor(clock):
+    budget = RetryBudget(ratio=0.0, min_tokens=10.0, refill_period=60.0)
+    budget.tokens = 11.0
+    clock.now += 600
+    assert budget.try_withdraw()
+    assert budget.try_withdraw()
+    # Only the time spent below the floor refills
+    assert budget.tokens == pytest.approx(9.0)
+
+
+class _StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def test_transient_errors():
+    assert is_transient_error(_StatusError(429))
+    assert is_transient_error(_StatusError(503))
+    assert not is_transient_error(_StatusError(400))
+    assert not is_transient_error(asyncio.TimeoutError())
+    assert not is_transient_error(ValueError("context length exceeded"))
+
+
+def _calls(*behaviours):
+    """A call whose n-th invocation sleeps, then returns or raises per `behaviours[n]`"""
+    started = []
+    cancelled = []
+
+    async def call():
+        index = len(started)
+        started.append(index)
+        delay, outcome = behaviours[index]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return call, started, cancelled
+
+
+def test_hedged_call_returns_a_fast_result_without_hedging():
+    call, started, _ = _calls((0.0, "primary"))
+    assert asyncio.run(hedged_call(call, timeout=1, hedge_delay=0.5)) == "primary"
+    assert started == [0]
+
+
+def test_hedge_wins_over_a_slow_primary():
+    call, started, cancelled = _calls((1.0, "primary"), (0.0, "hedge"))
+    budget = RetryBudget(min_tokens=1.0)
+    result = asyncio.run(hedged_call(call, timeout=2, hedge_delay=0.05, budget=budget))
+    assert result == "hedge"
+    assert started == [0, 1]
+    assert cancelled == [0]
+    assert budget.tokens < 1.0
+
+
+def test_no_hedge_once_the_budget_is_spent():
+    call, started, _ = _calls((0.1, "primary"), (0.0, "hedge"))
+    budget = RetryBudget(min_tokens=0.0)
+    budget.tokens = 0.0
+    result = asyncio.run(hedged_call(call, timeout=1, hedge_delay=0.01, budget=budget))
+    assert result == "primary"
+    assert started == [0]
+
+
+def test_hedged_call_times_out_and_cancels_attempts():
+    call, started, cancelled = _calls((1.0, "primary"), (1.0, "hedge"))
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(hedged_call(call, timeout=0.1, hedge_delay=0.02))
+    assert started == [0, 1]
+    assert sorted(cancelled) == [0, 1]
+
+
+def test_fast_failure_is_raised_without_a_hedge():
+    call, started, _ = _calls((0.0, ValueError("bad request")))
+    with pytest.raises(ValueError):
+        asyncio.run(hedged_call(call, timeout=1, hedge_delay=0.5))
+    assert started == [0]
+
+
+def _scan(service, pages, scope=None):
+    async def run():
+        if scope is not None:
+            request_scope.set(scope)
+        return await service._process_page_chunk(
+            pages, "question", "doc.pdf", 0, None, "gpt-5-mini", ScanStats(None, "gpt-5-mini")
+        )
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_service, "backoff_delay", lambda attempt: 0.0)
+
+
+def test_failing_chunk_is_bisected(make_service):
+    async def handler(kwargs):
+        pages = prompt_pages(kwargs)
+        if len(pages) > 2:
+            raise ValueError("context length exceeded")
+        return scan_completion(pages)
+
+    service = make_service(handler)
+    service.chunk_max_retries = 0
+    scope = RequestScope()
+    relevant, cost = _scan(service, make_pages(4), scope)
+
+    assert [page["page_number"] for page in relevant] == [1, 2, 3, 4]
+    assert not any(page.get("scan_failed") for page in relevant)
+    assert cost > 0
+    # One failed call on the whole chunk, then one per half
+    assert [len(prompt_pages(call)) for call in service.client.calls] == [4, 2, 2]
+    # The split drew one token; each scan deposited 0.2
+    assert service.retry_budget.tokens == pytest.approx(9.6, abs=0.01)
+    assert scope.fallbacks == []
+
+
+def test_chunk_that_times_out_is_bisected(make_service):
+    async def handler(kwargs):
+        pages = prompt_pages(kwargs)
+        if len(pages) > 1:
+            await asyncio.sleep(1)
+        return scan_completion(pages)
+
+    service = make_service(handler)
+    service.chunk_timeout = 0.05
+    service.chunk_max_retries = 0
+    relevant, _ = _scan(service, make_pages(2))
+    assert [page["page_number"] for page in relevant] == [1, 2]
+
+
+def test_pages_that_keep_failing_are_flagged(make_service):
+    async def handler(kwargs):
+        pages = prompt_pages(kwargs)
+        if 2 in pages:
+            raise ValueError("page 2 cannot be read")
+        return scan_completion(pages)
+
+    service = make_service(handler)
+    service.chunk_max_retries = 0
+    scope = RequestScope()
+    relevant, _ = _scan(service, make_pages(2), scope)
+
+    by_number = {page["page_number"]: page for page in relevant}
+    assert not by_number[1].get("scan_failed")
+    assert by_number[2]["scan_failed"] is True
+    assert by_number[2]["source_document"] == "doc.pdf"
+    assert "relevance_score" not in by_number[2]
+    assert scope.fallbacks == ["page_detection"]
+    # Flagged pages rank after every scored one
+    assert [page["page_number"] for page in service.rank_pages(relevant)] == [1, 2]
+
+
+def test_transient_failures_are_not_bisected(make_service):
+    async def handler(kwargs):
+        raise _StatusError(503)
+
+    service = make_service(handler)
+    service.chunk_max_retries = 1
+    relevant, cost = _scan(service, make_pages(4))
+
+    assert all(page["scan_failed"] for page in relevant)
+    assert cost == 0.0
+    # The first attempt and one retry, no split
+    assert [len(prompt_pages(call)) for call in service.client.calls] == [4, 4]
+
+
+def test_no_bisection_once_the_retry_budget_is_spent(make_service):
+    async def handler(kwargs):
+        raise ValueError("context length exceeded")
+
+    service = make_service(handler)
+    service.chunk_max_retries = 0
+    service.retry_budget = RetryBudget(ratio=0.0, min_tokens=0.0)
+    service.retry_budget.tokens = 0.0
+    relevant, _ = _scan(service, make_pages(4))
+
+    assert all(page["scan_failed"] for page in relevant)
+    assert len(service.client.calls) == 1
+
+
+def test_transient_errors_are_retried(make_service):
+    failures = [_StatusError(429)]
+
+    async def handler(kwargs):
+        if failures:
+            raise failures.pop()
+        return scan_completion(prompt_pages(kwargs))
+
+    service = make_service(handler)
+    relevant, _ = _scan(service, make_pages(3))
+    assert [page["page_number"] for page in relevant] == [1, 2, 3]
+    assert len(service.client.calls) == 2
@@ -0,0 +1,115 @@
+import asyncio
+
+from scheduler import (
+    PRIORITY_ANSWER,
+    PRIORITY_BACKGROUND,
+    PRIORITY_SCAN,
+    FairScheduler,
+    parse_weights,
+)
+
+
+def test_parse_weights_skips_invalid_entries():
+    assert parse_weights("alice=3, manuals=2,bad=x,") == {"alice": 3.0, "manuals": 2.0}
+
+
+def test_weight_for_uses_the_first_known_key():
+    scheduler = FairScheduler(weights={"alice": 3.0, "manuals": 2.0})
+    assert scheduler.weight_for("alice", "manuals") == 3.0
+    assert scheduler.weight_for(None, "manuals") == 2.0
+    assert scheduler.weight_for("bob") == 1.0
+
+
+async def _run_in_order(scheduler, calls):
+    """
+    Hold the only slot, queue `calls` of (flow, priority, weight), then
+    release it and return the order the queued calls were granted in
+    """
+    order = []
+    await scheduler.acquire("holder", PRIORITY_ANSWER)
+
+    async def call(name, flow, priority, weight):
+        async with scheduler.slot(flow, priority, weight=weight):
+            order.append(name)
+
+    tasks = []
+    for name, (flow, priority, weight) in enumerate(calls):
+        tasks.append(asyncio.create_task(call(name, flow, priority, weight)))
+        await asyncio.sleep(0)
+    assert scheduler.queued == len(calls)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_higher_priority_runs_first():
+    scheduler = FairScheduler(max_concurrency=1)
+    order = asyncio.run(
+        _run_in_order(
+            scheduler,
+            [
+                ("a", PRIORITY_BACKGROUND, 1.0),
+                ("a", PRIORITY_SCAN, 1.0),
+                ("a", PRIORITY_ANSWER, 1.0),
+            ],
+        )
+    )
+    assert order == [2, 1, 0]
+
+
+def test_backlogged_flow_does_not_starve_a_newcomer():
+    scheduler = FairScheduler(max_concurrency=1)
+    calls = [("big", PRIORITY_SCAN, 1.0)] * 10 + [("small", PRIORITY_SCAN, 1.0)]
+    order = asyncio.run(_run_in_order(scheduler, calls))
+    # The newcomer's call runs right after the backlog's first one
+    assert order.index(10) == 1
+
+
+def test_weights_share_slots_proportionally():
+    scheduler = FairScheduler(max_concurrency=1)
+    calls = []
+    for _ in range(6):
+        calls.append(("heavy", PRIORITY_SCAN, 2.0))
+        calls.append(("light", PRIORITY_SCAN, 1.0))
+    order = asyncio.run(_run_in_order(scheduler, calls))
+    first_six = [calls[name][0] for name in order[:6]]
+    assert first_six.count("heavy") == 4
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1)
+        await scheduler.acquire("holder", PRIORITY_SCAN)
+        waiter = asyncio.create_task(scheduler.acquire("a", PRIORITY_SCAN))
+        other = asyncio.create_task(scheduler.acquire("b", PRIORITY_SCAN))
+        await asyncio.sleep(0)
+        assert scheduler.queued == 2
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.queued == 1
+        scheduler.release()
+        await other
+        assert scheduler.in_flight == 1
+        scheduler.release()
+        assert scheduler.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_slot_granted_and_cancelled_in_the_same_tick_is_handed_on():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1)
+        await scheduler.acquire("holder", PRIORITY_SCAN)
+        waiter = asyncio.create_task(scheduler.acquire("a", PRIORITY_SCAN))
+        other = asyncio.create_task(scheduler.acquire("b", PRIORITY_SCAN))
+        await asyncio.sleep(0)
+
+        # The release grants `waiter` the slot before it gets to run
+        scheduler.release()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await asyncio.wait_for(other, 1)
+        assert scheduler.in_flight == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,101 @@
+import asyncio
+
+from sse import coalesce_content, frame_type
+
+
+class _Events:
+    """Async iterator over (delay, event) pairs that records whether it was closed"""
+
+    def __init__(self, items):
+        self.items = list(items)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.items:
+            raise StopAsyncIteration
+        delay, event = self.items.pop(0)
+        await asyncio.sleep(delay)
+        return event
+
+    async def aclose(self):
+        self.closed = True
+
+
+def _content(text, delay=0.0):
+    return delay, {"type": "content", "content": text}
+
+
+def _collect(events, **kwargs):
+    async def run():
+        return [event async for event in coalesce_content(events, **kwargs)]
+
+    return asyncio.run(run())
+
+
+def test_first_token_passes_through_and_the_rest_is_merged():
+    events = _Events([_content("a"), _content("b"), _content("c"), (0, {"type": "cost", "cost": 1.0})])
+    result = _collect(events, interval_ms=1000, max_bytes=1000)
+    assert result == [
+        {"type": "content", "content": "a"},
+        {"type": "content", "content": "bc"},
+        {"type": "cost", "cost": 1.0},
+    ]
+
+
+def test_buffer_flushes_at_max_bytes():
+    events = _Events([_content("a"), _content("bb"), _content("cc"), _content("d")])
+    result = _collect(events, interval_ms=1000, max_bytes=4)
+    assert [event["content"] for event in result] == ["a", "bbcc", "d"]
+
+
+def test_buffer_flushes_when_the_model_pauses():
+    events = _Events([_content("a"), _content("b"), _content("c", delay=0.2)])
+    result = _collect(events, interval_ms=20, max_bytes=1000)
+    assert [event["content"] for event in result] == ["a", "b", "c"]
+
+
+def test_coalescing_off_passes_everything_through():
+    events = _Events([_content("a"), _content("b")])
+    result = _collect(events, interval_ms=0, max_bytes=0)
+    assert [event["content"] for event in result] == ["a", "b"]
+    assert events.closed
+
+
+def test_inner_stream_is_closed_when_the_consumer_stops():
+    async def run(**kwargs):
+        events = _Events([_content("a"), _content("b"), _content("c")])
+        stream = coalesce_content(events, **kwargs)
+        async for _ in stream:
+            break
+        await stream.aclose()
+        return events.closed
+
+    assert asyncio.run(run(interval_ms=1000, max_bytes=1000))
+    assert asyncio.run(run(interval_ms=0, max_bytes=0))
+
+
+def test_inner_stream_is_closed_when_the_consumer_is_cancelled():
+    async def run():
+        events = _Events([_content("a"), _content("b", delay=10)])
+
+        async def consume():
+            async for _ in coalesce_content(events, interval_ms=1000, max_bytes=1000):
+                pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return events.closed
+
+    assert asyncio.run(run())
+
+
+def test_frame_type():
+    assert frame_type('data: {"type": "complete", "cost": 0}\n\n') == "complete"
+    assert frame_type('data: {"cost": 0, "type":"complete"}\n\n') == "complete"
+    assert frame_type("data: [DONE]\n\n") is None
+    assert frame_type(": keep-alive\n\n") is None
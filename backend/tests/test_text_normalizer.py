@@ -0,0 +1,26 @@
+from text_normalizer import clean_text, normalize_pages
+
+
+def _page(number, body):
+    lines = ["ACME Annual Report", *body, f"Page {number} of 9"]
+    return {"page_number": number, "text": "\n".join(lines)}
+
+
+def test_pages_are_tidied_in_one_pass_over_the_document():
+    pages = [
+        _page(1, ["  Revenue\tgrew  by ten   percent  ", "", "across the inter-", "national offices"]),
+        _page(2, ["Costs fell in every region of the company"]),
+        _page(3, [" \t "]),
+    ]
+    stats = normalize_pages(pages)
+    assert pages[0]["text"] == "Revenue grew by ten percent\nacross the international offices"
+    assert pages[1]["text"] == "Costs fell in every region of the company"
+    assert pages[2]["text"] == ""
+    assert stats["blank_pages"] == [3]
+    # The running header and the "Page # of #" footer
+    assert stats["boilerplate_lines"] == 2
+
+
+def test_a_letter_is_joined_to_one_hyphenated_break_only():
+    assert clean_text(["co-", "o-", "p"], set()) == "coo-\np"
+    assert clean_text(["A-", "b", "x-", "-", "y"], set()) == "A-\nb\nx-\n-\ny"
@@ -0,0 +1,202 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import BACKEND_DIR, make_pages, prompt_pages, scan_completion
+from llm_service import ScanStats
+from metrics import metrics
+from resp import MiniRedis
+from work_queue import ProcessWorkQueue, RedisWorkQueue, _run_until_deadline, serve_redis
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def fake_openai():
+    """fake_openai.py on a free port; workers reach it through OPENAI_BASE_URL"""
+    port = _free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.join(BACKEND_DIR, "fake_openai.py"),
+            "--port", str(port), "--latency-ms", "10", "--seed", "1",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@pytest.fixture
+def worker_env(monkeypatch, fake_openai):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_BASE_URL", fake_openai)
+    monkeypatch.setenv("PAGE_SCAN_SCREEN_MODEL", "")
+
+
+def _task(pages, deadline=None):
+    return {
+        "pages": pages,
+        "question": "What is on page 2?",
+        "filename": "doc.pdf",
+        "chunk_index": 0,
+        "chat_history": [],
+        "model": "gpt-5-mini",
+        "screen_model": None,
+        "flow": "tenant",
+        "weight": 1.0,
+        "deadline": deadline,
+    }
+
+
+def _check_scan_result(result, pages):
+    assert result["stats"]["chunks"] == 1
+    assert result["cost"] > 0
+    numbers = {page["page_number"] for page in pages}
+    for page in result["pages"]:
+        assert page["page_number"] in numbers
+        assert page["source_document"] == "doc.pdf"
+        assert 0.0 <= page["relevance_score"] <= 1.0
+
+
+def test_redis_queue_round_trip(worker_env):
+    async def scenario():
+        server = MiniRedis()
+        port = await server.start()
+        url = f"redis://127.0.0.1:{port}/0"
+        worker = asyncio.create_task(serve_redis(url, "test:chunks", concurrency=2))
+        queue = RedisWorkQueue(url, key="test:chunks", task_timeout=30)
+        try:
+            pages = make_pages(4)
+            results = await asyncio.gather(
+                queue.run(_task(pages)), queue.run(_task(pages, time.time() + 30))
+            )
+        finally:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+            await queue.close()
+            await server.stop()
+        return pages, results
+
+    pages, results = asyncio.run(scenario())
+    for result in results:
+        _check_scan_result(result, pages)
+
+
+def test_redis_queue_times_out_without_a_worker():
+    async def scenario():
+        server = MiniRedis()
+        port = await server.start()
+        queue = RedisWorkQueue(f"redis://127.0.0.1:{port}/0", key="test:idle", task_timeout=0.2)
+        timeouts = metrics.counters.get("work_queue_timeouts", 0)
+        try:
+            with pytest.raises(RuntimeError, match="is a worker running"):
+                await queue.run(_task(make_pages(2)))
+            # A deadline wins over the default timeout
+            started = time.monotonic()
+            with pytest.raises(RuntimeError, match="no result within"):
+                await queue.run(_task(make_pages(2), time.time() + 0.1))
+            assert time.monotonic() - started < 0.2
+        finally:
+            await queue.close()
+            await server.stop()
+        assert metrics.counters["work_queue_timeouts"] == timeouts + 2
+
+    asyncio.run(scenario())
+
+
+def test_process_queue_round_trip(worker_env):
+    async def scenario():
+        queue = ProcessWorkQueue(workers=1, concurrency=2, task_timeout=60)
+        try:
+            pages = make_pages(3)
+            return pages, await queue.run(_task(pages, time.time() + 60))
+        finally:
+            await queue.close()
+
+    pages, result = asyncio.run(scenario())
+    _check_scan_result(result, pages)
+
+
+def test_worker_rejects_tasks_past_their_deadline():
+    calls = []
+
+    async def handler(task):
+        calls.append(task)
+        await asyncio.sleep(1)
+        return {"pages": [], "cost": 0.0, "stats": {}}
+
+    async def scenario():
+        expired = await _run_until_deadline(handler, _task([], time.time() - 1))
+        assert expired == {"error": "deadline passed before the task started"}
+        assert calls == []
+
+        timed_out = await _run_until_deadline(handler, _task([], time.time() + 0.05))
+        assert timed_out == {"error": "deadline passed"}
+        assert len(calls) == 1
+
+    asyncio.run(scenario())
+
+
+def test_worker_reports_handler_errors():
+    async def handler(task):
+        raise ValueError("bad task")
+
+    result = asyncio.run(_run_until_deadline(handler, _task([])))
+    assert result == {"error": "bad task"}
+
+
+class _BrokenQueue:
+    remote = True
+
+    def __init__(self):
+        self.tasks = []
+
+    async def run(self, task):
+        self.tasks.append(task)
+        raise RuntimeError("no result within 0.0s (is a worker running?)")
+
+
+def test_dispatch_falls_back_to_a_local_scan(make_service):
+    async def handler(kwargs):
+        return scan_completion(prompt_pages(kwargs)[:1])
+
+    service = make_service(handler)
+    service.work_queue = _BrokenQueue()
+    fallbacks = metrics.counters.get("work_queue_fallbacks", 0)
+    pages = make_pages(3)
+
+    relevant, cost = asyncio.run(
+        service._dispatch_chunk(
+            pages, "question", "doc.pdf", 0, [], "gpt-5-mini",
+            ScanStats(None, "gpt-5-mini"), time.monotonic() + 30,
+        )
+    )
+
+    # The remote task carried plain pages and a wall-clock deadline
+    task = service.work_queue.tasks[0]
+    assert task["pages"] == pages
+    assert time.time() < task["deadline"] <= time.time() + 30
+    # ...and the chunk was scanned here instead
+    assert [page["page_number"] for page in relevant] == [1]
+    assert cost > 0
+    assert len(service.client.calls) == 1
+    assert metrics.counters["work_queue_fallbacks"] == fallbacks + 1
@@ -0,0 +1,139 @@
+import re
+from collections import Counter
+from typing import Any, Dict, List
+
+# Only the first/last few lines of a page are candidates for running
+# headers and footers, so repeated body text is never stripped
+EDGE_LINES = 3
+# A line is boilerplate if it appears on at least this share of pages...
+BOILERPLATE_PAGE_SHARE = 0.5
+# ...and on at least this many pages
+BOILERPLATE_MIN_PAGES = 3
+# Pages with less text than this after normalization are flagged blank
+MIN_PAGE_CHARS = 20
+CHARS_PER_TOKEN = 4
+
+_DIGITS = re.compile(r"\d+")
+# Front matter is numbered with lowercase roman numerals; only well-formed
+# ones below 90 count, so edge lines like "I", "MD", "mild" or "civil" stay
+_PAGE_NUMBER_LINE = re.compile(
+    r"^\s*((?i:page)\s*)?(\d+|(?=[ivxl])(xl|l?x{0,3})(ix|iv|v?i{0,3}))"
+    r"(\s*((?i:of)|/)\s*\d+)?\s*$"
+)
+# Searched by its literal prefix; the letter before it is checked by hand
+_HYPHENATED_BREAK = re.compile(r"-\n(?=[a-z])")
+# The pages of a document are tidied as one string joined by this separator,
+# so each pass runs once per document; splitlines() breaks lines on it, so
+# it never occurs inside a page's lines
+_PAGE_SEPARATOR = "\x1e"
+
+
+def _line_key(line: str) -> str:
+    """Key used to match running headers whose page numbers change"""
+    return _DIGITS.sub("#", line.strip().lower())
+
+
+def _edge_count(line_count: int) -> int:
+    """Edge window size, kept to a third of the page so short pages keep a body"""
+    return max(1, min(EDGE_LINES, line_count // 3))
+
+
+def _edge_keys(lines: List[str]) -> set:
+    edge = _edge_count(len(lines))
+    edges = lines[:edge] + lines[-edge:]
+    return {_line_key(line) for line in edges if line.strip()}
+
+
+def find_boilerplate(page_lines: List[List[str]]) -> set:
+    """Return keys of edge lines repeated across many pages of a document"""
+    if len(page_lines) < BOILERPLATE_MIN_PAGES:
+        return set()
+    counts = Counter()
+    for lines in page_lines:
+        counts.update(_edge_keys(lines))
+    threshold = max(BOILERPLATE_MIN_PAGES, len(page_lines) * BOILERPLATE_PAGE_SHARE)
+    return {key for key, count in counts.items() if count >= threshold}
+
+
+def _page_body(lines: List[str], boilerplate: set) -> str:
+    """A page's trimmed lines without boilerplate and page-number lines at its edges"""
+    edge = _edge_count(len(lines))
+
+    def kept(edge_lines):
+        return [
+            line
+            for line in edge_lines
+            if not (_line_key(line) in boilerplate or _PAGE_NUMBER_LINE.match(line))
+        ]
+
+    if len(lines) > 2 * edge:
+        lines = kept(lines[:edge]) + lines[edge:-edge] + kept(lines[-edge:])
+    else:
+        lines = kept(lines)
+    return "\n".join(map(str.strip, lines))
+
+
+def _join_hyphenated(text: str) -> str:
+    """Join words hyphenated across a line break between lowercase letters"""
+    pieces = []
+    start = 0
+    taken = -1
+    for match in _HYPHENATED_BREAK.finditer(text):
+        at = match.start()
+        # The letter before the hyphen must not be the one a previous join
+        # already took as its second half
+        if at > 0 and at - 1 != taken and "a" <= text[at - 1] <= "z":
+            pieces.append(text[start:at])
+            start = taken = match.end()
+    pieces.append(text[start:])
+    return "".join(pieces)
+
+
+def _tidy(text: str) -> str:
+    """Collapse runs of inline whitespace and join hyphenated line breaks"""
+    # \f and \v break lines, so tabs and no-break spaces are all that is left
+    text = text.replace("\t", " ").replace("\u00a0", " ")
+    while "  " in text:
+        text = text.replace("  ", " ")
+    return _join_hyphenated(text)
+
+
+def clean_text(lines: List[str], boilerplate: set) -> str:
+    """Drop boilerplate and page-number lines at the page edges, then tidy up"""
+    return _tidy(_page_body(lines, boilerplate))
+
+
+def normalize_pages(pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Normalize the text of a document's pages in place: strip running headers,
+    footers and page-number lines, join hyphenated line breaks, collapse
+    whitespace and blank lines, and flag near-empty pages with `is_blank`.
+    Returns per-document statistics including the estimated token savings.
+    """
+    page_lines = [list(filter(str.strip, (page["text"] or "").splitlines())) for page in pages]
+    boilerplate = find_boilerplate(page_lines)
+
+    # Every page is tidied in the same passes over the whole document
+    texts = _tidy(
+        _PAGE_SEPARATOR.join(_page_body(lines, boilerplate) for lines in page_lines)
+    ).split(_PAGE_SEPARATOR)
+
+    chars_before = 0
+    chars_after = 0
+    blank_pages = []
+    for page, text in zip(pages, texts):
+        chars_before += len(page["text"] or "")
+        page["text"] = text
+        page["char_count"] = len(text)
+        page["is_blank"] = len(text) < MIN_PAGE_CHARS
+        if page["is_blank"]:
+            blank_pages.append(page["page_number"])
+        chars_after += len(text)
+
+    return {
+        "chars_before": chars_before,
+        "chars_after": chars_after,
+        "estimated_tokens_saved": (chars_before - chars_after) // CHARS_PER_TOKEN,
+        "boilerplate_lines": len(boilerplate),
+        "blank_pages": blank_pages,
+    }
@@ -0,0 +1,241 @@
+import re
+from typing import Any, Dict, List, Optional
+
+import PyPDF2
+
+# Sections shown to the TOC pass: the top levels of the outline, at most
+# this many entries (deeper levels are dropped first)
+TOC_PROMPT_LEVELS = 3
+TOC_PROMPT_SECTIONS = 300
+
+# Structured output of the TOC pass: indices of the chosen sections
+TOC_SECTION_SCHEMA = {
+    "name": "toc_sections",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "sections": {"type": "array", "items": {"type": "integer"}},
+        },
+        "required": ["sections"],
+        "additionalProperties": False,
+    },
+}
+
+# Named destinations generated by LaTeX/Word ("G1.1034", "_Toc123") carry
+# no title worth showing
+_MACHINE_NAME = re.compile(r"^(_?Toc\d+|[A-Z]?\d+(\.\d+)*|G\d+\.\d+)$")
+
+
+def _roman(number: int) -> str:
+    numerals = [
+        (1000, "M"), (900, "CM"), (500, "D"), (400, "CD"), (100, "C"), (90, "XC"),
+        (50, "L"), (40, "XL"), (10, "X"), (9, "IX"), (5, "V"), (4, "IV"), (1, "I"),
+    ]
+    result = ""
+    for value, numeral in numerals:
+        while number >= value:
+            result += numeral
+            number -= value
+    return result
+
+
+def _letters(number: int) -> str:
+    """1 -> A, 26 -> Z, 27 -> AA (the PDF page label convention)"""
+    return chr(ord("A") + (number - 1) % 26) * ((number - 1) // 26 + 1)
+
+
+def read_page_labels(reader: PyPDF2.PdfReader) -> Optional[List[str]]:
+    """Page labels from the catalog's /PageLabels number tree, or None"""
+    try:
+        root = reader.trailer["/Root"].get_object()
+        if "/PageLabels" not in root:
+            return None
+        ranges = []
+
+        def walk(node):
+            node = node.get_object()
+            nums = node.get("/Nums", [])
+            for i in range(0, len(nums) - 1, 2):
+                ranges.append((int(nums[i]), nums[i + 1].get_object()))
+            for kid in node.get("/Kids", []):
+                walk(kid)
+
+        walk(root["/PageLabels"])
+    except Exception as e:
+        print(f"Could not read PDF page labels: {e}")
+        return None
+    if not ranges:
+        return None
+
+    ranges.sort(key=lambda item: item[0])
+    labels = []
+    total_pages = len(reader.pages)
+    for i, (start, spec) in enumerate(ranges):
+        end = ranges[i + 1][0] if i + 1 < len(ranges) else total_pages
+        style = spec.get("/S")
+        prefix = str(spec.get("/P", ""))
+        first = int(spec.get("/St", 1))
+        for offset in range(max(0, end - start)):
+            number = first + offset
+            if style == "/D":
+                value = str(number)
+            elif style == "/R":
+                value = _roman(number)
+            elif style == "/r":
+                value = _roman(number).lower()
+            elif style == "/A":
+                value = _letters(number)
+            elif style == "/a":
+                value = _letters(number).lower()
+            else:
+                value = ""
+            labels.append(prefix + value)
+    # Pages outside every range are labeled by their number
+    labels = [str(n + 1) for n in range(ranges[0][0])] + labels
+    labels += [str(n + 1) for n in range(len(labels), total_pages)]
+    return labels[:total_pages]
+
+
+def read_outline(reader: PyPDF2.PdfReader) -> List[Dict[str, Any]]:
+    """Flatten the PDF outline into {title, page_number, level} entries"""
+    entries = []
+
+    def walk(items, level):
+        for item in items:
+            if isinstance(item, list):
+                walk(item, level + 1)
+                continue
+            try:
+                page_number = reader.get_destination_page_number(item) + 1
+            except Exception:
+                continue
+            entries.append(
+                {"title": str(item.title).strip(), "page_number": page_number, "level": level}
+            )
+
+    try:
+        walk(reader.outline, 0)
+    except Exception as e:
+        print(f"Could not read PDF outline: {e}")
+    return entries
+
+
+def _destination_entries(reader: PyPDF2.PdfReader) -> List[Dict[str, Any]]:
+    entries = []
+    try:
+        destinations = reader.named_destinations
+    except Exception as e:
+        print(f"Could not read PDF named destinations: {e}")
+        return entries
+    for name, destination in destinations.items():
+        title = str(name).strip().lstrip("/")
+        if _MACHINE_NAME.match(title) or sum(ch.isalpha() for ch in title) < 3:
+            continue
+        try:
+            page_number = reader.get_destination_page_number(destination) + 1
+        except Exception:
+            continue
+        entries.append({"title": title, "page_number": page_number, "level": 0})
+    return entries
+
+
+def _label_entries(labels: List[str]) -> List[Dict[str, Any]]:
+    """One entry per run of pages sharing a label prefix (front matter, appendices)"""
+    entries = []
+    previous = None
+    for index, label in enumerate(labels):
+        prefix = re.sub(r"[0-9]+$", "", label)
+        kind = "roman" if re.fullmatch(r"[ivxlcdm]+", label, re.I) else prefix
+        if kind != previous:
+            entries.append({"title": f"Pages labeled {label}...", "page_number": index + 1, "level": 0})
+            previous = kind
+    return entries
+
+
+def build_sections(entries: List[Dict[str, Any]], total_pages: int) -> List[Dict[str, Any]]:
+    """
+    Give each entry a page range: from its page to the page before the next
+    entry at the same or a higher level (the last one runs to the end).
+    """
+    entries = sorted(entries, key=lambda entry: (entry["page_number"], entry["level"]))
+    sections = []
+    for i, entry in enumerate(entries):
+        end_page = total_pages
+        for following in entries[i + 1 :]:
+            if following["level"] <= entry["level"]:
+                end_page = following["page_number"] - 1
+                break
+        sections.append(
+            {
+                "title": entry["title"],
+                "level": entry["level"],
+                "start_page": entry["page_number"],
+                "end_page": max(entry["page_number"], min(end_page, total_pages)),
+            }
+        )
+    return sections
+
+
+def read_toc(reader: PyPDF2.PdfReader) -> List[Dict[str, Any]]:
+    """
+    Table of contents of a PDF as {title, level, start_page, end_page, label}
+    sections. The outline is used when present, then named destinations, then
+    runs of page labels; empty if the PDF has none of them.
+    """
+    total_pages = len(reader.pages)
+    labels = read_page_labels(reader)
+    entries = read_outline(reader)
+    if len(entries) < 2:
+        entries = _destination_entries(reader)
+    if len(entries) < 2 and labels:
+        entries = _label_entries(labels)
+    if len(entries) < 2:
+        return []
+
+    seen = set()
+    unique = []
+    for entry in entries:
+        key = (entry["title"], entry["page_number"], entry["level"])
+        if key not in seen and 1 <= entry["page_number"] <= total_pages:
+            seen.add(key)
+            unique.append(entry)
+
+    sections = build_sections(unique, total_pages)
+    if labels:
+        for section in sections:
+            start_label = labels[section["start_page"] - 1]
+            end_label = labels[section["end_page"] - 1]
+            if start_label != str(section["start_page"]) or end_label != str(section["end_page"]):
+                section["label"] = f"{start_label}-{end_label}"
+    return sections
+
+
+def read_navigation(reader: PyPDF2.PdfReader) -> Dict[str, List[Dict[str, Any]]]:
+    """The flattened outline and the table of contents of a PDF"""
+    return {"outline": read_outline(reader), "toc": read_toc(reader)}
+
+
+def read_navigation_file(pdf_path: str) -> Dict[str, List[Dict[str, Any]]]:
+    with open(pdf_path, "rb") as file:
+        return read_navigation(PyPDF2.PdfReader(file))
+
+
+def format_toc(sections: List[Dict[str, Any]]) -> tuple[str, List[Dict[str, Any]]]:
+    """
+    Numbered, indented listing of the sections shown to the TOC pass, and the
+    sections it lists (indices in the listing refer to that list)
+    """
+    shown = [section for section in sections if section["level"] < TOC_PROMPT_LEVELS]
+    level = TOC_PROMPT_LEVELS - 1
+    while len(shown) > TOC_PROMPT_SECTIONS and level > 0:
+        shown = [section for section in shown if section["level"] < level]
+        level -= 1
+    shown = shown[:TOC_PROMPT_SECTIONS]
+    lines = []
+    for index, section in enumerate(shown):
+        pages = f"pages {section['start_page']}-{section['end_page']}"
+        if section.get("label"):
+            pages += f", labeled {section['label']}"
+        lines.append(f"{'  ' * section['level']}[{index}] {section['title']} ({pages})")
+    return "\n".join(lines), shown
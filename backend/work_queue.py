@@ -0,0 +1,347 @@
+"""
+Work queues for step 2 chunk scans.
+
+A chunk task is a JSON-serializable dict (pages, question, filename, history,
+model, fair-queuing flow and deadline); its result holds the relevant pages,
+the cost and the cascade counters. `LLMService.run_chunk_task` executes one.
+Backends, chosen with PAGE_SCAN_QUEUE:
+
+- "inprocess" (default): tasks run on the request's own event loop
+- "processes": a pool of local worker processes, each with its own event
+  loop, connection pool and scheduler
+- "redis://host:port/db": tasks are pushed to a Redis list and served by
+  workers on any node (`python work_queue.py --redis URL`); each API process
+  reads its results back from its own reply list. `resp.MiniRedis` can
+  stand in for Redis.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import metrics
+from resp import RespClient
+
+PAGE_SCAN_QUEUE = os.environ.get("PAGE_SCAN_QUEUE", "inprocess")
+PAGE_SCAN_QUEUE_WORKERS = int(os.environ.get("PAGE_SCAN_QUEUE_WORKERS", "4"))
+# Chunk tasks one worker process runs at once
+PAGE_SCAN_WORKER_CONCURRENCY = int(os.environ.get("PAGE_SCAN_WORKER_CONCURRENCY", "16"))
+QUEUE_KEY = os.environ.get("PAGE_SCAN_QUEUE_KEY", "no-vector:chunks")
+# Reply lists outlive a crashed API process by this long
+REPLY_TTL_SECONDS = 600
+# Seconds a blocking pop waits before checking for shutdown
+POLL_SECONDS = 5
+# Seconds to wait for a result of a task without a deadline
+DEFAULT_TASK_TIMEOUT = 180.0
+
+TaskHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class InProcessWorkQueue:
+    """Runs tasks on the caller's event loop; pages need not be serializable"""
+
+    remote = False
+
+    def __init__(self, handler: TaskHandler):
+        self.handler = handler
+
+    async def run(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.handler(task)
+
+    async def close(self):
+        pass
+
+
+async def _run_until_deadline(handler: TaskHandler, task: Dict[str, Any]) -> Dict[str, Any]:
+    """Worker side: run a task, giving up at its deadline (wall clock)"""
+    deadline = task.get("deadline")
+    timeout = None if deadline is None else deadline - time.time()
+    if timeout is not None and timeout <= 0:
+        metrics.incr("work_queue_expired_tasks")
+        return {"error": "deadline passed before the task started"}
+    try:
+        return await asyncio.wait_for(handler(task), timeout)
+    except asyncio.TimeoutError:
+        metrics.incr("work_queue_expired_tasks")
+        return {"error": "deadline passed"}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+class _Pending:
+    """Futures of submitted tasks, resolved from a reader thread or task"""
+
+    def __init__(self):
+        self._futures: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def add(self, task_id: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._futures[task_id] = (loop, future)
+        return future
+
+    def discard(self, task_id: str):
+        with self._lock:
+            self._futures.pop(task_id, None)
+
+    def resolve(self, task_id: str, result: Dict[str, Any]):
+        with self._lock:
+            entry = self._futures.pop(task_id, None)
+        if entry is None:
+            # The request gave up (deadline or disconnect) before the result came
+            metrics.incr("work_queue_late_results")
+            return
+        loop, future = entry
+
+        def set_result():
+            if not future.done():
+                future.set_result(result)
+
+        loop.call_soon_threadsafe(set_result)
+
+
+def _result(result: Dict[str, Any]) -> Dict[str, Any]:
+    if "error" in result:
+        raise RuntimeError(f"chunk task failed: {result['error']}")
+    return result
+
+
+async def _wait_result(future: asyncio.Future, task: Dict[str, Any], default_timeout: float) -> Dict[str, Any]:
+    """
+    Caller side: wait for a task's result until its deadline (or
+    `default_timeout`), so a queue nobody serves fails instead of hanging
+    """
+    deadline = task.get("deadline")
+    timeout = default_timeout if deadline is None else max(0.0, deadline - time.time())
+    try:
+        return _result(await asyncio.wait_for(future, timeout))
+    except asyncio.TimeoutError:
+        metrics.incr("work_queue_timeouts")
+        raise RuntimeError(f"no result within {timeout:.1f}s (is a worker running?)") from None
+
+
+class ProcessWorkQueue:
+    """
+    Local worker processes fed through a multiprocessing queue. Each process
+    serves up to `concurrency` tasks at once on its own event loop.
+    """
+
+    remote = True
+
+    def __init__(
+        self,
+        workers: int = PAGE_SCAN_QUEUE_WORKERS,
+        concurrency: int = PAGE_SCAN_WORKER_CONCURRENCY,
+        task_timeout: float = DEFAULT_TASK_TIMEOUT,
+    ):
+        self.workers = max(1, workers)
+        self.concurrency = max(1, concurrency)
+        self.task_timeout = task_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = []
+        self._tasks = None
+        self._results = None
+        self._pending = _Pending()
+        self._reader: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._processes:
+                return
+            self._tasks = self._context.Queue()
+            self._results = self._context.Queue()
+            processes = [
+                self._context.Process(
+                    target=_process_worker_main,
+                    args=(self._tasks, self._results, self.concurrency),
+                    daemon=True,
+                )
+                for _ in range(self.workers)
+            ]
+            for process in processes:
+                process.start()
+            self._processes = processes
+            self._reader = threading.Thread(target=self._read_results, daemon=True)
+            self._reader.start()
+            print(f"Page scan queue: started {self.workers} worker processes")
+
+    def _read_results(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                return
+            task_id, result = item
+            self._pending.resolve(task_id, result)
+
+    async def run(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        self._start()
+        task_id = uuid.uuid4().hex
+        future = self._pending.add(task_id)
+        try:
+            self._tasks.put((task_id, task))
+            metrics.incr("work_queue_tasks_submitted")
+            return await _wait_result(future, task, self.task_timeout)
+        finally:
+            self._pending.discard(task_id)
+
+    async def close(self):
+        if not self._processes:
+            return
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.kill()
+        self._results.put(None)
+        self._processes = []
+
+
+def _process_worker_main(tasks, results, concurrency: int):
+    """Entry point of a worker process"""
+    from llm_service import LLMService
+
+    service = LLMService()
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(concurrency)
+        running = set()
+
+        async def handle(task_id, task):
+            try:
+                results.put((task_id, await _run_until_deadline(service.run_chunk_task, task)))
+            finally:
+                slots.release()
+
+        while True:
+            await slots.acquire()
+            item = await loop.run_in_executor(None, tasks.get)
+            if item is None:
+                break
+            job = asyncio.create_task(handle(*item))
+            running.add(job)
+            job.add_done_callback(running.discard)
+        if running:
+            await asyncio.wait(running)
+
+    asyncio.run(serve())
+
+
+class RedisWorkQueue:
+    """
+    Tasks go to a Redis list shared by every worker node; results come back
+    on this API process's reply list and are routed to the waiting request.
+    """
+
+    remote = True
+
+    def __init__(self, url: str, key: str = QUEUE_KEY, task_timeout: float = DEFAULT_TASK_TIMEOUT):
+        self.url = url
+        self.key = key
+        self.task_timeout = task_timeout
+        self.reply_key = f"{key}:reply:{uuid.uuid4().hex}"
+        self._commands = RespClient(url)
+        self._replies = RespClient(url)
+        self._pending = _Pending()
+        self._reader: Optional[asyncio.Task] = None
+
+    async def _read_results(self):
+        while True:
+            try:
+                item = await self._replies.execute("BRPOP", self.reply_key, POLL_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Page scan queue: reply read failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            if item is None:
+                continue
+            reply = json.loads(item[1])
+            self._pending.resolve(reply["id"], reply["result"])
+
+    async def run(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read_results())
+        task_id = uuid.uuid4().hex
+        future = self._pending.add(task_id)
+        try:
+            await self._commands.execute(
+                "LPUSH",
+                self.key,
+                json.dumps({"id": task_id, "reply": self.reply_key, "task": task}),
+            )
+            metrics.incr("work_queue_tasks_submitted")
+            return await _wait_result(future, task, self.task_timeout)
+        finally:
+            self._pending.discard(task_id)
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+        self._commands.close()
+        self._replies.close()
+
+
+async def serve_redis(url: str, key: str = QUEUE_KEY, concurrency: int = PAGE_SCAN_WORKER_CONCURRENCY):
+    """Worker node: pop chunk tasks from Redis and push their results back"""
+    from llm_service import LLMService
+
+    service = LLMService()
+    tasks = RespClient(url)
+    replies = RespClient(url)
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+    print(f"Page scan worker: serving {key} at {url}")
+
+    async def handle(message: Dict[str, Any]):
+        try:
+            result = await _run_until_deadline(service.run_chunk_task, message["task"])
+            reply = json.dumps({"id": message["id"], "result": result})
+            await replies.execute("LPUSH", message["reply"], reply)
+            await replies.execute("EXPIRE", message["reply"], REPLY_TTL_SECONDS)
+        except Exception as e:
+            print(f"Page scan worker: could not reply: {e}")
+        finally:
+            slots.release()
+
+    while True:
+        await slots.acquire()
+        item = await tasks.execute("BRPOP", key, POLL_SECONDS)
+        if item is None:
+            slots.release()
+            continue
+        job = asyncio.create_task(handle(json.loads(item[1])))
+        running.add(job)
+        job.add_done_callback(running.discard)
+
+
+def create_work_queue(spec: str, handler: TaskHandler, task_timeout: float = DEFAULT_TASK_TIMEOUT):
+    """Backend for a PAGE_SCAN_QUEUE value"""
+    if spec.startswith("redis://"):
+        return RedisWorkQueue(spec, task_timeout=task_timeout)
+    if spec == "processes":
+        return ProcessWorkQueue(task_timeout=task_timeout)
+    if spec != "inprocess":
+        print(f"Unknown PAGE_SCAN_QUEUE {spec!r}, scanning in-process")
+    return InProcessWorkQueue(handler)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Page scan worker node")
+    parser.add_argument("--redis", default=PAGE_SCAN_QUEUE, help="redis://host:port/db")
+    parser.add_argument("--concurrency", type=int, default=PAGE_SCAN_WORKER_CONCURRENCY)
+    args = parser.parse_args()
+    asyncio.run(serve_redis(args.redis, QUEUE_KEY, args.concurrency))